@@ -1,14 +1,21 @@
 #!/usr/bin/env python3
 
 import sys
+import os.path
 import configparser
 from inspiderweb.log import logcontrol, logger
 from inspiderweb.database import Database
-from inspiderweb.dotgraph import DotGraph
 from inspiderweb.recidextractor import get_recid_from_queries, \
     get_recids_from_bibkey_paths, get_recids_from_url_paths, \
-    get_recids_from_recid_paths
+    get_recids_from_recid_paths, Manifest
 from inspiderweb.cli import cli_parser, get_plot_connections
+from inspiderweb.plot import make_graph, write_parts
+from inspiderweb import storage
+from inspiderweb import planner
+from inspiderweb.workqueue import WorkQueue, run_worker
+from inspiderweb.server import serve
+from inspiderweb.batch import run_batch
+from inspiderweb.dumpimport import import_dumps
 
 """ Main file of inspiderweb: Tool to analyze paper reference networks.
 Currently hosted at: https://github.com/klieret/inspiderweb
@@ -23,10 +30,14 @@ print(args.plot)
 logcontrol.set_verbosity_from_argparse(args.verbosity)
 
 # fixme: add tests again
-if args.plot and not args.output:
+if (args.plot or args.path or args.ego is not None) and not args.output:
     logger.critical("We need output filename to plot. Exiting.")
     sys.exit(20)
 
+if args.split == "years" and args.sliceyears < 1:
+    logger.critical("--sliceyears must be at least 1. Exiting.")
+    sys.exit(28)
+
 # todo: maybe use a proper format to save the record data or at least allow ...
 # .... to export into such
 # todo: add clusters
@@ -34,30 +45,153 @@ if args.plot and not args.output:
 
 # fixme: Restore .travis to specific tests again.
 
-db = Database(args.database[0])
-db.load(args.database)
-db.statistics()
+if args.worker:
+    if not args.queue:
+        logger.critical("We need a work queue (--queue) to run as a worker. "
+                        "Exiting.")
+        sys.exit(24)
+    run_worker(args.queue)
+    sys.exit(0)
+
+if not args.database:
+    logger.critical("We need a database (--database). Exiting.")
+    sys.exit(23)
+
+if args.shards and os.path.isfile(args.database[0]):
+    logger.critical("Can't save the database {} in shards, as it is a file. "
+                    "Please give the path of a directory.".format(
+                        args.database[0]))
+    sys.exit(21)
+
+if args.depth is not None and not (os.path.isfile(args.database[0]) and
+                                   storage.is_indexed(args.database[0])):
+    logger.critical("Can't load the neighbourhood of the seeds from {}, as "
+                    "it is not an indexed database.".format(args.database[0]))
+    sys.exit(22)
+
+db = Database(args.database[0], shards=args.shards,
+              processes=args.processes)
+db.compression = args.compression
+db.crawl_memory = args.crawlmemory
+db.crawl_min_citations = args.mincitations
+db.background_saves = args.backgroundsave
+if args.queue:
+    db.work_queue = WorkQueue(args.queue)
+if args.depth is None:
+    db.load(args.database)
+    db.report_merge_conflicts(args.conflicts)
+    db.statistics()
+else:
+    if len(args.database) > 1:
+        logger.warning("Ignoring all but the first database, as --depth "
+                       "was given.")
+    db.load_meta()
+
+if args.importdump:
+    import_dumps(db, args.importdump, processes=args.processes,
+                 complete=args.fulldump)
+    db.statistics()
+
+if args.serve:
+    config = configparser.ConfigParser()
+    config.read(args.config)
+    serve(db, config["dotgraph"], args.serve, host=args.host)
+    sys.exit(0)
 
 # get recids
+manifest = None
+if args.recidpaths or args.bibkeypaths or args.urlpaths or args.batch:
+    manifest = Manifest(args.manifest or args.database[0] + ".manifest",
+                        read_only=args.dryrun)
 recids = set()
 recids.update(get_recid_from_queries(args.queries, db=db))
-recids.update(get_recids_from_bibkey_paths(args.bibkeypaths, db=db))
-recids.update(get_recids_from_recid_paths(args.recidpaths))
-recids.update(get_recids_from_url_paths(args.urlpaths))
+recids.update(get_recids_from_bibkey_paths(args.bibkeypaths, db=db,
+                                           processes=args.processes,
+                                           manifest=manifest))
+recids.update(get_recids_from_recid_paths(args.recidpaths,
+                                          processes=args.processes,
+                                          manifest=manifest))
+recids.update(get_recids_from_url_paths(args.urlpaths,
+                                        processes=args.processes,
+                                        manifest=manifest))
+
+if args.depth is not None:
+    db.load_neighbourhood(recids, args.depth)
+    db.statistics()
+
+if args.dryrun:
+    planner.report(planner.estimate_updates(db, args.get, recids,
+                                            force=args.forceupdate))
+    sys.exit(0)
 
 db.autocomplete_records(args.get, force=args.forceupdate, recids=recids)
 
+if args.cocitations:
+    db.compute_cocitations(top_k=args.cocitations)
+
 if args.labels:
     db.get_labels_from_file(args.labels)
 
-if args.plot:
+if args.batch:
+    config = configparser.ConfigParser()
+    config.read(args.config)
+    run_batch(db, config["dotgraph"], args.batch, processes=args.processes,
+              manifest=manifest)
+
+if args.components:
+    components = db.connected_components()
+    logger.info("{} connected components, the largest ones have {} "
+                "records.".format(len(components), ", ".join(
+                    str(len(component)) for component in components[:10])))
+    for number, component in enumerate(components):
+        if component & recids:
+            logger.info("Component {} ({} records) contains the seeds "
+                        "{}.".format(number, len(component),
+                                     ", ".join(sorted(component & recids))))
+
+# connections from the graph queries (--path, --ego)
+query_connections = None
+if args.path:
+    paths = db.shortest_paths(args.path[0], args.path[1], k=args.paths,
+                              directed=args.directed)
+    if not paths:
+        logger.warning("No path from {} to {}.".format(*args.path))
+    for path in paths:
+        logger.info("Path of length {}: {}".format(len(path) - 1,
+                                                    " - ".join(path)))
+    query_connections = db.path_connections(paths)
+if args.ego is not None:
+    query_connections = query_connections or set()
+    query_connections |= db.induced_connections(
+        db.ego_network(recids, args.ego))
+
+if args.plot or query_connections is not None:
 
     config = configparser.ConfigParser()
     config.read(args.config)
 
-    dg = DotGraph(db, config["dotgraph"])
-    dg.add_connections(get_plot_connections(args.plot, recids, db))
-    dg.generate_dot_str(rank=args.rank)
-    dg.write_to_file(args.output)
+    connections = None
+    if query_connections is not None:
+        connections = query_connections
+        if args.plot:
+            connections |= get_plot_connections(args.plot, recids, db)
+
+    options = dict(output_format=args.format, rank=args.rank,
+                   transitive=args.transitive, kcore=args.kcore,
+                   top=args.top, top_by=args.topby,
+                   centrality=args.centrality,
+                   min_centrality=args.mincentrality,
+                   connections=connections,
+                   communities=args.communities, collapse=args.collapse)
+    if args.split:
+        paths = write_parts(db, config["dotgraph"], args.plot, recids,
+                            args.output, split=args.split,
+                            slice_years=args.sliceyears,
+                            processes=args.processes, **options)
+        logger.info("Wrote {} files, index: {}".format(len(paths) - 1,
+                                                       paths[-1]))
+    else:
+        dg = make_graph(db, config["dotgraph"], args.plot, recids, **options)
+        dg.write_to_file(args.output)
 
 db.save()
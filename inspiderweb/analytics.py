@@ -0,0 +1,242 @@
+import collections
+from array import array
+from typing import Dict, Tuple, Iterable
+from .log import logger
+
+""" Part of inspiderweb: Tool to analyze paper reference networks.
+Inspiderweb currently hosted at: https://github.com/klieret/inspiderweb
+
+This file defines the Analytics class which computes importance scores
+of the records in the Database:
+    PageRank, HITS, degrees, k-core numbers, citation counts
+"""
+
+# Names of the scores that can be obtained via Analytics.scores
+measures = ["pagerank", "hubs", "authorities", "indegree", "outdegree",
+            "kcore", "citations"]
+
+
+class Analytics(object):
+    """ Computes centralities on the Graph of a Database. All results are
+    cached until the database changes (i.e. until db.version changes).
+    All scores are returned as dictionaries recid: score.
+    """
+    def __init__(self, db):
+        self.db = db
+        self._cache = {}
+        self._cache_version = None
+
+    def _cached(self, key, compute):
+        """ Return the cached result for $key or run $compute() on the
+        current graph and cache it. """
+        if self._cache_version != self.db.version:
+            self._cache = {}
+            self._cache_version = self.db.version
+        if key not in self._cache:
+            self._cache[key] = compute(self.db.get_graph())
+        return self._cache[key]
+
+    def scores(self, measure: str) -> Dict[str, float]:
+        """ Return the scores for one of the names in $measures. """
+        if measure == "pagerank":
+            return self.pagerank()
+        elif measure == "hubs":
+            return self.hits()[0]
+        elif measure == "authorities":
+            return self.hits()[1]
+        elif measure == "indegree":
+            return self.in_degrees()
+        elif measure == "outdegree":
+            return self.out_degrees()
+        elif measure == "kcore":
+            return self.core_numbers()
+        elif measure == "citations":
+            return self.citation_counts()
+        raise ValueError("Unknown measure {}".format(measure))
+
+    def top(self, measure: str, n: int) -> Iterable[str]:
+        """ Return the recids of the $n records with the highest score. """
+        scores = self.scores(measure)
+        return sorted(scores, key=scores.get, reverse=True)[:n]
+
+    def in_degrees(self) -> Dict[str, int]:
+        """ Number of citations of every record. """
+        return self._cached("indegree", lambda graph: {
+            recid: graph.in_degree(node)
+            for node, recid in enumerate(graph.recids)})
+
+    def out_degrees(self) -> Dict[str, int]:
+        """ Number of references of every record. """
+        return self._cached("outdegree", lambda graph: {
+            recid: graph.out_degree(node)
+            for node, recid in enumerate(graph.recids)})
+
+    def citation_counts(self) -> Dict[str, int]:
+        """ Number of citations of every record on inspirehep (see
+        Database.get_citation_counts) or the number of citations in the
+        database if unknown. """
+        def compute(graph):
+            counts = {}
+            for node, recid in enumerate(graph.recids):
+                record = self.db._records.get(recid)
+                if record is not None and record.citation_count >= 0:
+                    counts[recid] = max(record.citation_count,
+                                        graph.in_degree(node))
+                else:
+                    counts[recid] = graph.in_degree(node)
+            return counts
+        return self._cached("citations", compute)
+
+    def degree_distribution(self, direction="in") -> Dict[int, int]:
+        """ Return a dictionary degree: number of records with that degree.
+
+        Args:
+            direction: "in" (citations) or "out" (references)
+        """
+        if direction == "in":
+            degrees = self.in_degrees()
+        elif direction == "out":
+            degrees = self.out_degrees()
+        else:
+            raise ValueError("Unknown direction {}".format(direction))
+        return dict(collections.Counter(degrees.values()))
+
+    def pagerank(self, damping=0.85, tolerance=1e-8,
+                 max_iterations=100) -> Dict[str, float]:
+        """ PageRank of every record (rank flows from the citing record to
+        the referenced record).
+
+        Args:
+            damping: Damping factor
+            tolerance: Stop iterating once the L1 change is smaller.
+            max_iterations: Maximal number of iterations.
+        """
+        return self._cached(
+            ("pagerank", damping, tolerance, max_iterations),
+            lambda graph: _pagerank(graph, damping, tolerance,
+                                    max_iterations))
+
+    def hits(self, tolerance=1e-8,
+             max_iterations=100) -> Tuple[Dict[str, float],
+                                          Dict[str, float]]:
+        """ Hub and authority scores of every record (HITS algorithm).
+        Good hubs reference many good authorities.
+
+        Returns:
+            Two-tuple of dictionaries (hubs, authorities).
+        """
+        return self._cached(("hits", tolerance, max_iterations),
+                            lambda graph: _hits(graph, tolerance,
+                                                max_iterations))
+
+    def core_numbers(self) -> Dict[str, int]:
+        """ k-core number of every record, treating the network as
+        undirected. A record has core number k if it is part of a
+        subnetwork in which every record is connected to at least k other
+        records of that subnetwork. """
+        return self._cached("kcore", _core_numbers)
+
+
+def _pagerank(graph, damping, tolerance, max_iterations) -> Dict[str, float]:
+    n_nodes = len(graph)
+    if not n_nodes:
+        return {}
+    out_degrees = [graph.out_degree(node) for node in range(n_nodes)]
+    dangling = [node for node in range(n_nodes) if not out_degrees[node]]
+    citations = [graph.citations(node) for node in range(n_nodes)]
+    rank = array('d', [1. / n_nodes]) * n_nodes
+    for iteration in range(max_iterations):
+        contribution = [r / d if d else 0. for r, d in zip(rank, out_degrees)]
+        base = (1. - damping) / n_nodes + \
+            damping * sum(rank[node] for node in dangling) / n_nodes
+        new_rank = array('d', [
+            base + damping * sum(map(contribution.__getitem__, citing))
+            for citing in citations])
+        change = sum(abs(a - b) for a, b in zip(rank, new_rank))
+        rank = new_rank
+        if change < tolerance:
+            logger.debug("PageRank converged after {} iterations.".format(
+                iteration + 1))
+            break
+    else:
+        logger.warning("PageRank did not converge after {} "
+                       "iterations.".format(max_iterations))
+    return dict(zip(graph.recids, rank))
+
+
+def _hits(graph, tolerance, max_iterations):
+    n_nodes = len(graph)
+    if not n_nodes:
+        return {}, {}
+    references = [graph.references(node) for node in range(n_nodes)]
+    citations = [graph.citations(node) for node in range(n_nodes)]
+    hubs = [1.] * n_nodes
+    authorities = [1.] * n_nodes
+    for iteration in range(max_iterations):
+        new_authorities = _normalized(
+            [sum(map(hubs.__getitem__, citing)) for citing in citations])
+        new_hubs = _normalized(
+            [sum(map(new_authorities.__getitem__, referenced))
+             for referenced in references])
+        change = sum(abs(a - b) for a, b in zip(hubs, new_hubs))
+        hubs, authorities = new_hubs, new_authorities
+        if change < tolerance:
+            break
+    return dict(zip(graph.recids, hubs)), dict(zip(graph.recids, authorities))
+
+
+def _normalized(values):
+    norm = max(values)
+    if not norm:
+        return values
+    return [value / norm for value in values]
+
+
+def _core_numbers(graph) -> Dict[str, int]:
+    """ Bucket algorithm of Batagelj and Zaversnik, O(number of edges). """
+    n_nodes = len(graph)
+    neighbours = [set(graph.references(node)) | set(graph.citations(node))
+                  for node in range(n_nodes)]
+    degree = [len(n) for n in neighbours]
+    # nodes sorted by degree together with the position of every node
+    # and the start of every degree bin
+    order = sorted(range(n_nodes), key=degree.__getitem__)
+    position = [0] * n_nodes
+    for pos, node in enumerate(order):
+        position[node] = pos
+    bin_start = {}
+    for pos in reversed(range(n_nodes)):
+        bin_start[degree[order[pos]]] = pos
+    for node in order:
+        for other in neighbours[node]:
+            if degree[other] > degree[node]:
+                # move $other to the front of its bin, then shrink its
+                # degree by one
+                other_degree = degree[other]
+                pos_other = position[other]
+                pos_swap = bin_start[other_degree]
+                swap = order[pos_swap]
+                if swap != other:
+                    order[pos_other], order[pos_swap] = swap, other
+                    position[other], position[swap] = pos_swap, pos_other
+                bin_start[other_degree] += 1
+                bin_start.setdefault(other_degree - 1, pos_swap)
+                degree[other] -= 1
+    return dict(zip(graph.recids, degree))
+
+
+def filter_connections(connections: set, scores: Dict[str, float],
+                       min_score: float) -> set:
+    """ Only keep the connections between records that have a score of at
+    least $min_score.
+
+    Args:
+        connections: set of two-tuples of recids
+        scores: dictionary recid: score (e.g. from Analytics.scores)
+        min_score: minimal score
+    Returns:
+        set of two-tuples of recids
+    """
+    return {(source, target) for source, target in connections
+            if scores.get(source, 0) >= min_score and
+            scores.get(target, 0) >= min_score}
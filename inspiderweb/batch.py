@@ -0,0 +1,179 @@
+import sys
+import os.path
+import configparser
+from typing import Dict, List
+from .plot import make_graph, formats
+from .parallel import fork_map
+from .cli import get_plot_connections
+from .recidextractor import get_recid_from_queries, \
+    get_recids_from_bibkey_paths, get_recids_from_url_paths, \
+    get_recids_from_recid_paths
+from .log import logger
+
+""" Part of inspiderweb: Tool to analyze paper reference networks.
+Inspiderweb currently hosted at: https://github.com/klieret/inspiderweb
+
+This file implements batch jobs: Many plots from one loaded database
+(inspiderweb.py --batch FILE). The job file is an ini file with one
+section per job, e.g.
+
+    [DEFAULT]
+    rank = year
+
+    [author_a]
+    bibkeypaths = seeds/author_a.tex
+    plot = s-s s.r-s
+    output = plots/author_a.dot
+
+    [author_a_svg]
+    bibkeypaths = seeds/author_a.tex
+    plot = s-s s.r-s
+    output = plots/author_a.svg
+    format = svg
+
+Options of a job (lists are separated by whitespace):
+    recids, recidpaths, bibkeypaths, urlpaths, queries (one query per line):
+        seeds (like the command line options of the same names)
+    plot: plot rules (like --plot, default: seeds-seeds)
+    output: output file (required)
+    format, rank, transitive, kcore, top, topby, centrality, mincentrality,
+    communities, collapse:
+        like the command line options of the same names
+Jobs with the same seeds and plot rules share the selected connections.
+The plots are generated in parallel in several processes (where fork is
+available), which all share the loaded database.
+"""
+
+_list_options = ["recids", "recidpaths", "bibkeypaths", "urlpaths", "plot"]
+
+# The database of the batch, inherited by the worker processes
+_batch_db = None
+_batch_config = None
+
+
+def read_jobs(path: str) -> List[Dict]:
+    """ Read the job file at $path.
+
+    Returns:
+        List of dictionaries (one per job, with the options as keys).
+    """
+    parser = configparser.ConfigParser(interpolation=None)
+    if not parser.read(path):
+        logger.critical("Could not read batch file {}. Exiting.".format(path))
+        sys.exit(25)
+    jobs = []
+    for name in parser.sections():
+        section = parser[name]
+        job = {"name": name}
+        for option in _list_options:
+            job[option] = section.get(option, "").split()
+        job["queries"] = [query.strip() for query in
+                          section.get("queries", "").splitlines()
+                          if query.strip()]
+        job["plot"] = job["plot"] or ["seeds-seeds"]
+        job["output"] = section.get("output", "")
+        job["format"] = section.get("format", "dot")
+        job["rank"] = section.get("rank", "")
+        job["transitive"] = section.getboolean("transitive", False)
+        job["kcore"] = section.getint("kcore", 0)
+        job["top"] = section.getint("top", 0)
+        job["topby"] = section.get("topby", "indegree")
+        job["centrality"] = section.get("centrality", "")
+        job["mincentrality"] = section.getfloat("mincentrality", None)
+        job["communities"] = section.getboolean("communities", False)
+        job["collapse"] = section.getboolean("collapse", False)
+        if not job["output"]:
+            logger.critical("Job {} in {} has no output. "
+                            "Exiting.".format(name, path))
+            sys.exit(26)
+        if job["format"] not in formats:
+            logger.critical("Job {} in {} has unknown format {}. "
+                            "Exiting.".format(name, path, job["format"]))
+            sys.exit(27)
+        jobs.append(job)
+    return jobs
+
+
+def _run_jobs(jobs: List[Dict], seeds: frozenset) -> List[str]:
+    """ Run jobs which share seeds and plot rules in a worker process.
+    Returns the paths of the written files. """
+    connections = get_plot_connections(jobs[0]["plot"], seeds, _batch_db)
+    outputs = []
+    for job in jobs:
+        dg = make_graph(_batch_db, _batch_config, job["plot"], seeds,
+                        output_format=job["format"], rank=job["rank"],
+                        transitive=job["transitive"], kcore=job["kcore"],
+                        top=job["top"], top_by=job["topby"],
+                        centrality=job["centrality"],
+                        min_centrality=job["mincentrality"],
+                        connections=set(connections),
+                        communities=job["communities"],
+                        collapse=job["collapse"])
+        output_dir = os.path.dirname(job["output"])
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        dg.write_to_file(job["output"])
+        logger.info("Job {}: Wrote {}.".format(job["name"], job["output"]))
+        outputs.append(job["output"])
+    return outputs
+
+
+def run_batch(db, config, path: str, processes=1, manifest=None) -> \
+        List[str]:
+    """ Run all jobs of the job file at $path.
+
+    Args:
+        db: Database (only read)
+        config: "dotgraph" section of the configuration
+        path: Path of the job file
+        processes: Number of processes to generate the plots in
+        manifest: recidextractor.Manifest for the seed files
+    Returns:
+        List of the paths of the written files.
+    """
+    global _batch_db, _batch_config
+    jobs = read_jobs(path)
+    logger.info("Running {} jobs from {}.".format(len(jobs), path))
+
+    # 1. seeds (identical seed definitions are only resolved once)
+    seed_cache = {}
+    groups = {}
+    for job in jobs:
+        key = tuple(tuple(job[option]) for option in
+                    ["recids", "recidpaths", "bibkeypaths", "urlpaths",
+                     "queries"])
+        if key not in seed_cache:
+            seeds = set(job["recids"])
+            seeds.update(get_recid_from_queries(job["queries"], db=db))
+            seeds.update(get_recids_from_bibkey_paths(
+                job["bibkeypaths"], db=db, processes=processes,
+                manifest=manifest))
+            seeds.update(get_recids_from_recid_paths(
+                job["recidpaths"], processes=processes, manifest=manifest))
+            seeds.update(get_recids_from_url_paths(
+                job["urlpaths"], processes=processes, manifest=manifest))
+            seed_cache[key] = frozenset(seeds)
+        seeds = seed_cache[key]
+        groups.setdefault((seeds, tuple(job["plot"])), []).append(job)
+
+    # 2. compute everything that is shared before the processes are forked
+    for job in jobs:
+        for measure in [job["centrality"], job["top"] and job["topby"]]:
+            if measure:
+                db.analytics.scores(measure)
+    if any("@" in rule for job in jobs for rule in job["plot"]):
+        db.get_recids_by_year()
+
+    # 3. plots
+    _batch_db = db
+    _batch_config = config
+    outputs = []
+    try:
+        for group_outputs in fork_map(
+                _run_jobs, [(group_jobs, seeds) for (seeds, rules), group_jobs
+                            in groups.items()], processes=processes):
+            outputs.extend(group_outputs)
+    finally:
+        _batch_db = None
+        _batch_config = None
+    return outputs
@@ -1,7 +1,8 @@
 import argparse
 from argparse import RawDescriptionHelpFormatter
 from .log import logger
-from typing import Iterable
+from .analytics import measures
+from typing import Dict, Iterable, Tuple
 import sys
 
 description = r"""
@@ -34,13 +35,18 @@ action_options = cli_parser.add_argument_group('Action Options',
 misc_options = cli_parser.add_argument_group('Additional Options',
                                          'Further Configuration...')
 
-setup_options.add_argument("-d", "--database", required=True,
+setup_options.add_argument("-d", "--database", required=False,
                            help="Pickle database (db) file. Multiple db files "
                                 "are supported. In this case the first one "
-                                "will be used to save the resulting merged db",
+                                "will be used to save the resulting merged db. "
+                                "Directories are sharded dbs (see --shards), "
+                                "files ending with .sqlite are indexed dbs "
+                                "(see --depth), files ending with .compact "
+                                "are compressed dbs (see --compression).",
                            type=str, nargs="+")
 setup_options.add_argument("-o", "--output", required=False,
-                           help="Output dot file.",
+                           help="Output dot file (or svg file, see "
+                                "--format).",
                            type=str)
 setup_options.add_argument("-r", "--recidpaths", required=False,
                            help="Path of a file or a directory. Multiple paths"
@@ -101,7 +107,10 @@ plot_help = "Generate dot output (i.e. plot). If you do not specify an " \
             "being cited by a seed or citing a seed are valid starting points"\
             "of an arrow. Short options: s (seeds), a (all), r (refs), c " \
             "(cites). For 'refscites', the following alias exist: " \
-            "'citesrefs', 'cr', 'rc'. "
+            "'citesrefs', 'cr', 'rc'. Every selection can be restricted " \
+            "to a range of publication years by appending '@first:last', " \
+            "e.g. 'seeds.refs@1990:2000-seeds' or 'all@2010:-all' (both " \
+            "years are included, leave one out for an open range). "
 
 action_options.add_argument("-p", "--plot", required=False,
                             help=plot_help,
@@ -109,6 +118,59 @@ action_options.add_argument("-p", "--plot", required=False,
                             action="append",
                             const="seeds-seeds",
                             nargs="?")
+action_options.add_argument("--communities", required=False,
+                            action="store_true",
+                            help="Detect communities among the plotted "
+                                 "records and draw them as labeled "
+                                 "clusters.",
+                            default=False)
+action_options.add_argument("--collapse", required=False,
+                            action="store_true",
+                            help="Detect communities among the plotted "
+                                 "records and draw each of them as one "
+                                 "node.",
+                            default=False)
+action_options.add_argument("--split", required=False, type=str,
+                            help="Split the plot into several files that "
+                                 "can be rendered independently: one per "
+                                 "connected component ('components') or "
+                                 "one per --sliceyears years of "
+                                 "publication of the citing records "
+                                 "('years'). The files are written in "
+                                 "parallel with --processes processes and "
+                                 "listed in the index file OUTPUT.index.csv.",
+                            choices=["components", "years"], default="")
+action_options.add_argument("--sliceyears", required=False, type=int,
+                            help="Number of years per file for --split "
+                                 "years. Default: 10",
+                            default=10)
+action_options.add_argument("--path", required=False, type=str, nargs=2,
+                            metavar=("FROM", "TO"),
+                            help="Plot the shortest path(s) between two "
+                                 "recids (in addition to --plot). See also "
+                                 "--paths and --directed.",
+                            default=None)
+action_options.add_argument("--paths", required=False, type=int,
+                            help="Number of shortest paths for --path. "
+                                 "Default: 1",
+                            default=1)
+action_options.add_argument("--directed", required=False,
+                            action="store_true",
+                            help="Only follow references from FROM to TO "
+                                 "for --path (default: references and "
+                                 "citations).",
+                            default=False)
+action_options.add_argument("--ego", required=False, type=int,
+                            help="Plot all records that are at most EGO "
+                                 "references or citations away from the "
+                                 "seeds (in addition to --plot).",
+                            default=None)
+action_options.add_argument("--components", required=False,
+                            action="store_true",
+                            help="Print the sizes of the connected "
+                                 "components of the citation network and "
+                                 "which ones contain the seeds.",
+                            default=False)
 
 update_help = "Download information. Multiple arguments are supported. " \
               "Each argument must look like this: Starts with 'seeds' or " \
@@ -123,7 +185,10 @@ update_help = "Download information. Multiple arguments are supported. " \
               "These options can be chained, e.g. seeds.refs.cites means " \
               "1. For each seed recid, get all reference "\
               "2. For all of the above, get all citations. " \
-              "Similarly one could have written 's.r.c'. "
+              "Similarly one could have written 's.r.c'. " \
+              "(4) 'counts' (short 'n'): Only the number of citations of " \
+              "each recid (many recids per request, e.g. for " \
+              "--centrality citations), e.g. 'seeds.refs.counts'. "
 
 action_options.add_argument("-g", "--get", required=False,
                             help=update_help,
@@ -142,6 +207,162 @@ misc_options.add_argument("-l", "--labels",
                                "message (which should have the same effect "
                                "in most cases).",
                           required=False, type=str)
+misc_options.add_argument("--cocitations", required=False, type=int,
+                          help="Compute co-citations and bibliographic "
+                               "couplings from the references and citations "
+                               "in the database and keep the strongest "
+                               "COCITATIONS neighbours for every record. "
+                               "Nothing is downloaded for this.",
+                          default=0)
+misc_options.add_argument("--centrality", required=False, type=str,
+                          help="Scale the nodes of the plot according to "
+                               "this importance score.",
+                          choices=measures, default="")
+misc_options.add_argument("--mincentrality", required=False, type=float,
+                          help="Only plot connections between records whose "
+                               "score (as given by --centrality) is at least "
+                               "this large.",
+                          default=None)
+misc_options.add_argument("--transitive", action="store_true",
+                          help="Reduce the plot: Remove all connections "
+                               "a -> c that are implied by a path "
+                               "a -> b -> ... -> c.")
+misc_options.add_argument("--kcore", required=False, type=int,
+                          help="Reduce the plot: Only keep nodes that are "
+                               "part of the KCORE-core of the plotted "
+                               "network.",
+                          default=0)
+misc_options.add_argument("--top", required=False, type=int,
+                          help="Reduce the plot: Only keep the TOP nodes with "
+                               "the highest score (see --topby).",
+                          default=0)
+misc_options.add_argument("--topby", required=False, type=str,
+                          help="Score for --top. Default: indegree (i.e. "
+                               "number of citations in the database).",
+                          choices=measures, default="indegree")
+misc_options.add_argument("--format", required=False, type=str,
+                          help="Output format. 'dot' (default) writes the "
+                               "graph in dot language to be layed out by "
+                               "graphviz, 'svg' lays out the graph with a "
+                               "built-in force directed layout and directly "
+                               "writes an svg image with clickable nodes.",
+                          choices=["dot", "svg"], default="dot")
+misc_options.add_argument("--processes", required=False, type=int,
+                          help="Number of processes used to scan the files "
+                               "given by --recidpaths, --bibkeypaths and "
+                               "--urlpaths for seeds, to write sharded "
+                               "databases, to merge several sharded "
+                               "databases shard by shard and to write the "
+                               "files of --split. Default: 1",
+                          default=1)
+misc_options.add_argument("--manifest", required=False, type=str,
+                          help="Json file in which we remember which files "
+                               "were already scanned for seeds (and which "
+                               "seeds we found), so that unchanged files "
+                               "are skipped. Only written if seed files "
+                               "were scanned (and not with --dryrun). "
+                               "Default: Path of the first database with "
+                               "'.manifest' appended.",
+                          default="")
+misc_options.add_argument("--shards", required=False, type=int,
+                          help="Save the database in this many shard files "
+                               "in the directory given by the first "
+                               "--database path instead of one pickle "
+                               "file. Only shards with changed records are "
+                               "written (with --processes processes). The "
+                               "shards of one database are read in "
+                               "parallel, but unpickled in one process. "
+                               "Directories are always treated as sharded "
+                               "databases.",
+                          default=0)
+misc_options.add_argument("--depth", required=False, type=int,
+                          help="Only load the records which are at most "
+                               "DEPTH references or citations away from the "
+                               "seeds (e.g. 1 to plot s.r-s). Requires an "
+                               "indexed db (path ending with .sqlite) as "
+                               "first --database, further dbs are ignored.",
+                          default=None)
+misc_options.add_argument("--compression", required=False, type=str,
+                          help="Compression of compact dbs (saved if the "
+                               "path of the first --database ends with "
+                               ".compact). Default: zlib",
+                          choices=["zlib", "lzma"], default="zlib")
+misc_options.add_argument("--crawlmemory", required=False, type=int,
+                          help="When downloading (--get), keep at most this "
+                               "many recids per step in memory and write "
+                               "the rest to temporary files. Default: 0 (no "
+                               "limit)",
+                          default=0)
+misc_options.add_argument("--dryrun", required=False, action="store_true",
+                          help="Don't download anything for --get, but "
+                               "estimate how many queries and downloads it "
+                               "would take (from what is in the database "
+                               "already, see also the 'counts' option of "
+                               "--get) and exit without saving the "
+                               "database.",
+                          default=False)
+misc_options.add_argument("--mincitations", required=False, type=int,
+                          help="When downloading citations (--get), first "
+                               "download the citation counts (many records "
+                               "per request) and only download the "
+                               "citations of records with at least this "
+                               "many citations. Default: 0 (all)",
+                          default=0)
+misc_options.add_argument("--queue", required=False, type=str,
+                          help="Work queue (sqlite file, e.g. on a shared "
+                               "file system). Let the workers (see --worker) "
+                               "download the references and citations "
+                               "requested by --get and merge their results "
+                               "into the database.",
+                          default="")
+misc_options.add_argument("--worker", required=False, action="store_true",
+                          help="Run as a worker: Download the references "
+                               "and citations requested in the work queue "
+                               "given by --queue until interrupted. Doesn't "
+                               "need a --database.",
+                          default=False)
+misc_options.add_argument("--backgroundsave", required=False,
+                          action="store_true",
+                          help="While downloading, save the database in a "
+                               "background process, so that the downloads "
+                               "don't have to wait.",
+                          default=False)
+misc_options.add_argument("--serve", required=False, type=int,
+                          help="Keep the database loaded and answer requests "
+                               "(seeds, downloads, connections, plots) on "
+                               "this port until interrupted. See "
+                               "inspiderweb/server.py for the endpoints.",
+                          default=0)
+misc_options.add_argument("--host", required=False, type=str,
+                          help="Host to serve on (see --serve). Default: "
+                               "127.0.0.1 (only local connections)",
+                          default="127.0.0.1")
+misc_options.add_argument("--batch", required=False, type=str,
+                          help="Ini file with several plot jobs (seeds, plot "
+                               "rules, output, ...) that are run against "
+                               "the loaded database with --processes "
+                               "processes. See inspiderweb/batch.py for the "
+                               "format.",
+                          default="")
+misc_options.add_argument("--importdump", required=False, type=str,
+                          nargs="+",
+                          help="Import these dumps of inspirehep literature "
+                               "records (json, one record per line, "
+                               "optionally gzipped) into the database, "
+                               "parsing them with --processes processes.",
+                          default=[])
+misc_options.add_argument("--fulldump", required=False, action="store_true",
+                          help="The dumps given by --importdump contain all "
+                               "records of inspirehep, so that the "
+                               "citations derived from them are complete "
+                               "and don't have to be downloaded.",
+                          default=False)
+misc_options.add_argument("--conflicts", required=False, type=str,
+                          help="When merging several databases (--database "
+                               "with several paths), write the records with "
+                               "conflicting bibkeys to this csv file. The "
+                               "value of the first database is kept.",
+                          default="")
 misc_options.add_argument("-h", "--help",
                           help="Print this help message.", action="help")
 misc_options.add_argument("--rank", required=False,
@@ -168,12 +389,53 @@ misc_options.add_argument("-v" "--verbosity", required=False, type=str,
                           default="debug", dest="verbosity")
 
 
-def should_plot_node(recid: str, rule: str, seeds: Iterable[str], db) -> bool:
+def parse_year_range(year_range: str) -> Tuple[int, int]:
+    """ Parse a year range of the form 'first:last', 'first:', ':last' or
+    'year' and return it as a two-tuple of years, where 0 means that there
+    is no limit. """
+    first, sep, last = year_range.partition(":")
+    try:
+        first = int(first) if first else 0
+        last = int(last) if last else 0
+    except ValueError:
+        logger.critical("Wrong syntax: '{}' is not a year range of the "
+                        "form first:last.".format(year_range))
+        sys.exit(62)
+    if not sep:
+        last = first
+    return first, last
+
+
+def get_year_filters(rules: Iterable[str], db) -> Dict[str, set]:
+    """ Return a dictionary year range: recids published in these years
+    for all year ranges ('@first:last') of the plot rules $rules, so that
+    every range is only parsed and looked up once. """
+    year_filters = {}
+    for rule in rules:
+        for node_rule in rule.split("-"):
+            year_range = node_rule.partition("@")[2]
+            if year_range and year_range not in year_filters:
+                year_filters[year_range] = db.get_recids_in_years(
+                    *parse_year_range(year_range))
+    return year_filters
+
+
+def should_plot_node(recid: str, rule: str, seeds: Iterable[str], db,
+                     year_filters=None) -> bool:
     """ Based on the rule $rule and the seeds $seeds that were given as
     parameters, return True if the recid $recid is of interest for us.
     E.g. if the rule is "all.refs", return true if the recid is referenced
-    by any paper in the database. See the documentation of the command
-    line arguments for more on this syntax. """
+    by any paper in the database. If the rule ends with "@first:last",
+    the record also needs to be published in between those years
+    ($year_filters: see get_year_filters, computed if not given).
+    See the documentation of the command line arguments for more on this
+    syntax. """
+    rule, _, year_range = rule.partition("@")
+    if year_range:
+        if year_filters is None or year_range not in year_filters:
+            year_filters = get_year_filters(["@" + year_range], db)
+        if recid not in year_filters[year_range]:
+            return False
     steps = rule.split('.')
     if len(steps) == 1:
         if steps[0] in ["all", "a"]:
@@ -231,14 +493,16 @@ def should_plot_node(recid: str, rule: str, seeds: Iterable[str], db) -> bool:
 
 def should_plot_connection(source_recid: str, target_recid: str,
                            rules: Iterable[str],
-                           seeds: Iterable[str], db) -> bool:
+                           seeds: Iterable[str], db,
+                           year_filters=None) -> bool:
     """ Based on the rules $rules and the seeds $seeds that were given as
     parameters, return True if the connection $source_recid >  $target_recid
     should be plotted.
     E.g. for the rules ["seeds.refs > seeds", "seeds>all"], return True for all
     connections of references of seeds to the seeds and any connection of the
     seeds to anything.
-    See the command line arguments for more information. """
+    See the command line arguments for more information. $year_filters:
+    see should_plot_node. """
     for rule in rules:
         try:
             source_rule, target_rule = rule.split('-')
@@ -251,8 +515,10 @@ def should_plot_connection(source_recid: str, target_recid: str,
             # have to exit, because else there will be thousands of these
             # errors.
             sys.exit(58)
-        if should_plot_node(source_recid, source_rule, seeds, db) and \
-                should_plot_node(target_recid, target_rule, seeds, db):
+        if should_plot_node(source_recid, source_rule, seeds, db,
+                            year_filters) and \
+                should_plot_node(target_recid, target_rule, seeds, db,
+                                 year_filters):
             # logger.debug("adding connection.")
             return True
 
@@ -277,14 +543,15 @@ def get_plot_connections(rules: Iterable[str], seeds: Iterable[str],
     logger.debug("Getting plot connections for "
                  "rules {}".format(', '.join(rules)))
     connections = set()
+    year_filters = get_year_filters(rules, db)
     for recid, record in db._records.items():
         for reference_recid in record.references:
             if should_plot_connection(recid, reference_recid, rules,
-                                          seeds, db):
+                                      seeds, db, year_filters):
                 connections.add((record.recid, reference_recid))
         for citation_recid in record.citations:
             if should_plot_connection(citation_recid, recid, rules,
-                                          seeds, db):
+                                      seeds, db, year_filters):
                 connections.add((citation_recid, record.recid))
     # print(connections)
     return connections
@@ -0,0 +1,112 @@
+import random
+import collections
+from typing import Iterable, List, Set, Tuple
+from .graph import Graph
+
+""" Part of inspiderweb: Tool to analyze paper reference networks.
+Inspiderweb currently hosted at: https://github.com/klieret/inspiderweb
+
+This file implements community detection on the plotted connections
+(label propagation), so that the communities can be drawn as clusters of
+the DotGraph or collapsed into one node each.
+"""
+
+
+def label_propagation(graph: Graph, max_iterations=20, seed=0) -> List[int]:
+    """ Every node starts with its own label and then repeatedly takes the
+    label that is most common among its neighbours (ignoring the direction
+    of the citations), until no label changes any more. Ties are broken
+    in favour of the current label, otherwise at random, so the result
+    only depends on $seed (which determines the order in which the nodes
+    are visited and the ties are broken).
+
+    Args:
+        graph: Graph
+        max_iterations: Maximal number of passes over all nodes
+        seed: Seed for the order of the nodes
+    Returns:
+        List mapping every node index to its community (numbered by
+        decreasing size).
+    """
+    n_nodes = len(graph)
+    labels = list(range(n_nodes))
+    order = list(range(n_nodes))
+    rng = random.Random(seed)
+    for iteration in range(max_iterations):
+        rng.shuffle(order)
+        changed = False
+        for node in order:
+            counts = collections.Counter(
+                labels[neighbour] for neighbours in
+                (graph.references(node), graph.citations(node))
+                for neighbour in neighbours)
+            if not counts:
+                continue
+            best = max(counts.values())
+            if counts[labels[node]] == best:
+                continue
+            labels[node] = rng.choice(sorted(
+                label for label, count in counts.items() if count == best))
+            changed = True
+        if not changed:
+            break
+    sizes = collections.Counter(labels)
+    ranked = sorted(sizes, key=lambda label: (-sizes[label], label))
+    renumber = {label: position for position, label in enumerate(ranked)}
+    return [renumber[label] for label in labels]
+
+
+def detect_communities(connections: Iterable[Tuple[str, str]], min_size=2,
+                       seed=0) -> List[Set[str]]:
+    """ Communities of the network formed by the connections.
+
+    Args:
+        connections: Iterable of two-tuples of recids
+        min_size: Only return communities with at least this many records
+        seed: See label_propagation
+    Returns:
+        List of sets of recids, largest first.
+    """
+    # sorted, so that the numbering of the nodes doesn't depend on the
+    # order of $connections
+    graph = Graph.from_connections(sorted(connections))
+    communities = collections.defaultdict(set)
+    for node, label in enumerate(label_propagation(graph, seed=seed)):
+        communities[label].add(graph.recids[node])
+    return [communities[label] for label in sorted(communities)
+            if len(communities[label]) >= min_size]
+
+
+def representative(members: Set[str],
+                   connections: Iterable[Tuple[str, str]]) -> str:
+    """ The member of a community that is cited most often by the other
+    members (smallest recid in case of a tie). """
+    cited = collections.Counter(target for source, target in connections
+                                if source in members and target in members)
+    return min(members, key=lambda recid: (-cited[recid], recid))
+
+
+def collapse(connections: Iterable[Tuple[str, str]],
+             communities: List[Set[str]], node_ids: List[str]) -> set:
+    """ Replace every community by one node.
+
+    Args:
+        connections: Iterable of two-tuples of recids
+        communities: List of sets of recids
+        node_ids: Id of the new node for every community
+    Returns:
+        Set of two-tuples of node ids: Connections between the communities
+        and the records that are not in any community (connections within
+        a community are dropped).
+    """
+    node_of = {}
+    for node_id, members in zip(node_ids, communities):
+        for recid in members:
+            node_of[recid] = node_id
+    collapsed = set()
+    for source, target in connections:
+        source = node_of.get(source, source)
+        target = node_of.get(target, target)
+        if source != target:
+            collapsed.add((source, target))
+    return collapsed
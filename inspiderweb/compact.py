@@ -0,0 +1,304 @@
+import gzip
+import lzma
+import pickle
+import collections
+from typing import Dict, Iterator, Tuple
+from .record import Record
+from .log import logger
+from .storage import atomic_write
+
+""" Part of inspiderweb: Tool to analyze paper reference networks.
+Inspiderweb currently hosted at: https://github.com/klieret/inspiderweb
+
+This file implements the compact layout of the Database: One file that
+starts with the magic bytes followed by one byte for the compression
+("z": zlib/gzip, "x": lzma) and the compressed stream of
+    meta: length, pickled meta information
+    number of records
+    records: length, encoded record (see _encode_record)
+All numbers are varints (7 bits per byte, highest bit set if more bytes
+follow). Recids are stored as integers and sets of recids as sorted
+lists of differences. Strings (bibkeys, labels, urls) are stored once and
+then referred to by their position in a string pool. Optional fields
+(e.g. the citation count) are only stored if they are set, which is
+marked in the flags of the record. Citations are only stored where they
+differ from the ones implied by the references of the other records, so
+that most connections are only stored once.
+Records are written and read one at a time.
+"""
+
+magic = b"INSPWEB\x01"
+compact_extension = ".compact"
+compressions = {"zlib": b"z", "lzma": b"x"}
+
+_flags = ["references_dl", "citations_dl", "cocitations_dl", "info_dl"]
+_flag_label_none = 1 << len(_flags)
+_flag_custom_url = 1 << (len(_flags) + 1)
+_flag_citation_count = 1 << (len(_flags) + 2)
+
+
+def is_compact(path: str) -> bool:
+    """ Is there a compact database at $path (or should a new database at
+    $path be compact)? """
+    try:
+        with open(path, "rb") as stream:
+            return stream.read(len(magic)) == magic
+    except (FileNotFoundError, IsADirectoryError):
+        return path.endswith(compact_extension)
+
+
+def _write_varint(out: bytearray, number: int) -> None:
+    while number > 0x7f:
+        out.append(number & 0x7f | 0x80)
+        number >>= 7
+    out.append(number)
+
+
+def _read_varint(data: bytes, pos: int) -> Tuple[int, int]:
+    """ Returns the number and the position after it. """
+    number = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        number |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return number, pos
+        shift += 7
+
+
+def _recid_to_int(recid: str) -> int:
+    number = int(recid)
+    if str(number) != recid or number < 0:
+        raise ValueError("The compact format only supports recids that are "
+                         "non-negative integers, not {}.".format(recid))
+    return number
+
+
+def _write_recids(out: bytearray, recids) -> None:
+    numbers = sorted(_recid_to_int(recid) for recid in recids)
+    _write_varint(out, len(numbers))
+    previous = 0
+    for number in numbers:
+        _write_varint(out, number - previous)
+        previous = number
+
+
+def _read_recids(data: bytes, pos: int) -> Tuple[list, int]:
+    length, pos = _read_varint(data, pos)
+    recids = []
+    number = 0
+    for _ in range(length):
+        delta, pos = _read_varint(data, pos)
+        number += delta
+        recids.append(str(number))
+    return recids, pos
+
+
+def _write_weights(out: bytearray, weights: Dict[str, int]) -> None:
+    _write_recids(out, weights)
+    for recid in sorted(weights, key=int):
+        _write_varint(out, weights[recid])
+
+
+def _read_weights(data: bytes, pos: int) -> Tuple[dict, int]:
+    recids, pos = _read_recids(data, pos)
+    weights = {}
+    for recid in recids:
+        weights[recid], pos = _read_varint(data, pos)
+    return weights, pos
+
+
+class _StringPool(object):
+    """ 0 is the empty string, 1, 2, ... are the strings in the order in
+    which they were first written, len(pool) + 1 announces a new string
+    that follows directly. """
+    def __init__(self):
+        self.strings = [""]
+        self.index = {"": 0}
+
+    def write(self, out: bytearray, string: str) -> None:
+        if string in self.index:
+            _write_varint(out, self.index[string])
+            return
+        self.index[string] = len(self.strings)
+        _write_varint(out, len(self.strings))
+        self.strings.append(string)
+        encoded = string.encode("utf-8")
+        _write_varint(out, len(encoded))
+        out.extend(encoded)
+
+    def read(self, data: bytes, pos: int) -> Tuple[str, int]:
+        index, pos = _read_varint(data, pos)
+        if index < len(self.strings):
+            return self.strings[index], pos
+        length, pos = _read_varint(data, pos)
+        string = data[pos:pos + length].decode("utf-8")
+        self.strings.append(string)
+        return string, pos + length
+
+
+def _encode_record(record: Record, implied_citations: set,
+                   pool: _StringPool) -> bytes:
+    out = bytearray()
+    _write_varint(out, _recid_to_int(record.recid))
+    flags = 0
+    for bit, attribute in enumerate(_flags):
+        if getattr(record, attribute):
+            flags |= 1 << bit
+    if record.custom_label is None:
+        flags |= _flag_label_none
+    custom_url = record.inspire_url != Record(record.recid).inspire_url
+    if custom_url:
+        flags |= _flag_custom_url
+    if record.citation_count >= 0:
+        flags |= _flag_citation_count
+    _write_varint(out, flags)
+    pool.write(out, record.bibkey)
+    pool.write(out, record.custom_label or "")
+    pool.write(out, record.fulltext_url)
+    if custom_url:
+        pool.write(out, record.inspire_url)
+    _write_varint(out, record.year)
+    if record.citation_count >= 0:
+        _write_varint(out, record.citation_count)
+    _write_recids(out, record.references)
+    _write_recids(out, record.citations - implied_citations)
+    _write_recids(out, implied_citations - record.citations)
+    _write_recids(out, record.cocitations)
+    _write_weights(out, record.cocitation_weights)
+    _write_weights(out, record.coupling_weights)
+    return bytes(out)
+
+
+def _decode_record(data: bytes, pool: _StringPool) -> Tuple[Record, list]:
+    """ Returns the record (with only the citations that are not implied by
+    references) and the list of implied citations that are missing. """
+    number, pos = _read_varint(data, 0)
+    record = Record(str(number))
+    flags, pos = _read_varint(data, pos)
+    for bit, attribute in enumerate(_flags):
+        setattr(record, attribute, bool(flags & 1 << bit))
+    record.bibkey, pos = pool.read(data, pos)
+    record.custom_label, pos = pool.read(data, pos)
+    if flags & _flag_label_none:
+        record.custom_label = None
+    record.fulltext_url, pos = pool.read(data, pos)
+    if flags & _flag_custom_url:
+        record.inspire_url, pos = pool.read(data, pos)
+    record.year, pos = _read_varint(data, pos)
+    if flags & _flag_citation_count:
+        record.citation_count, pos = _read_varint(data, pos)
+    references, pos = _read_recids(data, pos)
+    record.references = set(references)
+    citations, pos = _read_recids(data, pos)
+    record.citations = set(citations)
+    missing, pos = _read_recids(data, pos)
+    cocitations, pos = _read_recids(data, pos)
+    record.cocitations = set(cocitations)
+    record.cocitation_weights, pos = _read_weights(data, pos)
+    record.coupling_weights, pos = _read_weights(data, pos)
+    return record, missing
+
+
+def _open_compressed(stream, mode: str, compression: bytes):
+    if compression == compressions["zlib"]:
+        return gzip.GzipFile(fileobj=stream, mode=mode, compresslevel=6)
+    elif compression == compressions["lzma"]:
+        return lzma.LZMAFile(stream, mode=mode)
+    raise ValueError("Unknown compression {}".format(compression))
+
+
+def write_compact(path: str, records: Dict[str, Record], meta: dict,
+                  compression="zlib") -> None:
+    """ Write the compact database.
+
+    Args:
+        path: Path of the file
+        records: Dictionary recid: Record
+        meta: Meta information (pickled)
+        compression: "zlib" or "lzma"
+    """
+    implied_citations = collections.defaultdict(set)
+    for recid, record in records.items():
+        for reference in record.references:
+            implied_citations[reference].add(recid)
+    pool = _StringPool()
+    with atomic_write(path) as raw_stream:
+        raw_stream.write(magic + compressions[compression])
+        with _open_compressed(raw_stream, "wb",
+                              compressions[compression]) as stream:
+            out = bytearray()
+            meta_bytes = pickle.dumps(meta)
+            _write_varint(out, len(meta_bytes))
+            _write_varint(out, len(records))
+            stream.write(bytes(out))
+            stream.write(meta_bytes)
+            for recid in sorted(records, key=int):
+                data = _encode_record(records[recid],
+                                      implied_citations.get(recid, set()),
+                                      pool)
+                out = bytearray()
+                _write_varint(out, len(data))
+                stream.write(bytes(out))
+                stream.write(data)
+    logger.debug("Wrote {} records in compact format.".format(len(records)))
+
+
+def _read_varint_from_stream(stream) -> int:
+    number = 0
+    shift = 0
+    while True:
+        byte = stream.read(1)
+        if not byte:
+            raise EOFError("Unexpected end of compact database.")
+        number |= (byte[0] & 0x7f) << shift
+        if byte[0] < 0x80:
+            return number
+        shift += 7
+
+
+def iter_compact(path: str) -> Iterator:
+    """ Read the compact database one record at a time.
+    The first item is the meta information, the following items are
+    two-tuples (record, missing), where the record only has the citations
+    that are not implied by the references of the other records and
+    missing is a list of the implied citations that it doesn't have (see
+    read_compact).
+    """
+    with open(path, "rb") as raw_stream:
+        header = raw_stream.read(len(magic) + 1)
+        if header[:len(magic)] != magic:
+            raise ValueError("{} is not a compact database.".format(path))
+        with _open_compressed(raw_stream, "rb", header[len(magic):]) as \
+                stream:
+            meta_length = _read_varint_from_stream(stream)
+            n_records = _read_varint_from_stream(stream)
+            yield pickle.loads(stream.read(meta_length))
+            pool = _StringPool()
+            for _ in range(n_records):
+                length = _read_varint_from_stream(stream)
+                yield _decode_record(stream.read(length), pool)
+
+
+def read_compact(path: str) -> Tuple[dict, Dict[str, Record]]:
+    """ Read the whole compact database.
+
+    Returns:
+        Two-tuple: The meta information (dictionary) and a dictionary
+        recid: Record.
+    """
+    items = iter_compact(path)
+    meta = next(items)
+    records = {}
+    all_missing = {}
+    for record, missing in items:
+        records[record.recid] = record
+        if missing:
+            all_missing[record.recid] = set(missing)
+    for recid, record in records.items():
+        for reference in record.references:
+            if reference in records and \
+                    recid not in all_missing.get(reference, ()):
+                records[reference].citations.add(recid)
+    return meta, records
@@ -1,11 +1,17 @@
 import pickle
-from .record import Record
+from .record import Record, year_from_bibkey
+from .graph import Graph
+from .analytics import Analytics
+from . import storage
+from . import compact
+from . import traversal
+from .frontier import Frontier
 import csv
 import os.path
 import re
 import time
 from .log import logger
-from typing import List, Set, Iterable
+from typing import Dict, List, Set, Iterable, Tuple
 import socket
 import urllib.request
 import urllib.parse
@@ -23,7 +29,18 @@ some methods to update/save/cache information.
 """
 
 
-def download(url: str, retries=3, timeout=10, sleep_after=1,
+# Outcome of looking up a bibkey on inspirehep:
+# status is one of "found", "missing", "ambiguous", recid is "" unless
+# status is "found" and timestamp is the time (time.time()) of the lookup.
+BibkeyResolution = collections.namedtuple("BibkeyResolution",
+                                          ["status", "recid", "timestamp"])
+
+
+# Time [s] to sleep after every download (rate limit)
+download_sleep = 1
+
+
+def download(url: str, retries=3, timeout=10, sleep_after=download_sleep,
              raise_exception=False) -> str:
     """ Download from url with automatic retries.
     Also prints logging messages.
@@ -72,11 +89,75 @@ class Database(object):
     The records are collected in self._records, a dictionary of the form
     recid: record, where record is a Record object and recid is the inspirehep
     id, i.e. the number 566620 for the record inspirehep.net/record/566620/.
+    Every connection is stored in both directions, i.e. if record a
+    references record b, b also lists a as citation (see add_edges).
+    Whether all references (citations) of a record are known, is tracked
+    by record.references_dl (record.citations_complete).
+    The database is saved either as one pickle file, (if self.shards > 0
+    or if the path is a directory) in the sharded layout or (if the path
+    is a sqlite file or ends with .sqlite) in the indexed layout described
+    in storage.py or (if the file starts with the magic bytes of
+    compact.py or ends with .compact) in the compact layout.
+    Indexed databases can also be loaded partially (see
+    load_neighbourhood).
     """
-    def __init__(self, backup_path=None):
+    def __init__(self, backup_path=None, shards=0, processes=1):
         self._records = {}
         self.backup_path = backup_path
         self.offline_testing = False
+        # Number of shards to save the database in (0: one pickle file).
+        # If we load a sharded database from backup_path, its number of
+        # shards is taken.
+        self.shards = shards
+        # Number of processes to write shards and to merge several sharded
+        # databases with (see storage.py).
+        self.processes = processes
+        # Recids of the records that changed since the last time we loaded
+        # from or saved to the backup path (so that only those shards
+        # have to be written).
+        self._dirty = set()
+        # Maximal number of recids that autocomplete_records keeps in memory
+        # per step before writing them to disk (0: no limit) and directory
+        # for these files (None: system default).
+        self.crawl_memory = 0
+        self.crawl_directory = None
+        # If set to a WorkQueue, autocomplete_records lets workers download
+        # references and citations (see workqueue.py), checking for results
+        # every poll_interval seconds.
+        self.work_queue = None
+        self.poll_interval = 5.
+        # If no task of the work queue is leased and none changes its
+        # status for worker_timeout seconds, we assume that there are no
+        # (live) workers and download the remaining tasks ourselves.
+        self.worker_timeout = 60.
+        # If > 0, autocomplete_records first downloads the citation counts
+        # of the records (many per request, see get_citation_counts) and
+        # only downloads the citations of records with at least this many
+        # citations.
+        self.crawl_min_citations = 0
+        # If True, the saves while downloading (autocomplete_records) happen
+        # in a forked process (where available), so that the crawl doesn't
+        # have to wait. (pid, path, saved dirty recids) of the running save.
+        self.background_saves = False
+        self._background_save = None
+        # Compression of the compact layout ("zlib" or "lzma")
+        self.compression = "zlib"
+        # True if only part of the database was loaded (load_neighbourhood)
+        self.partial = False
+        # Conflicts when merging other databases: four-tuples (recid,
+        # attribute name, our value, their value)
+        self.merge_conflicts = []
+        # Incremented whenever a record is added or updated, so that
+        # everything computed from the whole database can be cached.
+        self.version = 0
+        self._graph = None
+        self._analytics = None
+        self._years = None
+        # bibkey: BibkeyResolution
+        self._bibkey_resolutions = {}
+        # Bibkeys that were not found or were ambiguous are only looked up
+        # again after this time [s].
+        self.resolution_expiry = 30 * 24 * 3600
 
     def statistics(self):
         """ Print some statistics about the records in the database. """
@@ -93,6 +174,8 @@ class Database(object):
             sum([int(bool(r.bibkey)) for recid, r in self._records.items()])))
         logger.info("Current number of records with custom label: {}".format(
             sum([int(bool(r.custom_label)) for recid, r in self._records.items()])))
+        logger.info("Current number of cached bibkey lookups: {}".format(
+            len(self._bibkey_resolutions)))
         logger.info("*"*50)
 
     def load(self, paths=None, backup_path=True) -> bool:
@@ -111,16 +194,58 @@ class Database(object):
         """
         any_success = False
         if backup_path and self.backup_path:
+            was_empty = not self._records
             any_success |= self._load(self.backup_path)
+            if was_empty:
+                # everything is exactly as on disk
+                self._dirty.clear()
         if not paths:
-            return any_success
-        if "__iter__" not in dir(paths):
+            paths = []
+        elif isinstance(paths, str):
             # only one string supplied
             paths = [paths]
-        for path in paths:
-            any_success |= self._load(path)
+        for group in self._sharded_groups(paths):
+            if len(group) > 1:
+                any_success |= self._load_sharded_group(group)
+            else:
+                any_success |= self._load(group[0])
+        # only now, as the records of one connection might come from
+        # different shards or databases
+        self._reconcile_edges()
         return any_success
 
+    def _sharded_groups(self, paths: List[str]) -> List[List[str]]:
+        """ Split $paths into groups of consecutive sharded databases with
+        the same number of shards, which are merged in parallel (see
+        _load_sharded_group), and single paths. """
+        groups = []
+        last_shards = 0
+        for path in paths:
+            n_shards = 0
+            if self.processes > 1 and storage.is_sharded(path):
+                n_shards = storage.read_n_shards(path)
+            if n_shards and n_shards == last_shards:
+                groups[-1].append(path)
+            else:
+                groups.append([path])
+            last_shards = n_shards
+        return groups
+
+    def _load_sharded_group(self, paths: List[str]) -> bool:
+        """ Load/merge several sharded databases with the same number of
+        shards. Their shards are merged in self.processes processes before
+        they are merged into this database. """
+        metas, shards = storage.read_sharded_merged(paths,
+                                                    processes=self.processes)
+        for meta in metas:
+            self._merge_meta(meta)
+        for _records, conflicts in shards:
+            self.merge_conflicts.extend(conflicts)
+            self._merge_records(_records, reconcile=False)
+        logger.debug("Successfully loaded and merged dbs from {}".format(
+            ", ".join(paths)))
+        return True
+
     def _load(self, path="") -> bool:
         """ Load/merge the database from file $path.
         Returns True if this was successfull.
@@ -136,25 +261,309 @@ class Database(object):
         if not os.path.exists(path):
             logger.warning("Db does not exist yet. Creating it.")
             return False
+        if storage.is_indexed(path):
+            meta, _records = storage.read_indexed(path)
+            self._merge_meta(meta)
+            self._merge_records(_records, reconcile=False)
+            logger.debug("Successfully loaded db from {}".format(path))
+            return True
+        if compact.is_compact(path):
+            meta, _records = compact.read_compact(path)
+            self._merge_meta(meta)
+            self._merge_records(_records, reconcile=False)
+            logger.debug("Successfully loaded db from {}".format(path))
+            return True
+        if storage.is_sharded(path):
+            meta, shards = storage.read_sharded(path,
+                                                processes=self.processes)
+            if path == self.backup_path and not self.shards:
+                self.shards = meta["shards"]
+            self._merge_meta(meta)
+            for _records in shards:
+                self._merge_records(_records, reconcile=False)
+            logger.debug("Successfully loaded db from {}".format(path))
+            return True
         with open(path, "rb") as dbstream:
-            _records = pickle.load(dbstream)
-        for recid, their_record in _records.items():
-            assert recid == their_record.recid
-            my_record = self.get_record(recid)
-            my_record.merge(their_record)
-            self.update_record(recid, my_record)
+            state = pickle.load(dbstream)
+        if "records" in state:
+            self._merge_meta(state)
+            _records = state["records"]
+        else:
+            # older versions only saved the records
+            _records = state
+        self._merge_records(_records, reconcile=False)
         logger.debug("Successfully loaded db from {}".format(path))
         return True
 
-    def save(self, path=""):
+    def load_meta(self, path="") -> bool:
+        """ Only load the meta information (e.g. the bibkey lookups) of the
+        indexed database at $path (default: self.backup_path).
+        Returns True if this was successfull. """
+        if not path:
+            path = self.backup_path
+        if not os.path.isfile(path) or not storage.is_indexed(path):
+            logger.error("{} is not an indexed database.".format(path))
+            return False
+        self._merge_meta(storage.read_indexed_meta(path))
+        return True
+
+    def load_neighbourhood(self, seeds: Iterable[str], depth: int,
+                           path="") -> bool:
+        """ Only load the records that are at most $depth references or
+        citations away from one of the seeds from the indexed database at
+        $path (default: self.backup_path). Saving to the same path only
+        writes the changed records, so nothing is lost.
+
+        Args:
+            seeds: Recids
+            depth: 0: only the seeds, 1: seeds and their references and
+                   citations, ...
+            path: Path of an indexed database
+        Returns:
+            True if this was successfull.
+        """
+        if not self.load_meta(path):
+            return False
+        if not path:
+            path = self.backup_path
+        records = storage.read_neighbourhood(path, seeds, depth)
+        unchanged = records.keys() - self._records.keys()
+        self._merge_records(records, reconcile=False)
+        if path == self.backup_path:
+            self._dirty -= unchanged
+        self._reconcile_edges(records.keys())
+        self.partial = True
+        logger.info("Loaded {} records within {} steps of the seeds from "
+                    "{}".format(len(records), depth, path))
+        return True
+
+    def _merge_records(self, records: dict, reconcile=True) -> None:
+        """ Merge the records (dictionary recid: Record) of another
+        database into this one. Records that we do not have yet are
+        simply taken over, the others are merged (see Record.merge).
+        Conflicts are collected in self.merge_conflicts. If $reconcile,
+        the references and citations of the merged records are made
+        consistent with the other records (see _reconcile_edges). """
+        new_records = {}
+        n_conflicts = len(self.merge_conflicts)
+        for recid, their_record in records.items():
+            if recid != their_record.recid:
+                self.merge_conflicts.append(
+                    (recid, "recid", recid, their_record.recid))
+                continue
+            my_record = self._records.get(recid)
+            if my_record is None:
+                new_records[recid] = their_record
+                continue
+            for attribute, ours, theirs in my_record.merge(their_record):
+                self.merge_conflicts.append((recid, attribute, ours, theirs))
+        self._records.update(new_records)
+        self._dirty.update(records.keys())
+        self.version += 1
+        logger.debug("Took over {} new records, merged {} records, {} "
+                     "conflicts.".format(len(new_records),
+                                         len(records) - len(new_records),
+                                         len(self.merge_conflicts) -
+                                         n_conflicts))
+        if reconcile:
+            self._reconcile_edges(records.keys())
+
+    def add_edges(self, edges: Iterable[Tuple[str, str]]) -> None:
+        """ Add citations to the database. Both directions are stored: the
+        cited record in the references of the citing record and the citing
+        record in the citations of the cited record.
+
+        Args:
+            edges: Two-tuples (citing recid, cited recid)
+        """
+        for source, target in edges:
+            self.get_record(source).references.add(target)
+            self.get_record(target).citations.add(source)
+            self._dirty.add(source)
+            self._dirty.add(target)
+        self.version += 1
+
+    def _reconcile_edges(self, recids: Iterable[str] = None) -> int:
+        """ Make sure that every connection is stored in both directions
+        (see add_edges) for the records with the given recids (default:
+        all records). Only records that are in the database are changed,
+        so that partially loaded databases stay partial.
+
+        Returns:
+            Number of added directions.
+        """
+        records = self._records
+        if recids is None:
+            recids = list(records.keys())
+        n_added = 0
+        for recid in recids:
+            record = records.get(recid)
+            if record is None:
+                continue
+            for reference in record.references:
+                other = records.get(reference)
+                if other is not None and recid not in other.citations:
+                    other.citations.add(recid)
+                    self._dirty.add(reference)
+                    n_added += 1
+            for citation in record.citations:
+                other = records.get(citation)
+                if other is not None and recid not in other.references:
+                    other.references.add(recid)
+                    self._dirty.add(citation)
+                    n_added += 1
+        if n_added:
+            self.version += 1
+            logger.debug("Added {} missing directions of connections.".format(
+                n_added))
+        return n_added
+
+    def report_merge_conflicts(self, path="", delimiter_char=";") -> None:
+        """ Log the conflicts that occurred while loading/merging databases
+        and optionally write them to a csv file.
+
+        Args:
+            path: Path of the csv file (not written if empty)
+            delimiter_char: Delimiter of the csv file [;]
+        """
+        if not self.merge_conflicts:
+            logger.debug("No merge conflicts.")
+            return
+        logger.warning("{} conflicts while merging databases (kept the "
+                       "first value):".format(len(self.merge_conflicts)))
+        for recid, attribute, ours, theirs in self.merge_conflicts[:20]:
+            logger.warning("{}: {} '{}' vs. '{}'".format(recid, attribute,
+                                                         ours, theirs))
+        if len(self.merge_conflicts) > 20:
+            logger.warning("... and {} more.".format(
+                len(self.merge_conflicts) - 20))
+        if path:
+            with open(path, "w") as report_file:
+                writer = csv.writer(report_file, delimiter=delimiter_char)
+                writer.writerow(["recid", "attribute", "kept", "discarded"])
+                writer.writerows(self.merge_conflicts)
+            logger.info("Wrote merge conflicts to {}".format(path))
+
+    def _get_meta(self) -> dict:
+        """ Everything that is saved besides the records. """
+        return {"bibkey_resolutions": self._bibkey_resolutions}
+
+    def _merge_meta(self, meta: dict) -> None:
+        """ Merge everything that was saved besides the records. """
+        self._merge_bibkey_resolutions(meta.get("bibkey_resolutions", {}))
+
+    def save(self, path="", background=False) -> bool:
         """ Save the database to file.
-        If no path is given self.backup_path will be used. """
+        If no path is given self.backup_path will be used.
+        If $path is a sqlite file or ends with .sqlite, the database is
+        saved in the indexed layout, else if self.shards is set or $path is
+        a directory, the database is saved in the sharded layout (in both
+        cases, if the path is the backup path, only the changed records
+        or the shards containing them are written). If $path is a compact
+        database or ends with .compact, the compact layout is used.
+        Files are written to a temporary file first and then renamed, so
+        that a crash doesn't leave a corrupted database behind.
 
+        Args:
+            path: Path to save to
+            background: Save in a forked process (if available), which works
+                        on a copy-on-write snapshot of the database, and
+                        return right away. If the last background save is
+                        still running, nothing is done.
+        Returns:
+            True if the database was (or is being) saved.
+        """
         if not path:
             path = self.backup_path
-        with open(path, "wb") as dbfile:
-            pickle.dump(self._records, dbfile)
+        if background and hasattr(os, "fork"):
+            if self._background_save_running():
+                logger.debug("Previous save still running. Not saving.")
+                return False
+            pid = os.fork()
+            if pid == 0:
+                exit_code = 1
+                try:
+                    if self._write(path):
+                        exit_code = 0
+                except BaseException as ex:
+                    logger.error("Saving to {} failed because of "
+                                 "{}.".format(path, ex))
+                finally:
+                    os._exit(exit_code)
+            saved = set()
+            if path == self.backup_path:
+                saved = self._dirty
+                self._dirty = set()
+            self._background_save = (pid, path, saved)
+            logger.debug("Saving db to {} in process {}.".format(path, pid))
+            return True
+        self.wait_for_background_save()
+        if not self._write(path):
+            return False
+        if path == self.backup_path:
+            self._dirty.clear()
         logger.debug("Successfully saved db to {}".format(path))
+        return True
+
+    def _background_save_running(self, block=False) -> bool:
+        """ Check on the background save (waiting for it to finish if
+        $block). Returns True if it is still running. """
+        if self._background_save is None:
+            return False
+        pid, path, saved = self._background_save
+        finished_pid, status = os.waitpid(pid, 0 if block else os.WNOHANG)
+        if not finished_pid:
+            return True
+        self._background_save = None
+        if os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0:
+            logger.debug("Successfully saved db to {}".format(path))
+        else:
+            logger.error("Saving db to {} in the background failed.".format(
+                path))
+            # these records still have to be saved
+            self._dirty |= saved
+        return False
+
+    def wait_for_background_save(self) -> None:
+        """ Wait until the background save (if any) is finished. """
+        self._background_save_running(block=True)
+
+    def _write(self, path: str) -> bool:
+        """ Worker function of save. """
+        if storage.is_indexed(path):
+            dirty_recids = None
+            if path == self.backup_path and os.path.isfile(path):
+                dirty_recids = self._dirty
+            storage.write_indexed(path, self._records, self._get_meta(),
+                                  dirty_recids=dirty_recids,
+                                  merge=self.partial)
+        elif self.partial:
+            logger.error("Only part of the database was loaded, so it can "
+                         "only be saved to an indexed database. Not saving "
+                         "to {}.".format(path))
+            return False
+        elif compact.is_compact(path):
+            compact.write_compact(path, self._records, self._get_meta(),
+                                  compression=self.compression)
+        elif self.shards or storage.is_sharded(path):
+            self._save_sharded(path)
+        else:
+            state = self._get_meta()
+            state["records"] = self._records
+            with storage.atomic_write(path) as dbfile:
+                pickle.dump(state, dbfile)
+        return True
+
+    def _save_sharded(self, path: str) -> None:
+        meta = self._get_meta()
+        old_shards = storage.read_n_shards(path)
+        meta["shards"] = self.shards or old_shards or storage.default_shards
+        dirty_recids = None
+        if path == self.backup_path and old_shards == meta["shards"]:
+            dirty_recids = self._dirty
+        storage.write_sharded(path, self._records, meta,
+                              dirty_recids=dirty_recids,
+                              processes=self.processes)
 
     def get_record(self, recid: str):
         """ Return record with id $recid from database. Record will be created
@@ -174,11 +583,18 @@ class Database(object):
             return self._records[recid]
         else:
             self._records[recid] = Record(recid)
+            self._dirty.add(recid)
+            self.version += 1
             return self._records[recid]
 
     def get_recids_from_bibkeys(self, bibkeys: Iterable[str], offline_only=False):
         """ Try to search for as many bibkeys as possible with one run
-        as it speeds up the search in the internal database. """
+        as it speeds up the search in the internal database.
+        Bibkeys that are not in the database are looked up on inspirehep,
+        unless we already did so before (the results of all lookups,
+        including the ones without a unique match, are remembered in the
+        database, see self.resolution_expiry). """
+        bibkeys = set(bibkeys)
         # 1. search internally
         results = {}
         for recid, record in self._records.items():
@@ -187,22 +603,93 @@ class Database(object):
                     assert results[record.bibkey] == recid
                 else:
                     results[record.bibkey] = recid
+        # 2. search the results of previous lookups
+        now = time.time()
+        remaining = set()
+        for bibkey in bibkeys - set(results.keys()):
+            resolution = self._bibkey_resolutions.get(bibkey)
+            if resolution is None:
+                remaining.add(bibkey)
+            elif resolution.status == "found":
+                results[bibkey] = resolution.recid
+            elif now - resolution.timestamp > self.resolution_expiry:
+                remaining.add(bibkey)
+            else:
+                logger.debug("Skipping bibkey {}: {} at last lookup.".format(
+                    bibkey, resolution.status))
         if offline_only:
             return results
-        # 2. search inspire for the remaining
-        bibkeys -= set(results.keys())
-        for bibkey in bibkeys:
-            recids = self.get_recids_from_query(bibkey)
+        # 3. search inspire for the remaining
+        for bibkey in remaining:
+            json_string = self._get_json_from_query(bibkey, 250, 0)
+            if not json_string:
+                # download failed, so we don't know anything
+                continue
+            recids = set(self._get_recids_from_json(json_string))
             if len(recids) == 1:
                 results[bibkey] = list(recids)[0]
+                self._bibkey_resolutions[bibkey] = BibkeyResolution(
+                    "found", results[bibkey], time.time())
             else:
                 logger.error("{} records found for bibkey {}. I won't add "
                              "anything. ".format(len(recids), bibkey))
+                self._bibkey_resolutions[bibkey] = BibkeyResolution(
+                    "ambiguous" if recids else "missing", "", time.time())
         return results
 
+    def _merge_bibkey_resolutions(self, resolutions: dict) -> None:
+        """ Merge the results of bibkey lookups of another database, keeping
+        the latest lookup of every bibkey. """
+        for bibkey, resolution in resolutions.items():
+            mine = self._bibkey_resolutions.get(bibkey)
+            if mine is None or mine.timestamp < resolution.timestamp:
+                self._bibkey_resolutions[bibkey] = resolution
+
+    def get_year(self, recid: str) -> int:
+        """ Return the publication year of the record with id $recid
+        (0 if unknown). For records that were saved by older versions
+        (which did not save the year yet), the year is parsed from the
+        bibkey once and saved with the record. """
+        record = self._records.get(recid)
+        if record is None:
+            return 0
+        if not record.year and record.bibkey:
+            year = year_from_bibkey(record.bibkey)
+            if year:
+                record.year = year
+                self.update_record(recid, record)
+        return record.year
+
+    def get_recids_by_year(self) -> dict:
+        """ Return a dictionary year: set of recids for all records with
+        known year. The index is cached until the database changes. """
+        if self._years is None or self._years[0] != self.version:
+            index = collections.defaultdict(set)
+            for recid in self._records:
+                year = self.get_year(recid)
+                if year:
+                    index[year].add(recid)
+            self._years = (self.version, dict(index))
+        return self._years[1]
+
+    def get_recids_in_years(self, first=0, last=0) -> set:
+        """ Return all recids with publication year between $first
+        and $last (both included). If $first ($last) is 0, there is no
+        lower (upper) limit. """
+        recids = set()
+        for year, year_recids in self.get_recids_by_year().items():
+            if first and year < first:
+                continue
+            if last and year > last:
+                continue
+            recids.update(year_recids)
+        return recids
+
     def update_record(self, recid, record):
         """ Update record with id $recid with record $record. """
         self._records[recid] = record
+        self._dirty.add(recid)
+        self.version += 1
 
     def autocomplete_records(self, updates: Iterable[str], force=False,
                              save_every=5, recids=None,
@@ -218,7 +705,9 @@ class Database(object):
                 * refs (short r): References of each recid
                 * cites (short c): Citations of each recid
                 * refscites or citesrefs (short rc or cr): both
-                The last three options can be chained, 
+                * counts (short n): Only the number of citations of
+                  each recid (many recids per request)
+                The last four options can be chained, 
                 e.g. refs.cites means
                 1. For each supplied recid, get all reference
                 2. For all of the above, get all citations.
@@ -263,50 +752,162 @@ class Database(object):
         if len(steps) == 0:
             for i, recid in enumerate(recids):
                 if i and i % save_every == 0:
-                    self.save()
+                    self.save(background=self.background_saves)
                 if i and i % statistics_every == 0:
                     self.statistics()
                 self.get_info(recid)
 
+        # Every step handles each recid of $current once and collects them
+        # together with the newly found recids in $following.
+        current = Frontier(self.crawl_memory, self.crawl_directory)
+        current.update(recids)
         for step in steps:
+            if step in ["counts", "n"]:
+                logger.info("Downloading citation counts for {} "
+                            "records.".format(len(current)))
+                self.get_citation_counts(current, force=force)
+                continue
+            if step not in ["refs", "r", "cites", "c", "refscites", "rc",
+                            "cr", "citesrefs"]:
+                logger.error("Unrecognize update option {}. "
+                             "I will simply ignore this for "
+                             "now.".format(step))
+                continue
             logger.info("Downloading {} for {} records.".format(step,
-                                                                len(recids)))
-            # note how we are iterating over a copy of the set, instead of
-            # changing the set itself!
-            for i, recid in enumerate(recids.copy()):
+                                                                len(current)))
+            following = Frontier(self.crawl_memory, self.crawl_directory)
+            step_refs = step in ["refs", "r", "refscites", "rc", "cr",
+                                 "citesrefs"]
+            step_cites = step in ["cites", "c", "refscites", "rc", "cr",
+                                  "citesrefs"]
+            # records whose citations are not downloaded
+            skip_citations = set()
+            if step_cites and self.crawl_min_citations > 0:
+                skip_citations = {
+                    recid for recid, count in
+                    self.get_citation_counts(current).items()
+                    if count < self.crawl_min_citations}
+                logger.info("Skipping the citations of {} records with less "
+                            "than {} citations.".format(
+                                len(skip_citations),
+                                self.crawl_min_citations))
+            step_force = force
+            if self.work_queue is not None:
+                kinds = []
+                if step_refs:
+                    kinds.append("refs")
+                if step_cites:
+                    kinds.append("cites")
+                self._download_distributed(current, kinds, force=force,
+                                           skip_citations=skip_citations)
+                # whatever the workers didn't manage is downloaded below
+                step_force = False
+            for i, recid in enumerate(current):
                 if i and i % save_every == 0:
-                    self.save()
+                    self.save(background=self.background_saves)
                 if i and i % statistics_every == 0:
                     self.statistics()
 
-                if step in ["refs", "r"]:
-                    recids.update(self.get_references(recid, force=force))
-                elif step in ["cites", "c"]:
-                    recids.update(self.get_citations(recid, force=force))
-                elif step in ["refscites", "rc", "cr", "citesrefs"]:
-                    recids.update(self.get_references(recid, force=force))
-                    recids.update(self.get_citations(recid, force=force))
-                else:
-                    logger.error("Unrecognize update option {}. "
-                                 "I will simply ignore this for "
-                                 "now.".format(step))
+                following.add(recid)
+                if step_refs:
+                    following.update(self.get_references(recid,
+                                                         force=step_force))
+                if step_cites and recid not in skip_citations:
+                    following.update(self.get_citations(recid,
+                                                        force=step_force))
+            current.close()
+            current = following
+        recids = set(current)
+        current.close()
         return recids
 
+    def _download_distributed(self, recids: Iterable[str], kinds: List[str],
+                              force=False, skip_citations=()) -> None:
+        """ Add the downloads of references and/or citations of the
+        records that don't have them yet (or of all records if $force) to
+        self.work_queue and merge the results of the workers until all of
+        them are done or failed (or until the workers stop making
+        progress, see self.worker_timeout).
+
+        Args:
+            recids: Recids
+            kinds: List containing "refs" and/or "cites"
+            force: Also download information that we have already.
+            skip_citations: Don't download the citations of these recids.
+        """
+        tasks = set()
+        for recid in recids:
+            record = self._records.get(recid)
+            for kind in kinds:
+                if kind == "cites" and recid in skip_citations:
+                    continue
+                downloaded = record is not None and (
+                    record.references_dl if kind == "refs" else
+                    record.citations_complete)
+                if force or not downloaded:
+                    tasks.add((recid, kind))
+        if not tasks:
+            return
+        self.work_queue.add(tasks)
+        logger.info("Added {} tasks to the work queue {}. Waiting for "
+                    "workers (inspiderweb.py --worker --queue {}).".format(
+                        len(tasks), self.work_queue.path,
+                        self.work_queue.path))
+        last_statuses = {}
+        last_progress = time.time()
+        while True:
+            for recid, kind, records in self.work_queue.collect():
+                self._merge_records(records)
+            statuses = self.work_queue.status(tasks)
+            tasks = {task for task, status in statuses.items()
+                     if status in ["pending", "leased", "done"]}
+            failed = [task for task, status in statuses.items()
+                      if status == "failed"]
+            if failed:
+                logger.warning("{} tasks failed, e.g. {}.".format(
+                    len(failed), failed[0]))
+            if not tasks:
+                break
+            if statuses != last_statuses or \
+                    "leased" in statuses.values():
+                last_progress = time.time()
+            elif time.time() - last_progress > self.worker_timeout:
+                logger.warning("No worker took a task for {:.0f} s. "
+                               "Downloading the remaining {} tasks "
+                               "ourselves.".format(self.worker_timeout,
+                                                   len(tasks)))
+                break
+            last_statuses = statuses
+            logger.info("Waiting for {} tasks.".format(len(tasks)))
+            time.sleep(self.poll_interval)
+        if self.backup_path:
+            self.save(background=self.background_saves)
+
     def get_labels_from_file(self,
                              path: str,
-                             delimiter_char=";",):
+                             delimiter_char=";",) -> List[Tuple[int, str]]:
         """ Load labels from csv file. First row is treated as header
         and has to contain "labels", as well as one of "recid", "url",
         "bibkey'.
         Note that comments are not supprted right now, but all lines that
         do not contain enough fields will be skipped without an error
         message (which should have the same effect in most cases).
+        The file is read in one pass, collecting all identifiers. Then all
+        bibkeys are resolved at once and finally all labels are applied.
 
         Args:
             path: Path to csv file.
             delimiter_char: Delimiter of csv file [;]
+        Returns:
+            List of two-tuples (line number, identifier) of all rows whose
+            identifier could not be resolved to a recid.
         """
         logger.info("Loading labels from {}".format(path))
+        # todo: maybe rather have a function instead of this
+        url_regex = re.compile("inspirehep.net/record/([0-9]+)")
+
+        # 1. collect identifiers: list of (line number, identifier, label)
+        rows = []
         with open(path, "r") as inspire_links:
             csv_file = csv.DictReader(inspire_links, delimiter=delimiter_char)
 
@@ -327,43 +928,49 @@ class Database(object):
                     logger.error("Multiple identifiers in csv file headers."
                                  "Gonna take this one.")
                 identifier = "bibkey"
-
-            # todo: maybe rather have a function instead of this
-            url_regex = re.compile("inspirehep.net/record/([0-9]+)")
+            if not identifier:
+                logger.critical("No identifier found in csv header."
+                                " Abort.")
+                sys.exit(356)
 
             for row in csv_file:
-                if not row:
+                if not row or not row[identifier] or row["label"] is None:
                     continue
+                rows.append((csv_file.line_num, row[identifier].strip(),
+                             row["label"].strip()))
 
-                label = row["label"].strip()
-
-                if not row[identifier]:
-                    continue
+        # 2. resolve identifiers to recids
+        if identifier == "recid":
+            recids = {value: value for _, value, _ in rows if value.isdigit()}
+        elif identifier == "url":
+            recids = {}
+            for _, value, _ in rows:
+                match = url_regex.search(value)
+                if match:
+                    recids[value] = match.group(1)
+        else:
+            recids = self.get_recids_from_bibkeys(
+                {value for _, value, _ in rows})
 
-                if identifier == "recid":
-                    recid = row[identifier]
-                elif identifier == "url":
-                    try:
-                        recid = url_regex.search(row[identifier]).group(1)
-                    except AttributeError:
-                        continue
-                elif identifier == "bibkey":
-                    recids = list(self.get_recids_from_bibkeys(
-                        row[identifier]).keys())
-                    if not len(recids) == 1:
-                        logger.error("Something wrong with bibkey {}, just"
-                                     "adding first result.".format(
-                            row[identifier]))
-                    recid = recids[0]
-                else:
-                    logger.critical("No identifier found in csv header."
-                                    " Abort.")
-                    sys.exit(356)
+        # 3. apply labels
+        unresolved = []
+        for line_num, value, label in rows:
+            if value not in recids:
+                unresolved.append((line_num, value))
+                continue
+            record = self.get_record(recids[value])
+            record.custom_label = label
+            self.update_record(record.recid, record)
 
-                record = self.get_record(recid)
-                record.custom_label = label
-                self.update_record(recid, record)
+        logger.info("Applied {} labels.".format(len(rows) - len(unresolved)))
+        if unresolved:
+            logger.warning("Could not resolve the {} of the following {} "
+                           "rows: {}".format(
+                               identifier, len(unresolved),
+                               ", ".join("{} (line {})".format(value, line)
+                                         for line, value in unresolved)))
         logger.debug("Finished loading labels.")
+        return unresolved
 
     def get_info(self, recid, force=False) -> bool:
         record = self.get_record(recid)
@@ -386,7 +993,7 @@ class Database(object):
         search_string = "citedby:recid:{}".format(record.recid)
         recids = self.get_recids_from_query(search_string)
         logger.debug("{} is citing {} references.".format(recid, len(recids)))
-        record.references.update(recids)
+        self.add_edges((record.recid, reference) for reference in recids)
         self.update_record(recid, record)
         record.references_dl = True
         return recids
@@ -403,14 +1010,87 @@ class Database(object):
         if record.citations_dl and not force:
             logger.debug("Skipping downloading of citations.")
             return record.citations
+        if record.citations_complete and not force:
+            # we know as many citing records (from their references) as
+            # the citation count. This is not remembered as citations_dl,
+            # as the count might be outdated (see
+            # Record.citations_complete).
+            logger.debug("Skipping downloading of citations (all of them "
+                         "are known).")
+            return record.citations
         search_string = "refersto:recid:{}".format(record.recid)
         recids = self.get_recids_from_query(search_string)
         logger.debug("{} is cited by {} records.".format(recid, len(recids)))
-        record.citations.update(recids)
+        self.add_edges((citation, record.recid) for citation in recids)
+        record.citation_count = max(record.citation_count, len(recids))
         self.update_record(recid, record)
         record.citations_dl = True
         return recids
 
+    def get_citation_counts(self, recids: Iterable[str], force=False,
+                            batch=50) -> Dict[str, int]:
+        """ Download the number of citations of the records (but not the
+        citing records themselves, see get_citations). The counts of
+        $batch records are downloaded with one request.
+
+        Args:
+            recids: Recids
+            force: Also download counts that we have already.
+            batch: Number of records per request
+        Returns:
+            Dictionary recid: number of citations (only for the records
+            whose count is known).
+        """
+        counts = {}
+        missing = []
+        for recid in recids:
+            record = self.get_record(recid)
+            if record.citation_count >= 0 and not force:
+                counts[recid] = record.citation_count
+            else:
+                missing.append(recid)
+        if missing:
+            logger.debug("Downloading citation counts of {} records.".format(
+                len(missing)))
+        for start in range(0, len(missing), batch):
+            chunk = missing[start:start + batch]
+            query = " or ".join("recid:{}".format(recid) for recid in chunk)
+            json_string = self._get_json_from_query(
+                query, len(chunk), 0, output_tags="recid,number_of_citations")
+            for recid, count in self._get_citation_counts_from_json(
+                    json_string).items():
+                if recid not in chunk:
+                    continue
+                record = self.get_record(recid)
+                record.citation_count = count
+                self.update_record(recid, record)
+                counts[recid] = count
+        not_found = [recid for recid in missing if recid not in counts]
+        if not_found:
+            logger.warning("Did not get the citation counts of {} records, "
+                           "e.g. {}.".format(len(not_found), not_found[0]))
+        return counts
+
+    @staticmethod
+    def _get_citation_counts_from_json(json_string) -> Dict[str, int]:
+        """ Parse the citation counts (as json string) from the inspirehep
+        API.
+
+        Returns:
+            Dictionary recid: number of citations
+        """
+        if not json_string:
+            return {}
+        counts = {}
+        for record in json.loads(json_string) or []:
+            if "number_of_citations" not in record:
+                logger.error("Key 'number_of_citations' not found. This "
+                             "shouldn't happen as we asked for it. "
+                             "Full string: {}".format(record))
+                continue
+            counts[str(record["recid"])] = int(record["number_of_citations"])
+        return counts
+
     # fixme: somehow still doesn't work with recjson:
     # http://inspirehep.net/search?p=cocitedwith:566620&of=h&rg=25&sc=0
     # works perfectly fine but
@@ -433,6 +1113,100 @@ class Database(object):
     #     record.cocitations_dl = True
     #     return True
 
+    def get_graph(self) -> Graph:
+        """ Return a Graph (array based snapshot of all references and
+        citations) of the database. The graph is cached until the database
+        changes. """
+        if self._graph is None or self._graph[0] != self.version:
+            self._graph = (self.version, Graph.from_database(self))
+        return self._graph[1]
+
+    @property
+    def analytics(self) -> Analytics:
+        """ Analytics (centralities etc.) of this database. """
+        if self._analytics is None:
+            self._analytics = Analytics(self)
+        return self._analytics
+
+    def shortest_paths(self, source: str, target: str, k=1,
+                       directed=False) -> List[List[str]]:
+        """ The $k shortest paths between the records $source and $target
+        (see traversal.shortest_paths).
+
+        Args:
+            source: Recid
+            target: Recid
+            k: Number of paths
+            directed: Only follow references (from $source to $target)
+        Returns:
+            List of paths (lists of recids), shortest first.
+        """
+        return traversal.shortest_paths(self.get_graph(), source, target,
+                                        k=k, directed=directed)
+
+    def ego_network(self, seeds: Iterable[str], radius: int,
+                    direction="both") -> Set[str]:
+        """ Recids of all records that are at most $radius references
+        and/or citations away from the seeds (see traversal.ego_network).
+        """
+        return traversal.ego_network(self.get_graph(), seeds, radius,
+                                     direction=direction)
+
+    def connected_components(self) -> List[Set[str]]:
+        """ Connected components of the citation network (ignoring the
+        direction), largest first. """
+        return traversal.connected_components(self.get_graph())
+
+    def induced_connections(self, recids: Iterable[str]) -> set:
+        """ All connections between the given records (as for
+        DotGraph.add_connections). """
+        return traversal.induced_connections(self.get_graph(), recids)
+
+    def path_connections(self, paths: Iterable[List[str]]) -> set:
+        """ The connections along the given paths (as for
+        DotGraph.add_connections). """
+        return traversal.path_connections(self.get_graph(), paths)
+
+    def compute_cocitations(self, top_k=25) -> None:
+        """ Compute co-citations and bibliographic couplings from the
+        references and citations that are already in the database (without
+        downloading anything). For every record, the $top_k strongest
+        co-cited records are saved in record.cocitations, together with
+        their weights (number of records citing both) in
+        record.cocitation_weights. Similarly the $top_k strongest
+        bibliographic couplings (number of shared references) are saved in
+        record.coupling_weights.
+        As nothing is downloaded, record.cocitations_dl is not changed.
+        Only records whose values changed are marked as changed.
+
+        Args:
+            top_k: Number of neighbours to keep for each record.
+        """
+        graph = self.get_graph()
+        logger.info("Computing co-citations for {} records ({} "
+                    "connections).".format(len(self._records),
+                                           graph.n_edges))
+        changed = 0
+        for recid, record in self._records.items():
+            node = graph.index[recid]
+            cocitations = graph.cocitation_counts(node).most_common(top_k)
+            couplings = graph.coupling_counts(node).most_common(top_k)
+            cocitation_weights = {graph.recids[other]: weight
+                                  for other, weight in cocitations}
+            coupling_weights = {graph.recids[other]: weight
+                                for other, weight in couplings}
+            if cocitation_weights == record.cocitation_weights and \
+                    coupling_weights == record.coupling_weights and \
+                    record.cocitations == set(cocitation_weights):
+                continue
+            record.cocitation_weights = cocitation_weights
+            record.coupling_weights = coupling_weights
+            record.cocitations = set(cocitation_weights)
+            self.update_record(recid, record)
+            changed += 1
+        logger.debug("Finished computing co-citations ({} records "
+                     "changed).".format(changed))
+
     def get_recids_from_query(self, query: str,
                               record_group=250) -> Set[str]:
         """ Get recids from a query to the inspirehp API. Some bibliographic
@@ -480,7 +1254,8 @@ class Database(object):
     def _get_json_from_query(self, query: str,
                              record_group: int,
                              record_offset: int,
-                             offline_testing=None):
+                             offline_testing=None,
+                             output_tags="recid,system_control_number"):
         """ This function gets called from get_recids_from_query. See there
         for the general description.
 
@@ -494,6 +1269,7 @@ class Database(object):
             offline_testing: If True: Return an arbitrary hardcoded json
                              string (for fast offline testing).
                              If None: take self.offline_testing instead.
+            output_tags: Comma separated fields of the records to download
         Returns:
             Json as a string.
         """
@@ -509,7 +1285,7 @@ class Database(object):
         api_string = "p={p}&of={of}&ot={ot}&rg={rg}&jrec={jrec}".format(
                       p=urllib.parse.quote_plus(query),  # search query
                       of="recjson",  # output format
-                      ot="recid,system_control_number",  # output tags
+                      ot=output_tags,  # output tags
                       rg=record_group,  # number of records (def: 25, max: 250)
                       jrec=record_offset)  # result offset
         api_url = base_url + api_string
@@ -581,6 +1357,8 @@ class Database(object):
                 assert record.bibkey == bibkey
             else:
                 record.bibkey = bibkey
+            if bibkey:
+                record.year = year_from_bibkey(bibkey)
             if not record.fulltext_url and arxiv_code:
                 # The arxiv url looks like: oai:arXiv.org:1701.02937
                 # or oai:arXiv.org:hep-ph/0208013
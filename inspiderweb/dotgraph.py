@@ -1,6 +1,7 @@
-import re
 import collections
 from .log import logger
+from . import community
+from typing import List, Set
 import sys
 
 """ Part of inspiderweb: Tool to analyze paper reference networks.
@@ -23,8 +24,11 @@ class DotGraph(object):
         self._dot_str = ""
         self._all_node_ids = set([])
         self._node_styles = {}
-        self._clusters = {}  # clusterlabel: (set of recids, style)
+        self._clusters = {}  # cluster id: (set of recids, style, label)
         self._connections = set([])
+        self._node_fontsizes = {}
+        # node id: label of the nodes that stand for a whole community
+        self._summary_labels = {}
 
     def add_node(self, recid, style=""):
         self._node_styles[recid] = style
@@ -49,15 +53,66 @@ class DotGraph(object):
             self.add_connection(from_recid, to_recid)
         # print(self._connections)
 
-    def add_cluster(self, recids: set, cluster_id: str, style: str):
+    def scale_nodes(self, scores: dict, min_fontsize=15, max_fontsize=60):
+        """ Scale the font size of the nodes (that are not styled
+        otherwise) according to their score.
+
+        Args:
+            scores: Dictionary recid: score, e.g. from Analytics.scores
+            min_fontsize: Font size of the node with the lowest score
+            max_fontsize: Font size of the node with the highest score
+        """
+        if not scores:
+            return
+        low = min(scores.values())
+        high = max(scores.values())
+        for recid, score in scores.items():
+            if high > low:
+                fraction = (score - low) / (high - low)
+            else:
+                fraction = 1.
+            self._node_fontsizes[recid] = int(
+                round(min_fontsize + fraction * (max_fontsize - min_fontsize)))
+
+    def add_cluster(self, recids: set, cluster_id: str, style: str,
+                    label=""):
         """ Add a cluster.
 
         Args:
             recids: Set (!) of recids for each member of the cluster
             cluster_id: Id for cluster. Must be unique, otherwise arbitrary.
             style: String to style the cluster
+            label: Label of the cluster (default: $cluster_id)
+        """
+        self._clusters[cluster_id] = (recids, style, label or cluster_id)
+
+    def add_communities(self, communities: List[Set[str]],
+                        collapse=False) -> None:
+        """ Draw communities (e.g. from community.detect_communities) of
+        the connections that were added so far. Each community is labeled
+        with the label of the member that is cited most often by the other
+        members.
+
+        Args:
+            communities: List of sets of recids
+            collapse: Instead of drawing each community as a cluster,
+                      replace it by one node.
         """
-        self._clusters[cluster_id] = (recids, style)
+        node_ids = []
+        for number, members in enumerate(communities):
+            label = "{} + {}".format(
+                self.db.get_record(community.representative(
+                    members, self._connections)).label, len(members) - 1)
+            node_id = "community_{}".format(number)
+            node_ids.append(node_id)
+            if collapse:
+                self._summary_labels[node_id] = label
+                self.add_node(node_id, 'label="{}" shape=box3d'.format(label))
+            else:
+                self.add_cluster(set(members), node_id, "", label=label)
+        if collapse:
+            self._connections = community.collapse(self._connections,
+                                                   communities, node_ids)
 
     def add_cluster_node(self, cluster_id: str, recid: str):
         self._clusters[cluster_id][0].add(recid)
@@ -84,15 +139,12 @@ class DotGraph(object):
         if rank == "":
             pass
         elif rank == "year":
-            year_regex = re.compile(r".*:([0-9]{4}).*")
             node_ids_by_year = collections.defaultdict(set)
             for node_id in self._all_node_ids:
-                bibkey = self.db.get_record(node_id).bibkey
-                try:
-                    year = year_regex.match(bibkey).group(1)
-                except:
+                year = self.db.get_year(node_id)
+                if not year:
                     continue
-                node_ids_by_year[year].add(node_id)
+                node_ids_by_year[str(year)].add(node_id)
 
             # todo: fix indentation of stuff from config file
             self._dot_str += "{"
@@ -112,16 +164,15 @@ class DotGraph(object):
         """ Cluster several entries.
         """
 
-        for cluster_id, cluster in self._clusters.items():
-                # for cluster, items in clusters.items():
-                self._dot_str += '\t\tsubgraph "cluster_{}" {{\n'.format(
-                    cluster_id)
-                self._dot_str += ";\n".join(cluster[1].split(';'))
-                self._dot_str += self.config["cluster_style"]
-                self._dot_str += 'label="{}";\n'.format(cluster)
-                for recid in cluster[0]:
-                    self._dot_str += '\t\t"{};\n'.format(recid)
-                self._dot_str += "\t}\n"
+        for cluster_id, (recids, style, label) in self._clusters.items():
+            self._dot_str += '\t\tsubgraph "cluster_{}" {{\n'.format(
+                cluster_id)
+            self._dot_str += ";\n".join(style.split(';'))
+            self._dot_str += self.config["cluster_style"]
+            self._dot_str += 'label="{}";\n'.format(label)
+            for recid in recids:
+                self._dot_str += '\t\t"{}";\n'.format(recid)
+            self._dot_str += "\t}\n"
 
     def _draw_nodes(self) -> None:
         """ Draw nodes/style nodes (assign label etc.) """
@@ -132,6 +183,9 @@ class DotGraph(object):
                 self._node_styles[node_id] = 'label="{}" URL="{}"'.format(
                     self.db.get_record(node_id).label,
                     self.db.get_record(node_id).inspire_url)
+                if node_id in self._node_fontsizes:
+                    self._node_styles[node_id] += ' fontsize={}'.format(
+                        self._node_fontsizes[node_id])
 
         for recid, style in self._node_styles.items():
             self._dot_str += '\t"{}" [{}];\n'.format(recid, style)
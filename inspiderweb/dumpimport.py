@@ -0,0 +1,149 @@
+import gzip
+import json
+import collections
+import concurrent.futures
+from typing import Iterable, Iterator, List
+from .record import Record, year_from_bibkey
+from .log import logger
+
+""" Part of inspiderweb: Tool to analyze paper reference networks.
+Inspiderweb currently hosted at: https://github.com/klieret/inspiderweb
+
+This file imports bulk dumps of inspirehep literature records (one json
+object per line, optionally gzipped) into the Database
+(inspiderweb.py --importdump FILE). From every record we take
+    control_number: recid
+    texkeys: bibkey (the first one)
+    arxiv_eprints: fulltext url (the first one)
+    references[].record.$ref: references
+    citation_count: citation count (if given)
+and fill the same Record fields as Database._get_recids_from_json (plus
+the references). The citations are derived from the references (see
+Database.add_edges).
+The dump is read line by line and parsed in chunks (in several processes
+if requested), with only a few chunks in memory at a time.
+"""
+
+# Number of lines parsed together (in one process)
+chunk_lines = 2000
+
+
+def _open_dump(path: str):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+
+def _recid_from_ref(ref: str) -> str:
+    """ Recid from a reference such as
+    https://inspirehep.net/api/literature/1511147 ("" if the reference does
+    not point to a literature record). """
+    prefix, _, number = ref.rstrip("/").rpartition("/")
+    if not prefix.endswith("literature") or not number.isdigit():
+        return ""
+    return number
+
+
+def parse_record(data: dict) -> Record:
+    """ Record from one (decoded) record of the dump (None if the record
+    has no control_number). """
+    if "metadata" in data:
+        # records as returned by the inspirehep API
+        data = data["metadata"]
+    if "control_number" not in data:
+        return None
+    record = Record(str(data["control_number"]))
+    texkeys = data.get("texkeys") or []
+    if texkeys:
+        record.bibkey = texkeys[0]
+        record.year = year_from_bibkey(record.bibkey)
+    eprints = data.get("arxiv_eprints") or []
+    if eprints and eprints[0].get("value"):
+        record.fulltext_url = "http://arxiv.org/pdf/" + eprints[0]["value"]
+    for reference in data.get("references") or []:
+        ref = (reference.get("record") or {}).get("$ref", "")
+        recid = _recid_from_ref(ref)
+        if recid and recid != record.recid:
+            record.references.add(recid)
+    if isinstance(data.get("citation_count"), int):
+        record.citation_count = data["citation_count"]
+    record.references_dl = True
+    record.info_dl = True
+    return record
+
+
+def _parse_lines(lines: List[bytes]) -> List[Record]:
+    records = []
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = parse_record(json.loads(line.decode("utf-8")))
+        except (ValueError, AttributeError, TypeError) as ex:
+            logger.error("Skipping invalid line of dump: {}".format(ex))
+            continue
+        if record is not None:
+            records.append(record)
+    return records
+
+
+def _read_chunks(paths: Iterable[str]) -> Iterator[List[bytes]]:
+    for path in paths:
+        logger.info("Importing dump {}.".format(path))
+        with _open_dump(path) as dump:
+            chunk = []
+            for line in dump:
+                chunk.append(line)
+                if len(chunk) >= chunk_lines:
+                    yield chunk
+                    chunk = []
+            if chunk:
+                yield chunk
+
+
+def _parsed_chunks(paths: Iterable[str], processes=1) -> \
+        Iterator[List[Record]]:
+    """ Parsed chunks in the order of the dump. With $processes > 1, at
+    most 2 * $processes chunks are parsed or waiting at a time. """
+    chunks = _read_chunks(paths)
+    if processes <= 1:
+        for chunk in chunks:
+            yield _parse_lines(chunk)
+        return
+    with concurrent.futures.ProcessPoolExecutor(processes) as executor:
+        pending = collections.deque()
+        for chunk in chunks:
+            pending.append(executor.submit(_parse_lines, chunk))
+            if len(pending) >= 2 * processes:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def import_dumps(db, paths: Iterable[str], processes=1, complete=False) \
+        -> int:
+    """ Import the dumps at $paths into $db.
+
+    Args:
+        db: Database
+        paths: Paths of the dumps (gzipped if they end with .gz)
+        processes: Number of processes to parse the dumps with
+        complete: The dumps contain all records of inspirehep, so that
+                  the citations derived from the references are complete.
+    Returns:
+        Number of imported records.
+    """
+    n_records = 0
+    for records in _parsed_chunks(paths, processes=processes):
+        for record in records:
+            record.citations_dl = complete
+        db._merge_records({record.recid: record for record in records},
+                          reconcile=False)
+        db.add_edges((record.recid, reference) for record in records
+                     for reference in record.references)
+        n_records += len(records)
+        logger.debug("Imported {} records.".format(n_records))
+    db.version += 1
+    logger.info("Imported {} records.".format(n_records))
+    return n_records
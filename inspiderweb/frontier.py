@@ -0,0 +1,92 @@
+import os
+import os.path
+import heapq
+import shutil
+import tempfile
+from typing import Iterable, Iterator
+from .log import logger
+
+""" Part of inspiderweb: Tool to analyze paper reference networks.
+Inspiderweb currently hosted at: https://github.com/klieret/inspiderweb
+
+This file defines the Frontier class, a set of recids that is written to
+disk once it gets too large, so that crawling a large part of inspirehep
+(Database.autocomplete_records) only needs a bounded amount of memory.
+"""
+
+
+class Frontier(object):
+    """ Set of recids. As soon as more than $memory_budget recids are held
+    in memory, they are sorted and written to a run file in a temporary
+    directory. Iterating merges the run files and the recids in memory and
+    yields every recid exactly once (in sorted order).
+    Recids can't be added while iterating.
+    """
+    def __init__(self, memory_budget=0, directory=None):
+        """
+        Args:
+            memory_budget: Maximal number of recids held in memory (0: no
+                           limit, never write to disk).
+            directory: Directory in which the temporary directory for the
+                       run files is created (default: system default).
+        """
+        self.memory_budget = memory_budget
+        self.directory = directory
+        self._pending = set()
+        self._tmp_dir = None
+        self._runs = []
+
+    def add(self, recid: str) -> None:
+        self._pending.add(recid)
+        if self.memory_budget and len(self._pending) > self.memory_budget:
+            self._spill()
+
+    def update(self, recids: Iterable[str]) -> None:
+        for recid in recids:
+            self.add(recid)
+
+    def _spill(self) -> None:
+        if not self._tmp_dir:
+            self._tmp_dir = tempfile.mkdtemp(prefix="inspiderweb_frontier_",
+                                             dir=self.directory)
+        path = os.path.join(self._tmp_dir, "run_{}".format(len(self._runs)))
+        with open(path, "w") as run_file:
+            for recid in sorted(self._pending):
+                run_file.write(recid + "\n")
+        logger.debug("Wrote {} recids to {}.".format(len(self._pending),
+                                                     path))
+        self._runs.append(path)
+        self._pending = set()
+
+    @staticmethod
+    def _read_run(path: str) -> Iterator[str]:
+        with open(path) as run_file:
+            for line in run_file:
+                yield line.rstrip("\n")
+
+    def __iter__(self) -> Iterator[str]:
+        runs = [self._read_run(path) for path in self._runs]
+        previous = None
+        for recid in heapq.merge(sorted(self._pending), *runs):
+            if recid != previous:
+                yield recid
+                previous = recid
+
+    def __len__(self) -> int:
+        if not self._runs:
+            return len(self._pending)
+        return sum(1 for _ in self)
+
+    def close(self) -> None:
+        """ Remove the run files. """
+        if self._tmp_dir:
+            shutil.rmtree(self._tmp_dir, ignore_errors=True)
+        self._tmp_dir = None
+        self._runs = []
+        self._pending = set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,237 @@
+from array import array
+import collections
+from typing import Iterable, Tuple, Dict, List
+
+""" Part of inspiderweb: Tool to analyze paper reference networks.
+Inspiderweb currently hosted at: https://github.com/klieret/inspiderweb
+
+This file defines the Graph class, a compact, array backed snapshot of the
+reference/citation network that is used for all computations which have
+to look at the whole network at once (co-citations, centralities, ...).
+"""
+
+
+class Graph(object):
+    """ Snapshot of the citation network in compressed sparse row (CSR)
+    form.
+    Every recid is mapped to an integer node index (self.recids[i] is the
+    recid of node i, self.index[recid] the node index of a recid).
+    The edges i -> j ("i is referencing j") are stored in two arrays:
+    the targets of node i are self._ref_indices[self._ref_indptr[i]:
+    self._ref_indptr[i+1]]. The transposed graph ("j is cited by i") is
+    stored in the same way in self._cite_indptr and self._cite_indices.
+    """
+    def __init__(self, recids: Iterable[str],
+                 edges: Iterable[Tuple[str, str]]):
+        """
+        Args:
+            recids: Recids of the nodes. Nodes that are only mentioned in
+                    $edges are added automatically.
+            edges: Iterable of two-tuples (from_recid, to_recid), where
+                   from_recid is referencing to_recid.
+        """
+        self.recids = []  # type: List[str]
+        self.index = {}  # type: Dict[str, int]
+        for recid in recids:
+            self._add_node(recid)
+
+        targets = {}  # node index: set of node indices
+        for from_recid, to_recid in edges:
+            source = self._add_node(from_recid)
+            target = self._add_node(to_recid)
+            if source == target:
+                continue
+            targets.setdefault(source, set()).add(target)
+
+        self._ref_indptr, self._ref_indices = \
+            self._to_csr(len(self.recids), targets)
+        self._cite_indptr, self._cite_indices = \
+            self._transpose(len(self.recids), self._ref_indptr,
+                            self._ref_indices)
+
+    @classmethod
+    def from_database(cls, db):
+        """ Build the graph from all references and citations stored in the
+        Database $db. """
+        def edges():
+            for recid, record in db._records.items():
+                for reference_recid in record.references:
+                    yield (recid, reference_recid)
+                for citation_recid in record.citations:
+                    yield (citation_recid, recid)
+        return cls(db._records.keys(), edges())
+
+    @classmethod
+    def from_connections(cls, connections: Iterable[Tuple[str, str]]):
+        """ Build the graph from a set of two-tuples of recids as returned
+        by cli.get_plot_connections. """
+        return cls([], connections)
+
+    def _add_node(self, recid: str) -> int:
+        if recid not in self.index:
+            self.index[recid] = len(self.recids)
+            self.recids.append(recid)
+        return self.index[recid]
+
+    @staticmethod
+    def _to_csr(n_nodes: int, targets: dict):
+        indptr = array('l', [0]) * (n_nodes + 1)
+        indices = array('l')
+        for node in range(n_nodes):
+            if node in targets:
+                indices.extend(sorted(targets[node]))
+            indptr[node + 1] = len(indices)
+        return indptr, indices
+
+    @staticmethod
+    def _transpose(n_nodes: int, indptr: array, indices: array):
+        counts = array('l', [0]) * (n_nodes + 1)
+        for target in indices:
+            counts[target + 1] += 1
+        for node in range(n_nodes):
+            counts[node + 1] += counts[node]
+        t_indptr = array('l', counts)
+        t_indices = array('l', [0]) * len(indices)
+        fill = array('l', counts)
+        for source in range(n_nodes):
+            for target in indices[indptr[source]:indptr[source + 1]]:
+                t_indices[fill[target]] = source
+                fill[target] += 1
+        return t_indptr, t_indices
+
+    def __len__(self):
+        return len(self.recids)
+
+    @property
+    def n_edges(self) -> int:
+        return len(self._ref_indices)
+
+    def references(self, node: int) -> array:
+        """ Node indices of the nodes that node $node is referencing. """
+        return self._ref_indices[self._ref_indptr[node]:
+                                 self._ref_indptr[node + 1]]
+
+    def citations(self, node: int) -> array:
+        """ Node indices of the nodes that are citing node $node. """
+        return self._cite_indices[self._cite_indptr[node]:
+                                  self._cite_indptr[node + 1]]
+
+    def out_degree(self, node: int) -> int:
+        return self._ref_indptr[node + 1] - self._ref_indptr[node]
+
+    def in_degree(self, node: int) -> int:
+        return self._cite_indptr[node + 1] - self._cite_indptr[node]
+
+    def edges(self):
+        """ Iterate over all edges as two-tuples (from_recid, to_recid). """
+        for source in range(len(self.recids)):
+            for target in self.references(source):
+                yield (self.recids[source], self.recids[target])
+
+    def cocitation_counts(self, node: int) -> collections.Counter:
+        """ Row $node of the co-citation matrix C^T C (C being the adjacency
+        matrix of the references), i.e. for every other node the number of
+        records that are citing both of them.
+        """
+        counts = collections.Counter()
+        for citing in self.citations(node):
+            counts.update(self.references(citing))
+        del counts[node]
+        return counts
+
+    def coupling_counts(self, node: int) -> collections.Counter:
+        """ Row $node of the bibliographic coupling matrix C C^T, i.e. for
+        every other node the number of references it shares with $node.
+        """
+        counts = collections.Counter()
+        for cited in self.references(node):
+            counts.update(self.citations(cited))
+        del counts[node]
+        return counts
+
+    def strongly_connected_components(self) -> List[int]:
+        """ Tarjan's algorithm (iterative version).
+
+        Returns:
+            List, mapping every node index to the index of its strongly
+            connected component. Components are numbered in reverse
+            topological order, i.e. if there is a path from component a to
+            component b, then a >= b.
+        """
+        n_nodes = len(self.recids)
+        component = [-1] * n_nodes
+        lowlink = [0] * n_nodes
+        number = [-1] * n_nodes
+        stack = []
+        on_stack = [False] * n_nodes
+        counter = 0
+        n_components = 0
+        for root in range(n_nodes):
+            if number[root] >= 0:
+                continue
+            work = [(root, 0)]
+            while work:
+                node, child_pos = work.pop()
+                if child_pos == 0:
+                    number[node] = lowlink[node] = counter
+                    counter += 1
+                    stack.append(node)
+                    on_stack[node] = True
+                children = self.references(node)
+                recurse = False
+                for pos in range(child_pos, len(children)):
+                    child = children[pos]
+                    if number[child] < 0:
+                        work.append((node, pos + 1))
+                        work.append((child, 0))
+                        recurse = True
+                        break
+                    elif on_stack[child]:
+                        lowlink[node] = min(lowlink[node], number[child])
+                if recurse:
+                    continue
+                if lowlink[node] == number[node]:
+                    while True:
+                        member = stack.pop()
+                        on_stack[member] = False
+                        component[member] = n_components
+                        if member == node:
+                            break
+                    n_components += 1
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[node])
+        return component
+
+    def weakly_connected_components(self) -> List[int]:
+        """ Connected components if the direction of the edges is ignored.
+
+        Returns:
+            List, mapping every node index to the index of its component.
+            Components are numbered by decreasing size.
+        """
+        n_nodes = len(self.recids)
+        component = [-1] * n_nodes
+        sizes = []
+        for root in range(n_nodes):
+            if component[root] >= 0:
+                continue
+            label = len(sizes)
+            component[root] = label
+            work = [root]
+            size = 0
+            while work:
+                node = work.pop()
+                size += 1
+                for neighbours in (self.references(node),
+                                   self.citations(node)):
+                    for neighbour in neighbours:
+                        if component[neighbour] < 0:
+                            component[neighbour] = label
+                            work.append(neighbour)
+            sizes.append(size)
+        order = sorted(range(len(sizes)), key=lambda label: -sizes[label])
+        rank = [0] * len(sizes)
+        for position, label in enumerate(order):
+            rank[label] = position
+        return [rank[label] for label in component]
@@ -0,0 +1,128 @@
+import math
+import random
+import collections
+from typing import Dict, Tuple, Iterable
+from .graph import Graph
+
+""" Part of inspiderweb: Tool to analyze paper reference networks.
+Inspiderweb currently hosted at: https://github.com/klieret/inspiderweb
+
+This file implements a force directed layout (Fruchterman-Reingold), so that
+graphs can be drawn without an external Graphviz layout (see svggraph.py).
+"""
+
+
+def force_directed_layout(connections: Iterable[Tuple[str, str]],
+                          levels: Dict[str, int]=None,
+                          iterations=50,
+                          seed=0) -> Dict[str, Tuple[float, float]]:
+    """ Compute positions of all nodes of the network. The nodes are
+    sorted into the cells of a grid and repulsive forces are only calculated
+    exactly between nodes of the same cell. Nearby cells act with their
+    centre of mass and far away cells are ignored, so that one iteration
+    costs O(nodes + connections) instead of O(nodes^2).
+
+    Args:
+        connections: Iterable of two-tuples (from_recid, to_recid)
+        levels: Optional dictionary recid: level (e.g. the rank of the
+                publication year). If given, the vertical coordinate of
+                every node with a level is fixed to the level, so that only
+                the horizontal coordinate is optimized (like
+                `rank=same` in the dot language).
+        iterations: Number of iterations
+        seed: Seed for the random initial positions
+    Returns:
+        Dictionary recid: (x, y) with coordinates in units of the ideal
+        distance between two connected nodes.
+    """
+    graph = Graph.from_connections(connections)
+    n_nodes = len(graph)
+    if not n_nodes:
+        return {}
+    levels = levels or {}
+    rng = random.Random(seed)
+    side = math.sqrt(n_nodes)
+    fixed_y = [levels.get(recid) for recid in graph.recids]
+    xs = [rng.uniform(0, side) for _ in range(n_nodes)]
+    ys = [float(y) if y is not None else rng.uniform(0, side)
+          for y in fixed_y]
+    edges = [(source, target) for source in range(n_nodes)
+             for target in graph.references(source)]
+
+    # Ideal distance is 1. Repulsion between nodes of the same cell is
+    # calculated exactly, repulsion from the other cells within $reach cells
+    # uses their centre of mass and is the same for all nodes of a cell.
+    cell_size = 2.
+    reach = 3
+    temperature = side / 10.
+    for iteration in range(iterations):
+        dx = [0.] * n_nodes
+        dy = [0.] * n_nodes
+
+        grid = collections.defaultdict(list)
+        for node in range(n_nodes):
+            grid[(int(xs[node] // cell_size),
+                  int(ys[node] // cell_size))].append(node)
+        centres = {}
+        for cell, members in grid.items():
+            centres[cell] = (sum(xs[node] for node in members) / len(members),
+                             sum(ys[node] for node in members) / len(members),
+                             len(members))
+
+        for (cell_x, cell_y), members in grid.items():
+            centre_x, centre_y, _ = centres[(cell_x, cell_y)]
+            field_x = field_y = 0.
+            for offset_x in range(-reach, reach + 1):
+                for offset_y in range(-reach, reach + 1):
+                    if not offset_x and not offset_y:
+                        continue
+                    other = centres.get((cell_x + offset_x,
+                                         cell_y + offset_y))
+                    if other is None:
+                        continue
+                    delta_x = centre_x - other[0]
+                    delta_y = centre_y - other[1]
+                    distance2 = max(delta_x * delta_x + delta_y * delta_y,
+                                    1e-2)
+                    # force k^2/d along the unit vector delta/d
+                    field_x += other[2] * delta_x / distance2
+                    field_y += other[2] * delta_y / distance2
+            for node in members:
+                x, y = xs[node], ys[node]
+                dx[node] += field_x
+                dy[node] += field_y
+                for other in members:
+                    if other == node:
+                        continue
+                    delta_x = x - xs[other]
+                    delta_y = y - ys[other]
+                    distance2 = delta_x * delta_x + delta_y * delta_y
+                    if distance2 < 1e-6:
+                        delta_x, delta_y = rng.uniform(-0.1, 0.1), 0.1
+                        distance2 = delta_x * delta_x + delta_y * delta_y
+                    dx[node] += delta_x / distance2
+                    dy[node] += delta_y / distance2
+
+        for source, target in edges:
+            delta_x = xs[source] - xs[target]
+            delta_y = ys[source] - ys[target]
+            distance = math.sqrt(delta_x * delta_x + delta_y * delta_y)
+            # force d^2/k along the unit vector delta/d
+            dx[source] -= delta_x * distance
+            dy[source] -= delta_y * distance
+            dx[target] += delta_x * distance
+            dy[target] += delta_y * distance
+
+        for node in range(n_nodes):
+            if fixed_y[node] is not None:
+                dy[node] = 0.
+            length = math.sqrt(dx[node] * dx[node] + dy[node] * dy[node])
+            if length < 1e-9:
+                continue
+            step = min(length, temperature) / length
+            xs[node] += dx[node] * step
+            ys[node] += dy[node] * step
+        temperature *= 1. - 1. / iterations
+
+    return {recid: (xs[node], ys[node])
+            for node, recid in enumerate(graph.recids)}
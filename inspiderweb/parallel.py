@@ -0,0 +1,52 @@
+import multiprocessing
+from typing import Callable, Iterable, List, Tuple
+
+""" Part of inspiderweb: Tool to analyze paper reference networks.
+Inspiderweb currently hosted at: https://github.com/klieret/inspiderweb
+
+This file runs functions in forked worker processes, so that the workers
+share the (read only) state of the parent, e.g. a loaded Database, without
+pickling it. Where fork is not available, the functions are called one
+after another.
+"""
+
+
+def _call(function: Callable, arguments: tuple) -> Tuple[bool, object]:
+    # A SystemExit (e.g. of invalid plot rules) would silently end the
+    # worker process and the pool would wait for its result forever.
+    try:
+        return True, function(*arguments)
+    except SystemExit as ex:
+        return False, ex.code
+
+
+def fork_map(function: Callable, arguments: Iterable[tuple],
+             processes=1) -> List:
+    """ Call $function with every tuple of $arguments (in forked processes
+    if $processes > 1).
+
+    Args:
+        function: Module level function
+        arguments: Iterable of tuples of arguments
+        processes: Number of processes
+    Returns:
+        List of the return values (in the order of $arguments).
+    """
+    arguments = list(arguments)
+    if processes <= 1 or len(arguments) <= 1 or \
+            "fork" not in multiprocessing.get_all_start_methods():
+        return [function(*args) for args in arguments]
+    pool = multiprocessing.get_context("fork").Pool(processes)
+    try:
+        results = pool.starmap(_call, [(function, args)
+                                       for args in arguments], chunksize=1)
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+    values = []
+    for success, value in results:
+        if not success:
+            raise SystemExit(value)
+        values.append(value)
+    return values
@@ -0,0 +1,206 @@
+import math
+from typing import Iterable, List
+from .database import download_sleep
+from .log import logger
+
+""" Part of inspiderweb: Tool to analyze paper reference networks.
+Inspiderweb currently hosted at: https://github.com/klieret/inspiderweb
+
+This file estimates what the downloads requested by --get would cost
+(inspiderweb.py --dryrun), without downloading anything. The steps of the
+get strings are walked like in Database.autocomplete_records: Records
+whose references/citations are in the Database contribute their known
+recids, all other records are assumed to have the number of citations
+we know from their citation count (see Database.get_citation_counts) or
+the average number of references/citations of the downloaded records.
+Records found this way are not known yet, so the estimates are upper
+bounds (we can't tell how many of them are the same).
+"""
+
+# Records per downloaded page (see Database.get_recids_from_query)
+record_group = 250
+# Records per request for citation counts (see Database.get_citation_counts)
+count_batch = 50
+# Time [s] a download takes (without the sleep after every download)
+request_latency = 0.5
+# Used if there are no downloaded records in the database to average over
+default_references = 30.
+default_citations = 30.
+
+
+class StepEstimate(object):
+    """ Estimated cost of one step of a get string. """
+    def __init__(self, step: str):
+        self.step = step
+        # Records the step is applied to
+        self.records = 0.
+        # Queries (one per record and kind) and pages (downloads)
+        self.queries = 0.
+        self.pages = 0.
+        # Records that are not in the database after the step
+        self.new_records = 0.
+
+    def seconds(self, seconds_per_page=download_sleep + request_latency) \
+            -> float:
+        return self.pages * seconds_per_page
+
+
+def _pages(n_results: float) -> int:
+    """ Number of pages to download $n_results results. """
+    return int(n_results) // (record_group - 1) + 1
+
+
+def _duration(seconds: float) -> str:
+    if seconds < 120:
+        return "{:.0f} s".format(seconds)
+    if seconds < 7200:
+        return "{:.0f} min".format(seconds / 60)
+    return "{:.1f} h".format(seconds / 3600)
+
+
+def _averages(db):
+    """ Average number of references and citations (citation counts
+    included) of the records in $db. """
+    n_references = []
+    n_citations = []
+    for record in db._records.values():
+        if record.references_dl:
+            n_references.append(len(record.references))
+        if record.citation_count >= 0:
+            n_citations.append(record.citation_count)
+        elif record.citations_dl:
+            n_citations.append(len(record.citations))
+    return (sum(n_references) / len(n_references) if n_references else
+            default_references,
+            sum(n_citations) / len(n_citations) if n_citations else
+            default_citations,
+            n_citations)
+
+
+def estimate_update(db, update: str, recids: Iterable[str], force=False) \
+        -> List[StepEstimate]:
+    """ Estimate the cost of one get string (see
+    Database.autocomplete_records).
+
+    Args:
+        db: Database
+        update: Get string, e.g. "seeds.refs.cites"
+        recids: Seeds
+        force: As for autocomplete_records
+    Returns:
+        List of StepEstimate, one per step.
+    """
+    steps = update.split(".")
+    if steps[0] in ["all", "a"]:
+        known = set(db._records)
+    else:
+        known = set(recids)
+    # estimated number of records that we don't know yet
+    unknown = 0.
+    avg_references, avg_citations, citation_counts = _averages(db)
+    min_citations = db.crawl_min_citations
+    if citation_counts and min_citations > 0:
+        passing = sum(1 for count in citation_counts
+                      if count >= min_citations) / len(citation_counts)
+    else:
+        passing = 1.
+    records = db._records
+    estimates = []
+
+    if len(steps) == 1:
+        estimate = StepEstimate("info")
+        estimate.records = len(known)
+        estimate.queries = sum(1 for recid in known if force or
+                               recid not in records or
+                               not records[recid].info_dl)
+        estimate.pages = estimate.queries
+        return [estimate]
+
+    for step in steps[1:]:
+        estimate = StepEstimate(step)
+        estimate.records = len(known) + unknown
+        estimates.append(estimate)
+        if step in ["counts", "n"]:
+            missing = unknown + sum(
+                1 for recid in known if force or recid not in records or
+                records[recid].citation_count < 0)
+            estimate.queries = missing
+            estimate.pages = math.ceil(missing / count_batch)
+            estimate.new_records = unknown
+            continue
+        if step not in ["refs", "r", "cites", "c", "refscites", "rc", "cr",
+                        "citesrefs"]:
+            logger.error("Unrecognize update option {}. Ignoring it in the "
+                         "estimate.".format(step))
+            continue
+        found = set()
+        new_unknown = 0.
+        if step in ["refs", "r", "refscites", "rc", "cr", "citesrefs"]:
+            for recid in known:
+                record = records.get(recid)
+                if record is not None and record.references_dl and \
+                        not force:
+                    found |= record.references
+                    continue
+                estimate.queries += 1
+                estimate.pages += _pages(avg_references)
+                new_unknown += avg_references
+            estimate.queries += unknown
+            estimate.pages += unknown * _pages(avg_references)
+            new_unknown += unknown * avg_references
+        if step in ["cites", "c", "refscites", "rc", "cr", "citesrefs"]:
+            without_count = unknown
+            for recid in known:
+                record = records.get(recid)
+                if record is not None and record.citations_complete and \
+                        not force:
+                    found |= record.citations
+                    continue
+                if record is None or record.citation_count < 0:
+                    without_count += 1
+                    continue
+                count = record.citation_count
+                if count < min_citations:
+                    continue
+                found |= record.citations
+                estimate.queries += 1
+                estimate.pages += _pages(count)
+                new_unknown += max(0, count - len(record.citations))
+            if min_citations > 0:
+                # counts are downloaded first
+                estimate.pages += math.ceil(without_count / count_batch)
+                without_count *= passing
+            estimate.queries += without_count
+            estimate.pages += without_count * _pages(avg_citations)
+            new_unknown += without_count * avg_citations
+        known |= found
+        unknown += new_unknown
+        estimate.new_records = unknown + sum(1 for recid in known
+                                             if recid not in records)
+    return estimates
+
+
+def estimate_updates(db, updates: Iterable[str], recids: Iterable[str],
+                     force=False) -> List[StepEstimate]:
+    """ Estimates for all get strings (see estimate_update). """
+    estimates = []
+    for update in updates:
+        estimates.extend(estimate_update(db, update, recids, force=force))
+    return estimates
+
+
+def report(estimates: List[StepEstimate],
+           seconds_per_page=download_sleep + request_latency) -> None:
+    """ Log the estimates and their total. """
+    for estimate in estimates:
+        logger.info("Step {}: {:.0f} records, {:.0f} queries, {:.0f} pages, "
+                    "{:.0f} new records, {}.".format(
+                        estimate.step, estimate.records, estimate.queries,
+                        estimate.pages, estimate.new_records,
+                        _duration(estimate.seconds(seconds_per_page))))
+    pages = sum(estimate.pages for estimate in estimates)
+    logger.info("Total: {:.0f} queries, {:.0f} pages (downloads), about "
+                "{} at {:.1f} s per download. Records found in later steps "
+                "are not known yet, so these are upper bounds.".format(
+                    sum(estimate.queries for estimate in estimates), pages,
+                    _duration(pages * seconds_per_page), seconds_per_page))
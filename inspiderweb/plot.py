@@ -0,0 +1,217 @@
+from .dotgraph import DotGraph
+from .svggraph import SvgGraph
+from .cli import get_plot_connections
+from .analytics import filter_connections
+from .reduction import reduce_connections
+from .community import detect_communities
+from .graph import Graph
+from .parallel import fork_map
+from .log import logger
+from typing import Iterable, List, Tuple
+import os.path
+import csv
+import collections
+
+""" Part of inspiderweb: Tool to analyze paper reference networks.
+Inspiderweb currently hosted at: https://github.com/klieret/inspiderweb
+
+This file puts together the steps from the plot rules to the finished
+DotGraph/SvgGraph (selection of the connections, reduction, centralities),
+so that they can be shared by the command line interface, the server and
+batch jobs, and writes huge graphs split into several files.
+"""
+
+formats = ["dot", "svg"]
+
+
+def select_connections(db, rules: Iterable[str], seeds: Iterable[str],
+                       transitive=False, kcore=0, top=0, top_by="indegree",
+                       centrality="", min_centrality=None,
+                       connections=None) -> set:
+    """ Select the connections according to the plot rules and reduce
+    them (see make_graph for the arguments).
+
+    Returns:
+        Set of two-tuples of recids
+    """
+    if connections is None:
+        connections = get_plot_connections(rules, seeds, db)
+    connections = reduce_connections(connections, db, transitive=transitive,
+                                     kcore=kcore, top=top, top_by=top_by)
+    if centrality and min_centrality is not None:
+        connections = filter_connections(
+            connections, db.analytics.scores(centrality), min_centrality)
+    return connections
+
+
+def make_graph(db, config, rules: Iterable[str], seeds: Iterable[str],
+               output_format="dot", rank="", transitive=False, kcore=0,
+               top=0, top_by="indegree", centrality="", min_centrality=None,
+               connections=None, communities=False, collapse=False):
+    """ Build the graph of the connections selected by the plot rules and
+    generate its dot/svg string.
+
+    Args:
+        db: Database
+        config: "dotgraph" section of the configuration
+        rules: Plot rules (see cli.get_plot_connections)
+        seeds: Seed recids
+        output_format: "dot" or "svg"
+        rank: Rank option of DotGraph.generate_dot_str
+        transitive, kcore, top, top_by: See reduction.reduce_connections
+        centrality: If given: scale the nodes according to this measure
+                    (see analytics.measures)
+        min_centrality: If given: Only keep connections between nodes with
+                        at least this centrality
+        connections: Use these connections instead of the ones selected by
+                     $rules (e.g. the result of a query).
+        communities: Draw the communities of the connections as clusters
+        collapse: Replace every community by one node
+    Returns:
+        DotGraph or SvgGraph with the generated string.
+    """
+    connections = select_connections(
+        db, rules, seeds, transitive=transitive, kcore=kcore, top=top,
+        top_by=top_by, centrality=centrality, min_centrality=min_centrality,
+        connections=connections)
+    if output_format == "svg":
+        dg = SvgGraph(db, config)
+    else:
+        dg = DotGraph(db, config)
+    if centrality:
+        scores = db.analytics.scores(centrality)
+        dg.scale_nodes({recid: scores.get(recid, 0)
+                        for connection in connections
+                        for recid in connection})
+    dg.add_connections(connections)
+    if communities or collapse:
+        dg.add_communities(detect_communities(connections), collapse=collapse)
+    if output_format == "svg":
+        dg.generate_svg_str(rank=rank)
+    else:
+        dg.generate_dot_str(rank=rank)
+    return dg
+
+
+def split_connections(db, connections: set, split="components",
+                      slice_years=10, min_records=5) -> List[Tuple[str, set]]:
+    """ Split the connections into parts that can be drawn independently.
+
+    Args:
+        db: Database
+        connections: Set of two-tuples of recids
+        split: "components": one part per connected component (components
+               with less than $min_records records are put together in
+               one part); "years": one part per $slice_years years of
+               the publication year of the citing record.
+        slice_years: See $split
+        min_records: See $split
+    Returns:
+        List of two-tuples (name of the part, set of connections).
+    """
+    parts = []
+    if split == "components":
+        graph = Graph.from_connections(connections)
+        component = graph.weakly_connected_components()
+        by_component = collections.defaultdict(set)
+        for connection in connections:
+            by_component[component[graph.index[connection[0]]]].add(
+                connection)
+        small = set()
+        for label in sorted(by_component):
+            part = by_component[label]
+            records = {recid for connection in part for recid in connection}
+            if len(records) < min_records:
+                small |= part
+            else:
+                parts.append(("component_{:03d}".format(label), part))
+        if small:
+            parts.append(("small_components", small))
+    elif split == "years":
+        by_slice = collections.defaultdict(set)
+        for connection in connections:
+            year = db.get_year(connection[0])
+            by_slice[year // slice_years if year else None].add(connection)
+        for first_year in sorted(key for key in by_slice if key is not None):
+            parts.append(("{}-{}".format(
+                first_year * slice_years,
+                (first_year + 1) * slice_years - 1),
+                by_slice[first_year]))
+        if None in by_slice:
+            parts.append(("unknown_year", by_slice[None]))
+    else:
+        raise ValueError("Unknown split {}".format(split))
+    return parts
+
+
+# State shared with the processes that write the parts (see write_parts)
+_split_state = None
+
+
+def _write_part(part_number: int) -> Tuple[str, int, int]:
+    db, config, parts, output, options = _split_state
+    name, connections = parts[part_number]
+    root, extension = os.path.splitext(output)
+    path = "{}_{}{}".format(root, name, extension)
+    dg = make_graph(db, config, [], [], connections=connections, **options)
+    dg.write_to_file(path)
+    records = {recid for connection in connections for recid in connection}
+    return path, len(records), len(connections)
+
+
+def write_parts(db, config, rules: Iterable[str], seeds: Iterable[str],
+                output: str, split="components", slice_years=10,
+                processes=1, connections=None, **options) -> List[str]:
+    """ Select the connections (like make_graph), split them (see
+    split_connections) and write one file per part in parallel. The files
+    are named after $output with the name of the part appended. An index
+    of the parts (csv file) is written to $output with .index.csv
+    appended.
+
+    Args:
+        db: Database
+        config: "dotgraph" section of the configuration
+        rules, seeds, connections: See make_graph
+        output: Path
+        split, slice_years: See split_connections
+        processes: Number of processes
+        **options: Further options of make_graph
+    Returns:
+        List of the written paths (the index last).
+    """
+    global _split_state
+    connections = select_connections(
+        db, rules, seeds, connections=connections,
+        **{key: options.pop(key) for key in
+           ["transitive", "kcore", "top", "top_by", "min_centrality"]
+           if key in options},
+        centrality=options.get("centrality", ""))
+    parts = split_connections(db, connections, split=split,
+                              slice_years=slice_years)
+    logger.info("Writing {} connections in {} parts.".format(
+        len(connections), len(parts)))
+    if options.get("centrality"):
+        # compute before forking
+        db.analytics.scores(options["centrality"])
+    _split_state = (db, config, parts, output, options)
+    try:
+        written = fork_map(_write_part, [(number,) for number in
+                                         range(len(parts))],
+                           processes=processes)
+    finally:
+        _split_state = None
+    index_path = output + ".index.csv"
+    with open(index_path, "w") as index_file:
+        writer = csv.writer(index_file, delimiter=";")
+        writer.writerow(["part", "file", "records", "connections"])
+        for (name, _), (path, n_records, n_connections) in zip(parts,
+                                                                written):
+            writer.writerow([name, path, n_records, n_connections])
+    return [path for path, _, _ in written] + [index_path]
+
+
+def graph_str(dg) -> str:
+    """ Dot or svg string of a graph returned by make_graph. """
+    if isinstance(dg, SvgGraph):
+        return dg.return_svg_str()
+    return dg.return_dot_str()
@@ -1,8 +1,13 @@
 import os.path
 from .log import logger
+from .storage import atomic_write
 import sys
 import re
-from typing import List
+import mmap
+import json
+import hashlib
+import concurrent.futures
+from typing import List, Iterable
 
 """ Part of inspiderweb: Tool to analyze paper reference networks.
 Inspiderweb currently hosted at: https://github.com/klieret/inspiderweb
@@ -19,14 +24,257 @@ The fact that all of the functions can take the db argument (even if they
 don't need it) is to make wrapping via
     get_recids_from_paths
 easier.
+The get_recids_from_[....]_paths functions do not call the file functions
+one by one, but use extract_from_paths, which scans all files for the raw
+identifiers (recids, bibkeys, urls) first (optionally in parallel over a
+process pool) and merges them, so that e.g. all bibkeys are resolved at
+once.
+If a Manifest is given, files whose modification time and size did not
+change since the last run are not read at all and their identifiers are
+taken from the manifest instead. Files whose modification time changed,
+but whose content hash didn't, are only hashed, not scanned.
 """
 
+# Files with these extensions are skipped when walking through directories.
+binary_extensions = {".pdf", ".ps", ".eps", ".dvi", ".png", ".jpg", ".jpeg",
+                     ".gif", ".svg", ".zip", ".gz", ".tgz", ".bz2", ".xz",
+                     ".tar", ".pickle", ".pyc", ".o", ".so", ".aux", ".log",
+                     ".synctex", ".toc", ".out", ".blg", ".fls"}
+# Files bigger than this [bytes] are skipped when walking through directories.
+max_file_size = 50 * 1024 * 1024
+
+bibkey_regex = re.compile(rb"[a-zA-Z]{1,20}:[0-9]{4}[a-z]{0,10}")
+url_regex = re.compile(rb"inspirehep.net/record/([0-9]+)")
+
+
+def _scan_recids(data) -> set:
+    new_recids = set()
+    for line in data[:].splitlines():
+        line = line.strip()
+        if line:
+            new_recids.add(line.decode("utf-8", "replace"))
+    return new_recids
+
+
+def _scan_bibkeys(data) -> set:
+    return {bibkey.decode("ascii") for bibkey in bibkey_regex.findall(data)}
+
+
+def _scan_urls(data) -> set:
+    return {recid.decode("ascii") for recid in url_regex.findall(data)}
+
+
+_scanners = {"recid": _scan_recids,
+             "bibkey": _scan_bibkeys,
+             "url": _scan_urls}
+
+
+def is_binary(path: str, block_size=8192) -> bool:
+    """ Guess whether the file at $path is binary (i.e. contains a null
+    byte in its first $block_size bytes). """
+    with open(path, "rb") as stream:
+        return b"\0" in stream.read(block_size)
+
+
+def extract_from_file(path: str, kind: str) -> set:
+    """ Scan a file for identifiers. Binary files are skipped.
+
+    Args:
+        path: Path to a file
+        kind: "recid" (every line is a recid), "bibkey" or "url"
+              (search for inspirehep urls and take the recid)
+    Returns:
+        Set of identifiers (recids or bibkeys) as strings.
+    """
+    if os.path.getsize(path) == 0 or is_binary(path):
+        return set()
+    with open(path, "rb") as stream:
+        with mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return _scanners[kind](data)
+
+
+def _extract_from_file(args):
+    # helper for ProcessPoolExecutor.map, which only takes one argument
+    # and which also returns the path and the hash of the file. If the
+    # hash is the known hash, the file is not scanned and the identifiers
+    # are None.
+    path, kind, known_digest = args
+    if os.path.getsize(path) == 0 or is_binary(path):
+        return path, set(), ""
+    with open(path, "rb") as stream:
+        with mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            digest = hashlib.sha1(data).hexdigest()
+            if digest == known_digest:
+                return path, None, digest
+            return path, _scanners[kind](data), digest
+
+
+class Manifest(object):
+    """ Remembers for every scanned file its modification time, size,
+    content hash and the identifiers found in it, so that unchanged files
+    need not be scanned again. Bibkeys are not resolved here (the Database
+    remembers its lookups, see Database.get_recids_from_bibkeys, so
+    that failed lookups are retried after a while). Saved as json file
+    (only if it changed and if not $read_only).
+    """
+    def __init__(self, path="", read_only=False):
+        self.path = path
+        self.read_only = read_only
+        self._files = {}  # kind: {absolute path: entry}
+        self._changed = False
+        if path and os.path.exists(path):
+            with open(path, "r") as stream:
+                self._files = json.load(stream)["files"]
+            logger.debug("Loaded manifest from {}".format(path))
+
+    @staticmethod
+    def _key(path: str) -> str:
+        return os.path.abspath(path)
+
+    def get(self, path: str, kind: str) -> dict:
+        """ Return the entry for file $path (a dictionary with the keys
+        mtime, size, hash and identifiers), None if the file is
+        unknown. """
+        return self._files.get(kind, {}).get(self._key(path))
+
+    def get_unchanged(self, path: str, kind: str) -> dict:
+        """ Like get, but only return the entry if the modification time
+        and the size of the file did not change. """
+        entry = self.get(path, kind)
+        if entry is None:
+            return None
+        stat = os.stat(path)
+        if entry["mtime"] != stat.st_mtime_ns or entry["size"] != stat.st_size:
+            return None
+        return entry
+
+    def update(self, path: str, kind: str, digest: str,
+               identifiers: set) -> dict:
+        stat = os.stat(path)
+        entry = {"mtime": stat.st_mtime_ns,
+                 "size": stat.st_size,
+                 "hash": digest,
+                 "identifiers": sorted(identifiers)}
+        files = self._files.setdefault(kind, {})
+        if files.get(self._key(path)) != entry:
+            files[self._key(path)] = entry
+            self._changed = True
+        return entry
+
+    def save(self):
+        if not self.path or self.read_only or not self._changed:
+            return
+        with atomic_write(self.path, "w") as stream:
+            json.dump({"version": 1, "files": self._files}, stream)
+        self._changed = False
+        logger.debug("Saved manifest to {}".format(self.path))
+
+
+def list_files(paths: Iterable[str]) -> List[str]:
+    """ List all files that should be scanned: If a path points to a file,
+    take this file, if it points to a directory, walk through that whole
+    directory. Inside of directories, hidden files and directories, files
+    with an extension in $binary_extensions and files bigger than
+    $max_file_size are skipped.
+    """
+    files = []
+    for path in paths:
+        if not os.path.exists(path):
+            logger.critical("Input file {} doesn't exist. Abort.".format(path))
+            sys.exit(50)
+        if os.path.isfile(path):
+            files.append(path)
+            continue
+        for root, dirs, filenames in os.walk(path):
+            dirs[:] = [d for d in dirs if not d.startswith(".")]
+            for filename in filenames:
+                if filename.startswith("."):
+                    continue
+                if os.path.splitext(filename)[1].lower() in binary_extensions:
+                    continue
+                file_path = os.path.join(root, filename)
+                if os.path.getsize(file_path) > max_file_size:
+                    logger.warning("Skipping {}, because it's too "
+                                   "big.".format(file_path))
+                    continue
+                files.append(file_path)
+    return files
+
+
+def scan_paths(paths: Iterable[str], kind: str, processes=1,
+               manifest=None) -> dict:
+    """ Scan all files in $paths (see list_files) for identifiers.
+
+    Args:
+        paths: List of paths of directories or files.
+        kind: See extract_from_file
+        processes: If > 1: Scan the files in that many worker processes.
+        manifest: Manifest. Files that did not change since they were
+                  recorded in there are not scanned again.
+    Returns:
+        Dictionary path: manifest entry (see Manifest.get)
+    """
+    if manifest is None:
+        manifest = Manifest()
+    entries = {}
+    to_scan = []
+    for path in list_files(paths):
+        entry = manifest.get_unchanged(path, kind)
+        if entry is not None:
+            entries[path] = entry
+            continue
+        # only the modification time changed (e.g. after a checkout)?
+        entry = manifest.get(path, kind)
+        known_digest = ""
+        if entry is not None and entry["size"] == os.path.getsize(path):
+            known_digest = entry["hash"]
+        to_scan.append((path, kind, known_digest))
+    logger.debug("Skipping {} unchanged files, scanning {} files.".format(
+        len(entries), len(to_scan)))
+
+    if processes > 1 and len(to_scan) > 1:
+        with concurrent.futures.ProcessPoolExecutor(processes) as executor:
+            results = list(executor.map(
+                _extract_from_file, to_scan,
+                chunksize=max(1, len(to_scan) // (4 * processes))))
+    else:
+        results = [_extract_from_file(args) for args in to_scan]
+
+    for path, identifiers, digest in results:
+        if identifiers is None:
+            identifiers = manifest.get(path, kind)["identifiers"]
+        if identifiers:
+            logger.debug("Got {} {}s from file {}.".format(
+                len(identifiers), kind, path))
+        entries[path] = manifest.update(path, kind, digest, identifiers)
+    return entries
+
+
+def extract_from_paths(paths: Iterable[str], kind: str, processes=1,
+                       manifest=None) -> set:
+    """ Scan all files in $paths (see list_files) for identifiers and merge
+    the results. See scan_paths for the arguments.
+
+    Returns:
+        Set of identifiers.
+    """
+    entries = scan_paths(paths, kind, processes=processes, manifest=manifest)
+    identifiers = set()
+    for entry in entries.values():
+        identifiers.update(entry["identifiers"])
+    logger.info("Got {} {}s from {} files.".format(len(identifiers), kind,
+                                                   len(entries)))
+    if manifest is not None:
+        manifest.save()
+    return identifiers
+
 
 def get_recids_from_paths(paths: List[str], extractor, db=None) -> set():
     """ Iterate over $paths. If $path points to a file, apply
     $function($path, db=$db) and add the returned values to a set.
     If $path points to a directory, walk through
-    that whole directory and apply $function to every file, just as above.
+    that whole directory and apply $function to every file, just as above
+    (skipping the files that list_files skips).
 
     Args:
         paths (list(str)): List of paths of directories or files.
@@ -37,27 +285,12 @@ def get_recids_from_paths(paths: List[str], extractor, db=None) -> set():
         The merged return values of all calls of $function.
     """
     new_recids = set()
-    for path in paths:
-        if not os.path.exists(path):
-            logger.critical("Input file {} doesn't exist. Abort.".format(path))
-            sys.exit(50)
-        if os.path.isdir(path):
-            for root, dirs, files in os.walk(path):
-                # fixme: skip hidden files
-                for file in files:
-                    these_new_recids = \
-                        extractor(os.path.join(root, file), db=db)
-                    if these_new_recids:
-                        logger.info("Got {} seeds from bibkeys from file "
-                                    "{}.".format(len(these_new_recids),
-                                                 os.path.join(root, file)))
-                    new_recids.update(these_new_recids)
-
-        if os.path.isfile(path):
-            these_new_recids = extractor(path, db=db)
-            new_recids.update(these_new_recids)
-            logger.info("Got {} seeds from bibkeys from file {}.".format(
+    for path in list_files(paths):
+        these_new_recids = extractor(path, db=db)
+        if these_new_recids:
+            logger.info("Got {} seeds from file {}.".format(
                 len(these_new_recids), path))
+        new_recids.update(these_new_recids)
     return new_recids
 
 
@@ -70,18 +303,12 @@ def get_recids_from_recid_file(path: str, db=None) -> set():
     Returns:
         Set of recids.
     """
-    new_recids = set()
-    with open(path, "r") as seedfile_stream:
-        for line in seedfile_stream:
-            line = line.replace('\n', "").strip()
-            if not line:
-                continue
-            new_recids.add(line)
-    return new_recids
+    return extract_from_file(path, "recid")
 
 
 # noinspection PyUnusedLocal
-def get_recids_from_recid_paths(paths: List[str], db=None) -> set():
+def get_recids_from_recid_paths(paths: List[str], db=None,
+                                processes=1, manifest=None) -> set():
     """ Get recids from a list of paths.
     If a $path points to a file, we get interpret every line as a recid
     and add all of them to a set.
@@ -90,10 +317,13 @@ def get_recids_from_recid_paths(paths: List[str], db=None) -> set():
     Args:
         paths (list(path)): Paths to files or directories.
         db: Can be left empty.
+        processes: Number of processes to scan the files with.
+        manifest: Manifest to skip unchanged files.
     Returns:
         set of recids.
     """
-    return get_recids_from_paths(paths, get_recids_from_recid_file)
+    return extract_from_paths(paths, "recid", processes=processes,
+                              manifest=manifest)
 
 
 def get_recids_from_bibkey_file(path: str, db) -> set():
@@ -104,29 +334,35 @@ def get_recids_from_bibkey_file(path: str, db) -> set():
     Returns:
         Set of recids.
     """
-    bibkey_regex = re.compile(r"[a-zA-Z]{1,20}:[0-9]{4}[a-z]{0,10}")
-    with open(path, "r") as bibfile:
-        bibkeys = set()
-        for bibline in bibfile:
-            bibkeys.update(bibkey_regex.findall(bibline))
-    bibkey_recids = db.get_recids_from_bibkeys(bibkeys).keys()
-    return bibkey_recids
+    bibkeys = extract_from_file(path, "bibkey")
+    return set(db.get_recids_from_bibkeys(bibkeys).values())
 
 
-def get_recids_from_bibkey_paths(paths: List[str], db) -> set():
+def get_recids_from_bibkey_paths(paths: List[str], db, processes=1,
+                                 manifest=None) -> set():
     """ Get recids from a list of paths.
     If a $path points to a file, we search it for bibkeys, query inspirehep
     for the bibkey, and -- if there is a direct match -- add this to a
     set of return recids.
     If $path points to a directory, walk through
     that whole directory and apply do the same for every file in there.
+    The bibkeys of all files are resolved together (the Database remembers
+    its lookups). Files that did not change since they were recorded in
+    $manifest are not read again.
     Args:
         paths (list(path)): Paths to files or directories.
         db: Database. Must be supplied!
+        processes: Number of processes to scan the files with.
+        manifest: Manifest to skip unchanged files.
     Returns:
         set of recids.
     """
-    return get_recids_from_paths(paths, get_recids_from_bibkey_file, db=db)
+    bibkeys = extract_from_paths(paths, "bibkey", processes=processes,
+                                 manifest=manifest)
+    logger.info("Resolving {} bibkeys.".format(len(bibkeys)))
+    if not bibkeys:
+        return set()
+    return set(db.get_recids_from_bibkeys(bibkeys).values())
 
 
 # noinspection PyUnusedLocal
@@ -140,16 +376,12 @@ def get_recids_from_url_file(path: str, db=None) -> set():
     Returns:
         Set of recids.
     """
-    url_regex = re.compile("inspirehep.net/record/([0-9]+)")
-    new_recids = set()
-    with open(path, "r") as stream:
-        for line in stream:
-            new_recids.update(url_regex.findall(line))
-    return new_recids
+    return extract_from_file(path, "url")
 
 
 # noinspection PyUnusedLocal
-def get_recids_from_url_paths(paths: List[str], db=None) -> set():
+def get_recids_from_url_paths(paths: List[str], db=None, processes=1,
+                              manifest=None) -> set():
     """ Get recids from a list of paths.
     If a $path points to a file, we search it for inspirehep urls which are
     then added to the return set.
@@ -158,10 +390,13 @@ def get_recids_from_url_paths(paths: List[str], db=None) -> set():
     Args:
         paths (list(path)): Paths to files or directories.
         db: Can be left empty.
+        processes: Number of processes to scan the files with.
+        manifest: Manifest to skip unchanged files.
     Returns:
         set of recids.
     """
-    return get_recids_from_paths(paths, get_recids_from_url_file)
+    return extract_from_paths(paths, "url", processes=processes,
+                              manifest=manifest)
 
 
 def get_recid_from_queries(queries: List[str], db) -> set():
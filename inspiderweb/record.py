@@ -1,3 +1,5 @@
+import re
+
 """ Part of inspiderweb: Tool to analyze paper reference networks.
 Inspiderweb currently hosted at: https://github.com/klieret/inspiderweb
 
@@ -5,6 +7,17 @@ This file defines the Record class which collects the necessary information
 we need from one record/one paper on inspirehep.
 """
 
+year_regex = re.compile(r".*:([0-9]{4}).*")
+
+
+def year_from_bibkey(bibkey: str) -> int:
+    """ Return the year from a bibkey such as Davies:2016ruz (or 0 if the
+    bibkey doesn't contain a year). """
+    match = year_regex.match(bibkey)
+    if not match:
+        return 0
+    return int(match.group(1))
+
 
 class Record(object):
     """ Instances of the record class describe one paper/record from
@@ -15,36 +28,67 @@ class Record(object):
         self.fulltext_url = ""
         self.custom_label = label
         self.bibkey = ""
+        self.year = 0  # publication year, 0 if unknown
+        # number of citations on inspirehep (which might be more than we
+        # downloaded), -1 if unknown
+        self.citation_count = -1
         self.recid = recid
         self.references = set([])
         self.citations = set([])
         self.cocitations = set([])
+        # recid: number of records citing both records (only for the
+        # strongest co-citations, which are also collected in cocitations)
+        self.cocitation_weights = {}
+        # recid: number of shared references (bibliographic coupling)
+        self.coupling_weights = {}
         self.references_dl = False
         self.citations_dl = False
         self.cocitations_dl = False
         self.info_dl = False
 
+    def __setstate__(self, state):
+        # Records pickled by older versions might not have all attributes
+        # yet, so we start from the defaults.
+        self.__dict__.update(Record(state["recid"]).__dict__)
+        self.__dict__.update(state)
+
     def __eq__(self, other):
         return self.__dict__ == other.__dict__
 
-    def merge(self, other) -> None:
-        """ Merge this record with another Record
+    def merge(self, other) -> list:
+        """ Merge this record with another Record.
+        If both records have a different bibkey (inspire_url), we keep ours
+        and report it as a conflict.
+
         Args:
          other: other record to be merged into this one
 
-        Returns: None
+        Returns: List of conflicts, i.e. three-tuples (attribute name,
+            our value, their value).
         """
 
-        assert self.inspire_url == other.inspire_url
-        if self.bibkey and other.bibkey:
-            assert self.bibkey == other.bibkey
+        assert self.recid == other.recid
+        conflicts = []
+        if self.inspire_url != other.inspire_url:
+            conflicts.append(("inspire_url", self.inspire_url,
+                              other.inspire_url))
+        if self.bibkey and other.bibkey and self.bibkey != other.bibkey:
+            conflicts.append(("bibkey", self.bibkey, other.bibkey))
         if not self.bibkey:
             self.bibkey = other.bibkey
-        assert self.recid == other.recid
+        if not self.year:
+            self.year = other.year
+        self.citation_count = max(self.citation_count, other.citation_count)
 
-        self.references.update(other.references)
-        self.citations.update(other.citations)
-        self.cocitations.update(other.cocitations)
+        self.references |= other.references
+        self.citations |= other.citations
+        self.cocitations |= other.cocitations
+        for recid, weight in other.cocitation_weights.items():
+            self.cocitation_weights[recid] = max(
+                weight, self.cocitation_weights.get(recid, 0))
+        for recid, weight in other.coupling_weights.items():
+            self.coupling_weights[recid] = max(
+                weight, self.coupling_weights.get(recid, 0))
 
         self.references_dl |= other.references_dl
         self.citations_dl |= other.citations_dl
@@ -55,6 +99,18 @@ class Record(object):
             self.custom_label = other.custom_label
         if not self.fulltext_url:
             self.fulltext_url = other.fulltext_url
+        return conflicts
+
+    @property
+    def citations_complete(self) -> bool:
+        """ Do we know all citations of this record? Either they were
+        downloaded or we know as many citing records (e.g. from their
+        references) as the citation count. The latter is checked anew every
+        time (and never stored as citations_dl), so that downloading a
+        newer citation count (see Database.get_citation_counts) makes us
+        download the citations again. """
+        return self.citations_dl or \
+            0 <= self.citation_count <= len(self.citations)
 
     @property
     def label(self):
@@ -0,0 +1,131 @@
+from .log import logger
+from .graph import Graph
+from .analytics import _core_numbers
+from typing import Dict
+
+""" Part of inspiderweb: Tool to analyze paper reference networks.
+Inspiderweb currently hosted at: https://github.com/klieret/inspiderweb
+
+Collection of passes that reduce the set of connections (as returned by
+cli.get_plot_connections) before it is handed to the DotGraph, so that the
+resulting dot file stays renderable. Every pass takes a set of two-tuples
+of recids and returns a new one.
+"""
+
+
+def _nodes(connections: set) -> set:
+    return {recid for connection in connections for recid in connection}
+
+
+def _report(name: str, before: set, after: set) -> None:
+    logger.info("{}: Removed {} of {} connections and {} of {} "
+                "nodes.".format(name, len(before) - len(after), len(before),
+                                len(_nodes(before)) - len(_nodes(after)),
+                                len(_nodes(before))))
+
+
+def transitive_reduction(connections: set) -> set:
+    """ Remove every connection a -> c for which there is another path
+    a -> b -> ... -> c, i.e. which is implied by other citations.
+    Connections inside of citation cycles are kept.
+    Note that reachability is stored as one bitmask per node, so memory
+    grows quadratically with the number of nodes.
+
+    Args:
+        connections: set of two-tuples of recids
+    Returns:
+        set of two-tuples of recids
+    """
+    graph = Graph.from_connections(connections)
+    component = graph.strongly_connected_components()
+    n_components = max(component) + 1 if component else 0
+    successors = [set() for _ in range(n_components)]
+    for node in range(len(graph)):
+        for target in graph.references(node):
+            if component[node] != component[target]:
+                successors[component[node]].add(component[target])
+
+    # Components are numbered in reverse topological order, so all
+    # successors of a component are handled before the component itself.
+    reachable = [0] * n_components
+    kept = set()
+    for comp in range(n_components):
+        indirect = 0
+        for successor in successors[comp]:
+            indirect |= reachable[successor]
+        for successor in successors[comp]:
+            if not indirect >> successor & 1:
+                kept.add((comp, successor))
+        reachable[comp] = indirect
+        for successor in successors[comp]:
+            reachable[comp] |= 1 << successor
+
+    reduced = set()
+    for source, target in connections:
+        source_comp = component[graph.index[source]]
+        target_comp = component[graph.index[target]]
+        if source_comp == target_comp or (source_comp, target_comp) in kept:
+            reduced.add((source, target))
+    _report("Transitive reduction", connections, reduced)
+    return reduced
+
+
+def k_core(connections: set, k: int) -> set:
+    """ Only keep the k-core, i.e. the largest subnetwork in which every
+    node is connected to at least $k other nodes.
+
+    Args:
+        connections: set of two-tuples of recids
+        k: Minimal core number
+    Returns:
+        set of two-tuples of recids
+    """
+    core = _core_numbers(Graph.from_connections(connections))
+    reduced = {(source, target) for source, target in connections
+               if core[source] >= k and core[target] >= k}
+    _report("{}-core".format(k), connections, reduced)
+    return reduced
+
+
+def top_nodes(connections: set, scores: Dict[str, float], n: int) -> set:
+    """ Only keep connections between the $n nodes with the highest
+    scores.
+
+    Args:
+        connections: set of two-tuples of recids
+        scores: dictionary recid: score (e.g. from Analytics.scores)
+        n: Number of nodes to keep
+    Returns:
+        set of two-tuples of recids
+    """
+    nodes = sorted(_nodes(connections), key=lambda recid: scores.get(recid, 0),
+                   reverse=True)
+    keep = set(nodes[:n])
+    reduced = {(source, target) for source, target in connections
+               if source in keep and target in keep}
+    _report("Top {} nodes".format(n), connections, reduced)
+    return reduced
+
+
+def reduce_connections(connections: set, db, transitive=False, kcore=0,
+                       top=0, top_by="indegree") -> set:
+    """ Apply the reduction passes in the order top nodes, k-core, transitive
+    reduction (each one only if requested).
+
+    Args:
+        connections: set of two-tuples of recids
+        db: Database
+        transitive: Perform transitive reduction
+        kcore: If > 0: only keep the $kcore-core.
+        top: If > 0: only keep the $top nodes with the highest score.
+        top_by: Score to select the top nodes (see analytics.measures)
+    Returns:
+        set of two-tuples of recids
+    """
+    if top:
+        connections = top_nodes(connections, db.analytics.scores(top_by), top)
+    if kcore:
+        connections = k_core(connections, kcore)
+    if transitive:
+        connections = transitive_reduction(connections)
+    return connections
@@ -0,0 +1,185 @@
+import json
+import threading
+import socketserver
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from .cli import get_plot_connections
+from .plot import make_graph, graph_str, formats
+from .recidextractor import get_recid_from_queries
+from .log import logger
+
+""" Part of inspiderweb: Tool to analyze paper reference networks.
+Inspiderweb currently hosted at: https://github.com/klieret/inspiderweb
+
+This file implements a small HTTP server that keeps one Database loaded,
+so that many queries and plots can be made without reloading it every
+time (inspiderweb.py --serve PORT).
+
+All requests are POST requests with a json object as body (GET works for
+/statistics). Seeds are given as
+    "recids": list of recids, "bibkeys": list of bibkeys, "queries": list
+    of inspirehep queries
+Endpoints:
+    /statistics: number of records etc.
+    /resolve: {"recids": seed recids}
+    /autocomplete: additionally "get": list of strings as for --get and
+        "force": bool; returns {"recids": seeds and downloaded recids}
+    /connections: additionally "plot": list of plot rules; returns
+        {"connections": list of [from_recid, to_recid]}
+    /plot: additionally "format" ("dot" or "svg"), "rank", "transitive",
+        "kcore", "top", "topby", "centrality", "mincentrality",
+        "communities", "collapse" as the
+        command line options; returns the dot/svg string
+Requests are handled in parallel, but the Database is only accessed by one
+request at a time (also while a request waits for inspirehep, so a long
+/autocomplete blocks the other requests). After each request that changed
+the Database, the changed records are saved.
+"""
+
+
+class DatabaseServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, db, config):
+        """
+        Args:
+            address: Two-tuple (host, port)
+            db: Database (should have a backup_path to save to)
+            config: "dotgraph" section of the configuration
+        """
+        super().__init__(address, _RequestHandler)
+        self.db = db
+        self.config = config
+        self.lock = threading.Lock()
+        # forking from a process with several threads is not safe
+        db.background_saves = False
+
+    def persist(self) -> None:
+        """ Save the changed records. Must be called with the lock. """
+        if self.db._dirty and self.db.backup_path:
+            self.db.save()
+
+    def seeds(self, request: dict) -> set:
+        seeds = set(map(str, request.get("recids", [])))
+        bibkeys = request.get("bibkeys", [])
+        if bibkeys:
+            seeds.update(self.db.get_recids_from_bibkeys(bibkeys).values())
+        queries = request.get("queries", [])
+        if queries:
+            seeds.update(get_recid_from_queries(queries, db=self.db))
+        return seeds
+
+    def handle_request_data(self, path: str, request: dict):
+        """ Returns a json serializable object, a string or None if there
+        is no endpoint $path. """
+        with self.lock:
+            try:
+                if path == "/statistics":
+                    return {"records": len(self.db._records),
+                            "version": self.db.version}
+                seeds = self.seeds(request)
+                if path == "/resolve":
+                    return {"recids": sorted(seeds)}
+                elif path == "/autocomplete":
+                    recids = self.db.autocomplete_records(
+                        request.get("get", []),
+                        force=bool(request.get("force", False)),
+                        recids=seeds)
+                    return {"recids": sorted(recids)}
+                elif path == "/connections":
+                    connections = get_plot_connections(
+                        request.get("plot", ["seeds-seeds"]), seeds, self.db)
+                    return {"connections": sorted(map(list, connections))}
+                elif path == "/plot":
+                    output_format = request.get("format", "dot")
+                    if output_format not in formats:
+                        raise ValueError("Unknown format {}".format(
+                            output_format))
+                    return graph_str(make_graph(
+                        self.db, self.config,
+                        request.get("plot", ["seeds-seeds"]), seeds,
+                        output_format=output_format,
+                        rank=request.get("rank", ""),
+                        transitive=bool(request.get("transitive", False)),
+                        kcore=int(request.get("kcore", 0)),
+                        top=int(request.get("top", 0)),
+                        top_by=request.get("topby", "indegree"),
+                        centrality=request.get("centrality", ""),
+                        min_centrality=request.get("mincentrality"),
+                        communities=bool(request.get("communities", False)),
+                        collapse=bool(request.get("collapse", False))))
+                return None
+            finally:
+                self.persist()
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self._respond({})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            request = json.loads(self.rfile.read(length).decode("utf-8") or
+                                 "{}")
+        except ValueError as ex:
+            self._send(400, "text/plain", "Invalid json: {}".format(ex))
+            return
+        if not isinstance(request, dict):
+            self._send(400, "text/plain", "Expected a json object.")
+            return
+        self._respond(request)
+
+    def _respond(self, request: dict):
+        path = urllib.parse.urlparse(self.path).path
+        try:
+            result = self.server.handle_request_data(path, request)
+        except (ValueError, TypeError) as ex:
+            self._send(400, "text/plain", str(ex))
+            return
+        except SystemExit:
+            # e.g. invalid plot rules
+            self._send(400, "text/plain", "Invalid request, see log.")
+            return
+        except Exception as ex:
+            logger.exception("Request to {} failed.".format(path))
+            self._send(500, "text/plain", str(ex))
+            return
+        if result is None:
+            self._send(404, "text/plain", "Unknown endpoint {}".format(path))
+        elif isinstance(result, str):
+            self._send(200, "text/plain", result)
+        else:
+            self._send(200, "application/json", json.dumps(result))
+
+    def _send(self, code: int, content_type: str, body: str):
+        data = body.encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", content_type + "; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        logger.debug("{} {}".format(self.address_string(), format % args))
+
+
+def serve(db, config, port: int, host="127.0.0.1") -> None:
+    """ Serve the database until interrupted, then save it.
+
+    Args:
+        db: Database
+        config: "dotgraph" section of the configuration
+        port: Port
+        host: Host (default: only local connections)
+    """
+    server = DatabaseServer((host, port), db, config)
+    logger.info("Serving the database on http://{}:{}/".format(host, port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Stopping the server.")
+    finally:
+        server.server_close()
+        with server.lock:
+            db.save()
@@ -0,0 +1,399 @@
+import os
+import os.path
+import pickle
+import sqlite3
+import zlib
+import contextlib
+import concurrent.futures
+from typing import Dict, Iterable, Iterator, List, Tuple
+from .parallel import fork_map
+from .log import logger
+
+""" Part of inspiderweb: Tool to analyze paper reference networks.
+Inspiderweb currently hosted at: https://github.com/klieret/inspiderweb
+
+This file implements the on-disk layouts of the Database (apart from the
+plain pickle file, which is handled by the Database itself).
+
+Sharded layout: A directory containing
+    meta.pickle: everything but the records (number of shards, bibkey
+                 lookups, ...)
+    shard_000.pickle, shard_001.pickle, ...: dictionaries recid: Record
+The shard of a record is given by shard_of(recid, number of shards), so that
+only the shards with changed records need to be written. The shards are
+written in parallel (forked) processes. Several sharded databases with the
+same number of shards are merged shard by shard in parallel processes
+(see read_sharded_merged). One sharded database is read in parallel
+threads, but unpickled in this process, because sending the records back
+from another process would cost as much as unpickling them here.
+
+Indexed layout: One sqlite file with the tables
+    meta: one row with the pickled meta information
+    records: recid (primary key), pickled Record
+so that single records (and thus the neighbourhood of some seeds) can be
+loaded without reading the whole database.
+"""
+
+meta_filename = "meta.pickle"
+# Number of shards if nothing else is specified
+default_shards = 16
+# New databases whose path ends with this are saved in the indexed layout
+indexed_extension = ".sqlite"
+# Maximal number of recids per "IN (...)" query
+_query_chunk_size = 500
+
+
+@contextlib.contextmanager
+def atomic_write(path: str, mode="wb"):
+    """ Context manager that yields a stream to write the file at $path.
+    The data is written to a temporary file next to it, flushed to disk and
+    then renamed to $path, so that $path either contains the old or the new
+    data, even if we crash while writing. """
+    tmp_path = "{}.tmp{}".format(path, os.getpid())
+    try:
+        with open(tmp_path, mode) as stream:
+            yield stream
+            stream.flush()
+            os.fsync(stream.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    # make sure the rename itself is on disk
+    try:
+        directory = os.open(os.path.dirname(os.path.abspath(path)),
+                            os.O_RDONLY)
+    except OSError:
+        # e.g. not supported on windows
+        return
+    try:
+        os.fsync(directory)
+    except OSError:
+        pass
+    finally:
+        os.close(directory)
+
+
+def shard_of(recid: str, n_shards: int) -> int:
+    """ Shard of the record with id $recid. Uses crc32 instead of hash(),
+    as the latter changes from one python process to the next. """
+    return zlib.crc32(recid.encode("ascii")) % n_shards
+
+
+def shard_path(path: str, shard: int) -> str:
+    return os.path.join(path, "shard_{:03d}.pickle".format(shard))
+
+
+def is_sharded(path: str) -> bool:
+    return os.path.isdir(path)
+
+
+def read_n_shards(path: str) -> int:
+    """ Number of shards of the sharded database at $path (0 if there is
+    no sharded database at $path). """
+    meta_path = os.path.join(path, meta_filename)
+    if not os.path.exists(meta_path):
+        return 0
+    with open(meta_path, "rb") as meta_stream:
+        return pickle.load(meta_stream)["shards"]
+
+
+def _read_shard_bytes(path: str) -> bytes:
+    if not os.path.exists(path):
+        return b""
+    with open(path, "rb") as shard_stream:
+        return shard_stream.read()
+
+
+def _load_shard(data: bytes) -> dict:
+    if not data:
+        return {}
+    records = pickle.loads(data)
+    for recid, record in records.items():
+        assert recid == record.recid
+    return records
+
+
+def read_sharded(path: str, processes=1) -> Tuple[dict, Iterable[dict]]:
+    """ Read a sharded database.
+
+    Args:
+        path: Directory of the sharded database
+        processes: If > 1: Read the shard files in that many threads. The
+                   records are only unpickled here (one shard at a time,
+                   while the next shards are read), as sending them back
+                   from worker processes would pickle them once more.
+    Returns:
+        Two-tuple: The meta information (dictionary) and an iterable
+        of dictionaries recid: Record (one per shard).
+    """
+    with open(os.path.join(path, meta_filename), "rb") as meta_stream:
+        meta = pickle.load(meta_stream)
+    paths = [shard_path(path, shard) for shard in range(meta["shards"])]
+    if processes > 1:
+        return meta, _read_shards_parallel(paths, processes)
+    return meta, (_load_shard(_read_shard_bytes(path)) for path in paths)
+
+
+def _read_shards_parallel(paths: List[str], processes: int) -> \
+        Iterator[dict]:
+    with concurrent.futures.ThreadPoolExecutor(processes) as executor:
+        for data in executor.map(_read_shard_bytes, paths):
+            yield _load_shard(data)
+
+
+def _merge_shard(paths: List[str], shard: int) -> Tuple[dict, list]:
+    """ Merge shard $shard of the sharded databases at $paths (the first
+    ones win conflicts, see Record.merge).
+
+    Returns:
+        Two-tuple: dictionary recid: Record and list of conflicts
+        (recid, attribute, ours, theirs).
+    """
+    merged = {}
+    conflicts = []
+    for path in paths:
+        for recid, record in _load_shard(
+                _read_shard_bytes(shard_path(path, shard))).items():
+            ours = merged.get(recid)
+            if ours is None:
+                merged[recid] = record
+                continue
+            conflicts.extend((recid, attribute, our_value, their_value)
+                             for attribute, our_value, their_value in
+                             ours.merge(record))
+    return merged, conflicts
+
+
+def read_sharded_merged(paths: List[str], processes=1) -> \
+        Tuple[List[dict], List[Tuple[dict, list]]]:
+    """ Read several sharded databases with the same number of shards and
+    merge them. Every shard number is merged in a worker process, so only
+    the merged records are sent back.
+
+    Args:
+        paths: Directories of the sharded databases
+        processes: Number of processes
+    Returns:
+        Two-tuple: List of the meta information of the databases and list
+        of two-tuples (dictionary recid: Record, list of conflicts), one per
+        shard (see _merge_shard).
+    """
+    metas = []
+    for path in paths:
+        with open(os.path.join(path, meta_filename), "rb") as meta_stream:
+            metas.append(pickle.load(meta_stream))
+    n_shards = metas[0]["shards"]
+    assert all(meta["shards"] == n_shards for meta in metas)
+    return metas, fork_map(_merge_shard, [(paths, shard) for shard in
+                                          range(n_shards)],
+                           processes=processes)
+
+
+# Shards to be written by the processes of write_sharded
+_write_state = None
+
+
+def _write_shard(shard: int) -> None:
+    path, shards = _write_state
+    with atomic_write(shard_path(path, shard)) as shard_stream:
+        pickle.dump(shards[shard], shard_stream)
+
+
+def write_sharded(path: str, records: Dict[str, object], meta: dict,
+                  dirty_recids=None, processes=1) -> int:
+    """ Write a sharded database.
+
+    Args:
+        path: Directory of the sharded database (created if needed)
+        records: Dictionary recid: Record of all records
+        meta: Meta information, must contain the number of shards as
+              meta["shards"].
+        dirty_recids: If not None, only write the shards that contain one
+                      of these recids (and the ones that do not exist yet).
+        processes: Number of processes to write the shards with
+    Returns:
+        Number of shards written.
+    """
+    global _write_state
+    n_shards = meta["shards"]
+    os.makedirs(path, exist_ok=True)
+    if dirty_recids is None:
+        to_write = set(range(n_shards))
+    else:
+        to_write = {shard_of(recid, n_shards) for recid in dirty_recids}
+        to_write |= {shard for shard in range(n_shards)
+                     if not os.path.exists(shard_path(path, shard))}
+    if to_write:
+        shards = {shard: {} for shard in to_write}
+        for recid, record in records.items():
+            shard = shard_of(recid, n_shards)
+            if shard in shards:
+                shards[shard][recid] = record
+        _write_state = (path, shards)
+        try:
+            fork_map(_write_shard, [(shard,) for shard in sorted(shards)],
+                     processes=processes)
+        finally:
+            _write_state = None
+    with atomic_write(os.path.join(path, meta_filename)) as meta_stream:
+        pickle.dump(meta, meta_stream)
+    # remove shards from a previous layout with more shards
+    shard = n_shards
+    while os.path.exists(shard_path(path, shard)):
+        os.remove(shard_path(path, shard))
+        shard += 1
+    logger.debug("Wrote {} of {} shards.".format(len(to_write), n_shards))
+    return len(to_write)
+
+
+def is_indexed(path: str) -> bool:
+    """ Is there an indexed (sqlite) database at $path (or should a new
+    database at $path be indexed)? """
+    if not os.path.isfile(path):
+        return path.endswith(indexed_extension)
+    with open(path, "rb") as stream:
+        return stream.read(16) == b"SQLite format 3\x00"
+
+
+def _connect_indexed(path: str) -> sqlite3.Connection:
+    connection = sqlite3.connect(path)
+    connection.execute("CREATE TABLE IF NOT EXISTS meta "
+                       "(id INTEGER PRIMARY KEY, meta BLOB)")
+    connection.execute("CREATE TABLE IF NOT EXISTS records "
+                       "(recid TEXT PRIMARY KEY, record BLOB)")
+    return connection
+
+
+def _read_stored(connection: sqlite3.Connection,
+                 recids: List[str]) -> Dict[str, bytes]:
+    """ Pickled records with the given $recids that are stored in the
+    indexed database (recids that are not stored are skipped). """
+    stored = {}
+    for start in range(0, len(recids), _query_chunk_size):
+        chunk = recids[start:start + _query_chunk_size]
+        query = "SELECT recid, record FROM records WHERE recid IN " \
+                "({})".format(",".join("?" * len(chunk)))
+        stored.update(connection.execute(query, chunk))
+    return stored
+
+
+def _dump_merged(record, stored_blob=None) -> bytes:
+    """ Pickle $record, merged with the pickled record $stored_blob (our
+    values win conflicts, see Record.merge). $record itself is not
+    changed. """
+    blob = pickle.dumps(record)
+    if stored_blob is None:
+        return blob
+    merged = pickle.loads(blob)
+    merged.merge(pickle.loads(stored_blob))
+    return pickle.dumps(merged)
+
+
+def read_indexed_meta(path: str) -> dict:
+    """ Read only the meta information of the indexed database at $path. """
+    connection = _connect_indexed(path)
+    try:
+        row = connection.execute("SELECT meta FROM meta").fetchone()
+    finally:
+        connection.close()
+    return pickle.loads(row[0]) if row else {}
+
+
+def read_indexed(path: str) -> Tuple[dict, dict]:
+    """ Read the whole indexed database at $path.
+
+    Returns:
+        Two-tuple: The meta information (dictionary) and a dictionary
+        recid: Record.
+    """
+    connection = _connect_indexed(path)
+    try:
+        records = {recid: pickle.loads(blob) for recid, blob in
+                   connection.execute("SELECT recid, record FROM records")}
+    finally:
+        connection.close()
+    return read_indexed_meta(path), records
+
+
+def read_neighbourhood(path: str, seeds: Iterable[str],
+                       depth: int) -> dict:
+    """ Read only the records of the indexed database at $path which are at
+    most $depth references/citations away from one of the $seeds.
+
+    Args:
+        path: Path of the indexed database
+        seeds: Recids
+        depth: 0: only the seeds, 1: seeds and their references and
+               citations, ...
+    Returns:
+        Dictionary recid: Record. Recids that are not in the database are
+        skipped.
+    """
+    seeds = set(seeds)
+    records = {}
+    frontier = seeds
+    connection = _connect_indexed(path)
+    try:
+        for hop in range(depth + 1):
+            frontier = sorted(frontier - records.keys())
+            found = {}
+            for start in range(0, len(frontier), _query_chunk_size):
+                chunk = frontier[start:start + _query_chunk_size]
+                query = "SELECT recid, record FROM records WHERE recid IN " \
+                        "({})".format(",".join("?" * len(chunk)))
+                for recid, blob in connection.execute(query, chunk):
+                    found[recid] = pickle.loads(blob)
+            records.update(found)
+            frontier = set()
+            for record in found.values():
+                frontier |= record.references
+                frontier |= record.citations
+    finally:
+        connection.close()
+    logger.debug("Read {} records within {} steps of {} seeds.".format(
+        len(records), depth, len(seeds)))
+    return records
+
+
+def write_indexed(path: str, records: Dict[str, object], meta: dict,
+                  dirty_recids=None, merge=False) -> int:
+    """ Write (insert or replace) records into the indexed database at
+    $path. Records that are in the file, but not in $records are kept, so
+    that a partially loaded database can be saved.
+
+    Args:
+        path: Path of the indexed database (created if needed)
+        records: Dictionary recid: Record
+        meta: Meta information
+        dirty_recids: If not None, only write the records with these
+                      recids.
+        merge: Merge the records with the ones stored in the file instead
+               of replacing them. Needed if only part of the database was
+               loaded: Records outside of the loaded part (e.g. created by
+               Database.get_record) are otherwise overwritten by a
+               (possibly empty) stub.
+    Returns:
+        Number of records written.
+    """
+    if dirty_recids is None:
+        recids = records.keys()
+    else:
+        recids = records.keys() & set(dirty_recids)
+    connection = _connect_indexed(path)
+    try:
+        with connection:
+            stored = {}
+            if merge:
+                stored = _read_stored(connection, sorted(recids))
+            connection.executemany(
+                "INSERT OR REPLACE INTO records VALUES (?, ?)",
+                ((recid, _dump_merged(records[recid], stored.get(recid)))
+                 for recid in recids))
+            connection.execute("INSERT OR REPLACE INTO meta VALUES (0, ?)",
+                               (pickle.dumps(meta),))
+    finally:
+        connection.close()
+    logger.debug("Wrote {} records.".format(len(recids)))
+    return len(recids)
@@ -0,0 +1,116 @@
+from xml.sax.saxutils import escape, quoteattr
+from .dotgraph import DotGraph
+from .layout import force_directed_layout
+from .log import logger
+
+""" Part of inspiderweb: Tool to analyze paper reference networks.
+Inspiderweb currently hosted at: https://github.com/klieret/inspiderweb
+
+This file defines the SvgGraph class which lays out the graph itself and
+writes it as SVG, so that no external Graphviz layout is needed.
+"""
+
+
+class SvgGraph(DotGraph):
+    """ Same interface as DotGraph (add_connections, scale_nodes, ...),
+    but the output is an SVG image with clickable nodes instead of a
+    string in dot language.
+    """
+    # size of one unit of the layout in pixels
+    scale = 120
+    margin = 80
+    default_fontsize = 12
+
+    def __init__(self, db, config, iterations=50):
+        super().__init__(db, config)
+        self.iterations = iterations
+        self._svg_str = ""
+
+    def return_svg_str(self) -> str:
+        return self._svg_str
+
+    def _levels(self, rank: str) -> dict:
+        """ Map recid to vertical level (newest year on top). """
+        if rank == "":
+            return {}
+        elif rank == "year":
+            years = {}
+            for node_id in self._all_node_ids:
+                year = self.db.get_year(node_id)
+                if year:
+                    years[node_id] = year
+            ordered = sorted(set(years.values()), reverse=True)
+            level_of_year = {year: level for level, year in enumerate(ordered)}
+            return {recid: level_of_year[year]
+                    for recid, year in years.items()}
+        else:
+            logger.warning("Unknown rank option {}".format(rank))
+            return {}
+
+    def generate_svg_str(self, rank="") -> str:
+        """ Lay out the graph and generate the SVG.
+
+        Args:
+            rank: Currently only support "year".
+        """
+        for connection in self._connections:
+            self._all_node_ids.add(connection[0])
+            self._all_node_ids.add(connection[1])
+
+        levels = self._levels(rank)
+        logger.debug("Laying out {} nodes.".format(len(self._all_node_ids)))
+        positions = force_directed_layout(self._connections, levels=levels,
+                                          iterations=self.iterations)
+        if not positions:
+            self._svg_str = '<svg xmlns="http://www.w3.org/2000/svg"/>\n'
+            return self._svg_str
+
+        min_x = min(x for x, y in positions.values())
+        min_y = min(y for x, y in positions.values())
+        pixels = {recid: (self.margin + (x - min_x) * self.scale,
+                          self.margin + (y - min_y) * self.scale)
+                  for recid, (x, y) in positions.items()}
+        width = max(x for x, y in pixels.values()) + self.margin
+        height = max(y for x, y in pixels.values()) + self.margin
+
+        lines = ['<svg xmlns="http://www.w3.org/2000/svg" '
+                 'xmlns:xlink="http://www.w3.org/1999/xlink" '
+                 'width="{:.0f}" height="{:.0f}">'.format(width, height),
+                 '<defs><marker id="arrow" viewBox="0 0 10 10" refX="10" '
+                 'refY="5" markerWidth="6" markerHeight="6" '
+                 'orient="auto"><path d="M 0 0 L 10 5 L 0 10 z"/></marker>'
+                 '</defs>']
+        for from_recid, to_recid in self._connections:
+            lines.append('<line x1="{:.1f}" y1="{:.1f}" x2="{:.1f}" '
+                         'y2="{:.1f}" stroke="gray" '
+                         'marker-end="url(#arrow)"/>'.format(
+                            *(pixels[from_recid] + pixels[to_recid])))
+        for recid, (x, y) in pixels.items():
+            fontsize = self._node_fontsizes.get(recid, self.default_fontsize)
+            if recid in self._summary_labels:
+                # a whole community
+                lines.append('<rect x="{:.1f}" y="{:.1f}" width="{}" '
+                             'height="{}" fill="gray"/><text x="{:.1f}" '
+                             'y="{:.1f}" font-size="{}" font-family="Arial" '
+                             'text-anchor="middle">{}</text>'.format(
+                                x - fontsize, y - fontsize / 2, 2 * fontsize,
+                                fontsize, x, y - fontsize, fontsize,
+                                escape(self._summary_labels[recid])))
+                continue
+            record = self.db.get_record(recid)
+            lines.append('<a xlink:href={}><circle cx="{:.1f}" cy="{:.1f}" '
+                         'r="{}" fill="red"/><text x="{:.1f}" y="{:.1f}" '
+                         'font-size="{}" font-family="Arial" '
+                         'text-anchor="middle">{}</text></a>'.format(
+                            quoteattr(record.inspire_url), x, y,
+                            fontsize // 2, x, y - fontsize, fontsize,
+                            escape(record.label)))
+        lines.append('</svg>')
+        self._svg_str = "\n".join(lines) + "\n"
+        return self._svg_str
+
+    def write_to_file(self, path: str):
+        """ Prints svg string to file.
+        """
+        with open(path, "w") as svgfile:
+            svgfile.write(self._svg_str)
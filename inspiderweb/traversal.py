@@ -0,0 +1,199 @@
+import heapq
+from typing import Callable, Iterable, List, Set, Tuple
+from .graph import Graph
+
+""" Part of inspiderweb: Tool to analyze paper reference networks.
+Inspiderweb currently hosted at: https://github.com/klieret/inspiderweb
+
+Queries on the citation network that only look at a small part of it:
+shortest paths between two records (breadth first search from both ends),
+the k shortest paths (Yen's algorithm) and ego networks (all records within
+some steps of the seeds). The results can be turned into connections
+(sets of two-tuples of recids) for the DotGraph.
+"""
+
+
+def _neighbour_functions(graph: Graph, directed: bool) -> \
+        Tuple[Callable, Callable]:
+    """ Functions node -> neighbours in forward and backward direction.
+    Directed: Forward means following the references. """
+    if directed:
+        return graph.references, graph.citations
+
+    def both(node):
+        return list(graph.references(node)) + list(graph.citations(node))
+    return both, both
+
+
+def _bidirectional_bfs(graph: Graph, source: int, target: int,
+                       directed: bool, blocked_nodes=frozenset(),
+                       blocked_edges=frozenset()) -> List[int]:
+    """ Shortest path from node $source to node $target that avoids the
+    $blocked_nodes and the $blocked_edges (two-tuples of nodes in the
+    direction of the path). Both ends are expanded one level at a time,
+    always the smaller frontier first.
+
+    Returns:
+        List of nodes (empty if there is no path)
+    """
+    if source == target:
+        return [source]
+    forward, backward = _neighbour_functions(graph, directed)
+    # node: (predecessor, distance) for both searches
+    visited = [{source: (None, 0)}, {target: (None, 0)}]
+    frontiers = [[source], [target]]
+    while frontiers[0] and frontiers[1]:
+        side = 0 if len(frontiers[0]) <= len(frontiers[1]) else 1
+        neighbours = forward if side == 0 else backward
+        mine, other = visited[side], visited[1 - side]
+        best = None
+        next_frontier = []
+        for node in frontiers[side]:
+            for neighbour in neighbours(node):
+                edge = (node, neighbour) if side == 0 else (neighbour, node)
+                if neighbour in mine or neighbour in blocked_nodes or \
+                        edge in blocked_edges:
+                    continue
+                mine[neighbour] = (node, mine[node][1] + 1)
+                next_frontier.append(neighbour)
+                if neighbour in other:
+                    length = mine[neighbour][1] + other[neighbour][1]
+                    if best is None or length < best[0]:
+                        best = (length, neighbour)
+        if best is not None:
+            meeting = best[1]
+            path = []
+            node = meeting
+            while node is not None:
+                path.append(node)
+                node = visited[0][node][0]
+            path.reverse()
+            node = visited[1][meeting][0]
+            while node is not None:
+                path.append(node)
+                node = visited[1][node][0]
+            return path
+        frontiers[side] = next_frontier
+    return []
+
+
+def shortest_paths(graph: Graph, source: str, target: str, k=1,
+                   directed=False) -> List[List[str]]:
+    """ The $k shortest paths (without loops) between two records.
+
+    Args:
+        graph: Graph
+        source: Recid
+        target: Recid
+        k: Number of paths
+        directed: If True, only follow references from $source to
+                  $target, else also citations.
+    Returns:
+        List of paths (lists of recids, starting with $source), shortest
+        first. Fewer than $k if there aren't more paths.
+    """
+    if source not in graph.index or target not in graph.index:
+        return []
+    source_node = graph.index[source]
+    target_node = graph.index[target]
+    first = _bidirectional_bfs(graph, source_node, target_node, directed)
+    if not first:
+        return []
+    found = [first]
+    candidates = []  # heap of (length, path)
+    seen = {tuple(first)}
+    while len(found) < k:
+        previous = found[-1]
+        for i in range(len(previous) - 1):
+            spur = previous[i]
+            root = previous[:i + 1]
+            blocked_edges = {(path[i], path[i + 1]) for path in found
+                             if len(path) > i + 1 and path[:i + 1] == root}
+            spur_path = _bidirectional_bfs(graph, spur, target_node,
+                                           directed,
+                                           blocked_nodes=set(root[:-1]),
+                                           blocked_edges=blocked_edges)
+            if not spur_path:
+                continue
+            path = root[:-1] + spur_path
+            if tuple(path) not in seen:
+                seen.add(tuple(path))
+                heapq.heappush(candidates, (len(path), path))
+        if not candidates:
+            break
+        found.append(heapq.heappop(candidates)[1])
+    return [[graph.recids[node] for node in path] for path in found]
+
+
+def ego_network(graph: Graph, seeds: Iterable[str], radius: int,
+                direction="both") -> Set[str]:
+    """ All records that are at most $radius steps away from one of the
+    seeds.
+
+    Args:
+        graph: Graph
+        seeds: Recids
+        radius: Maximal number of steps
+        direction: "refs" (only follow references), "cites" (only
+                   citations) or "both"
+    Returns:
+        Set of recids (including the seeds that are in the graph)
+    """
+    frontier = {graph.index[recid] for recid in seeds if recid in graph.index}
+    reached = set(frontier)
+    for step in range(radius):
+        next_frontier = set()
+        for node in frontier:
+            if direction in ["refs", "both"]:
+                next_frontier.update(graph.references(node))
+            if direction in ["cites", "both"]:
+                next_frontier.update(graph.citations(node))
+        frontier = next_frontier - reached
+        reached |= frontier
+    return {graph.recids[node] for node in reached}
+
+
+def connected_components(graph: Graph) -> List[Set[str]]:
+    """ Connected components (ignoring the direction of the citations),
+    largest first.
+
+    Returns:
+        List of sets of recids
+    """
+    component = graph.weakly_connected_components()
+    components = [set() for _ in range(max(component) + 1 if component
+                                       else 0)]
+    for node, label in enumerate(component):
+        components[label].add(graph.recids[node])
+    return components
+
+
+def induced_connections(graph: Graph, recids: Iterable[str]) -> set:
+    """ All connections between the given records.
+
+    Returns:
+        Set of two-tuples (from_recid, to_recid), where from_recid is
+        referencing to_recid.
+    """
+    nodes = {graph.index[recid] for recid in recids if recid in graph.index}
+    return {(graph.recids[node], graph.recids[target]) for node in nodes
+            for target in graph.references(node) if target in nodes}
+
+
+def path_connections(graph: Graph, paths: Iterable[List[str]]) -> set:
+    """ The connections along the paths (in the direction of the
+    citations).
+
+    Returns:
+        Set of two-tuples (from_recid, to_recid), where from_recid is
+        referencing to_recid.
+    """
+    connections = set()
+    for path in paths:
+        for recid, next_recid in zip(path, path[1:]):
+            if graph.index[next_recid] in \
+                    graph.references(graph.index[recid]):
+                connections.add((recid, next_recid))
+            else:
+                connections.add((next_recid, recid))
+    return connections
@@ -0,0 +1,223 @@
+import os
+import time
+import pickle
+import socket
+import sqlite3
+from typing import Dict, Iterable, List, Tuple
+from .log import logger
+
+""" Part of inspiderweb: Tool to analyze paper reference networks.
+Inspiderweb currently hosted at: https://github.com/klieret/inspiderweb
+
+This file defines the WorkQueue, a sqlite file through which one
+coordinator (the Database of a normal run with --queue) distributes the
+downloads of references and citations to several worker processes (runs
+with --worker, possibly on other machines sharing the file system).
+
+Every task is identified by (recid, kind) with kind "refs" or "cites" and
+goes through the states
+    pending -> leased -> done -> merged
+A worker leases some tasks for a limited time. If it doesn't finish in
+time, the tasks can be leased by another worker. Only the first result
+of a task is kept and merging a result twice doesn't change the
+Database, so that retries are harmless. Tasks that failed too often are
+marked as failed.
+"""
+
+kinds = ["refs", "cites"]
+
+
+class WorkQueue(object):
+    def __init__(self, path: str, lease_time=600., max_attempts=3):
+        """
+        Args:
+            path: Path of the sqlite file (created if needed)
+            lease_time: Time [s] after which leased tasks that are not done
+                        are given to another worker.
+            max_attempts: Tasks are marked as failed after this many leases.
+        """
+        self.path = path
+        self.lease_time = lease_time
+        self.max_attempts = max_attempts
+        # autocommit mode, transactions are started explicitly
+        self._connection = sqlite3.connect(path, timeout=60,
+                                           isolation_level=None)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS tasks ("
+            "recid TEXT, kind TEXT, status TEXT, worker TEXT, "
+            "lease_until REAL, attempts INTEGER, result BLOB, "
+            "PRIMARY KEY (recid, kind))")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS task_status "
+                                 "ON tasks (status)")
+
+    def close(self) -> None:
+        self._connection.close()
+
+    def add(self, tasks: Iterable[Tuple[str, str]]) -> None:
+        """ Add tasks (two-tuples (recid, kind)). Tasks that are already
+        in the queue are only reset if their result was merged already
+        (i.e. if the Database asks for them again). """
+        with self._transaction():
+            for recid, kind in tasks:
+                assert kind in kinds
+                self._connection.execute(
+                    "INSERT OR IGNORE INTO tasks VALUES (?, ?, 'pending', "
+                    "'', 0, 0, NULL)", (recid, kind))
+                self._connection.execute(
+                    "UPDATE tasks SET status='pending', attempts=0 WHERE "
+                    "recid=? AND kind=? AND status IN ('merged', 'failed')",
+                    (recid, kind))
+
+    def claim(self, worker: str, n=10) -> List[Tuple[str, str]]:
+        """ Lease up to $n pending tasks (or tasks whose lease expired) for
+        the worker with id $worker.
+
+        Returns:
+            List of two-tuples (recid, kind)
+        """
+        now = time.time()
+        with self._transaction():
+            self._expire(now)
+            tasks = self._connection.execute(
+                "SELECT recid, kind FROM tasks WHERE status='pending' OR "
+                "(status='leased' AND lease_until<?) LIMIT ?",
+                (now, n)).fetchall()
+            self._connection.executemany(
+                "UPDATE tasks SET status='leased', worker=?, lease_until=?, "
+                "attempts=attempts+1 WHERE recid=? AND kind=?",
+                ((worker, now + self.lease_time, recid, kind)
+                 for recid, kind in tasks))
+        return tasks
+
+    def complete(self, recid: str, kind: str, records: Dict[str, object]) \
+            -> bool:
+        """ Store the result of a task: dictionary recid: Record of all
+        records the worker downloaded information about. Returns False
+        (and ignores the result) if the task was completed already. """
+        with self._transaction():
+            cursor = self._connection.execute(
+                "UPDATE tasks SET status='done', result=? WHERE recid=? AND "
+                "kind=? AND status='leased'",
+                (pickle.dumps(records), recid, kind))
+        return cursor.rowcount > 0
+
+    def release(self, recid: str, kind: str) -> None:
+        """ Give back a leased task that failed, so that it can be retried
+        (if it was not tried too often already). """
+        with self._transaction():
+            self._connection.execute(
+                "UPDATE tasks SET status=CASE WHEN attempts<? THEN 'pending' "
+                "ELSE 'failed' END WHERE recid=? AND kind=? AND "
+                "status='leased'", (self.max_attempts, recid, kind))
+
+    def collect(self) -> List[Tuple[str, str, dict]]:
+        """ Return the results of all tasks that are done and mark them as
+        merged.
+
+        Returns:
+            List of three-tuples (recid, kind, dictionary recid: Record)
+        """
+        with self._transaction():
+            rows = self._connection.execute(
+                "SELECT recid, kind, result FROM tasks WHERE "
+                "status='done'").fetchall()
+            self._connection.execute(
+                "UPDATE tasks SET status='merged', result=NULL WHERE "
+                "status='done'")
+        return [(recid, kind, pickle.loads(result))
+                for recid, kind, result in rows]
+
+    def status(self, tasks: Iterable[Tuple[str, str]]) -> \
+            Dict[Tuple[str, str], str]:
+        """ Status of the given tasks (two-tuples (recid, kind)). """
+        with self._transaction():
+            self._expire(time.time())
+            statuses = {}
+            for recid, kind in tasks:
+                row = self._connection.execute(
+                    "SELECT status FROM tasks WHERE recid=? AND kind=?",
+                    (recid, kind)).fetchone()
+                statuses[(recid, kind)] = row[0] if row else ""
+        return statuses
+
+    def counts(self) -> Dict[str, int]:
+        """ Number of tasks per status. """
+        return dict(self._connection.execute(
+            "SELECT status, COUNT(*) FROM tasks GROUP BY status"))
+
+    def _expire(self, now: float) -> None:
+        """ Mark tasks with expired leases that were tried too often as
+        failed. Must be called within a transaction. """
+        self._connection.execute(
+            "UPDATE tasks SET status='failed' WHERE status='leased' AND "
+            "lease_until<? AND attempts>=?", (now, self.max_attempts))
+
+    def _transaction(self):
+        return _Transaction(self._connection)
+
+
+class _Transaction(object):
+    """ Context manager for a write transaction that locks the queue right
+    away (so that two workers can't lease the same task). """
+    def __init__(self, connection: sqlite3.Connection):
+        self.connection = connection
+
+    def __enter__(self):
+        self.connection.execute("BEGIN IMMEDIATE")
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.connection.execute("COMMIT")
+        else:
+            self.connection.execute("ROLLBACK")
+
+
+def run_worker(path: str, worker="", batch=10, poll_interval=5.,
+               idle_timeout=0., lease_time=600.) -> int:
+    """ Work on the tasks of the queue at $path until interrupted.
+
+    Args:
+        path: Path of the queue
+        worker: Id of this worker (default: hostname:pid)
+        batch: Number of tasks to lease at once
+        poll_interval: Time [s] to wait if there are no tasks
+        idle_timeout: If > 0: Stop after waiting this long [s] for tasks
+        lease_time: See WorkQueue
+    Returns:
+        Number of tasks completed.
+    """
+    # avoid circular import
+    from .database import Database
+    worker = worker or "{}:{}".format(socket.gethostname(), os.getpid())
+    queue = WorkQueue(path, lease_time=lease_time)
+    logger.info("Worker {} waiting for tasks from {}.".format(worker, path))
+    n_completed = 0
+    idle_since = time.time()
+    try:
+        while True:
+            tasks = queue.claim(worker, batch)
+            if not tasks:
+                if idle_timeout and time.time() - idle_since > idle_timeout:
+                    break
+                time.sleep(poll_interval)
+                continue
+            for recid, kind in tasks:
+                db = Database()
+                try:
+                    if kind == "refs":
+                        db.get_references(recid)
+                    else:
+                        db.get_citations(recid)
+                except Exception as ex:
+                    logger.error("Task {} {} failed because of {}.".format(
+                        kind, recid, ex))
+                    queue.release(recid, kind)
+                    continue
+                if queue.complete(recid, kind, db._records):
+                    n_completed += 1
+            logger.info("Worker {} completed {} tasks.".format(worker,
+                                                              n_completed))
+            idle_since = time.time()
+    finally:
+        queue.close()
+    return n_completed
@@ -0,0 +1,1086 @@
+#!/usr/bin/env python3
+
+from inspiderweb.database import Database
+from inspiderweb import reduction
+from inspiderweb.svggraph import SvgGraph
+from inspiderweb.cli import get_plot_connections
+import xml.dom.minidom
+from inspiderweb import recidextractor
+from inspiderweb import storage
+from inspiderweb import compact
+from inspiderweb.frontier import Frontier
+from inspiderweb.workqueue import WorkQueue, run_worker
+import threading
+import json
+import urllib.request
+import urllib.error
+import configparser
+from inspiderweb.server import DatabaseServer
+from inspiderweb.batch import run_batch
+from inspiderweb.community import detect_communities
+from inspiderweb import planner
+from inspiderweb.dumpimport import import_dumps
+import gzip
+from inspiderweb.plot import make_graph, split_connections, write_parts
+import unittest
+import copy
+import tempfile
+import os.path
+
+
+def make_db(references):
+    """ Database without backup path with the references given as
+    a dictionary recid: set of referenced recids. """
+    db = Database()
+    for recid, refs in references.items():
+        record = db.get_record(recid)
+        record.references_dl = True
+        db.add_edges((recid, ref) for ref in refs)
+    return db
+
+
+class TestCocitations(unittest.TestCase):
+    def setUp(self):
+        # 1 and 2 both cite 10 and 11, 3 only cites 10 and 12
+        self.db = make_db({"1": {"10", "11"},
+                           "2": {"10", "11"},
+                           "3": {"10", "12"}})
+        self.db.compute_cocitations(top_k=1)
+
+    def test_cocitations(self):
+        record = self.db.get_record("10")
+        self.assertEqual(record.cocitation_weights, {"11": 2})
+        self.assertEqual(record.cocitations, {"11"})
+        # computed locally, not downloaded
+        self.assertFalse(record.cocitations_dl)
+
+    def test_unchanged(self):
+        version = self.db.version
+        self.db._dirty.clear()
+        self.db.compute_cocitations(top_k=1)
+        self.assertEqual(self.db.version, version)
+        self.assertEqual(self.db._dirty, set())
+
+    def test_coupling(self):
+        self.assertEqual(self.db.get_record("1").coupling_weights, {"2": 2})
+        self.assertEqual(list(self.db.get_record("3").coupling_weights.
+                              values()), [1])
+
+
+class TestAnalytics(unittest.TestCase):
+    def setUp(self):
+        # triangle 1, 2, 3 plus 4 which is only citing 1
+        self.db = make_db({"1": {"2", "3"}, "2": {"3"}, "4": {"1"}})
+
+    def test_degrees(self):
+        self.assertEqual(self.db.analytics.in_degrees()["3"], 2)
+        self.assertEqual(self.db.analytics.out_degrees()["4"], 1)
+        self.assertEqual(self.db.analytics.degree_distribution("in"),
+                         {0: 1, 1: 2, 2: 1})
+
+    def test_pagerank(self):
+        pagerank = self.db.analytics.pagerank()
+        self.assertAlmostEqual(sum(pagerank.values()), 1.)
+        self.assertEqual(self.db.analytics.top("pagerank", 1), ["3"])
+
+    def test_core_numbers(self):
+        self.assertEqual(self.db.analytics.core_numbers(),
+                         {"1": 2, "2": 2, "3": 2, "4": 1})
+
+    def test_cache(self):
+        self.assertEqual(self.db.analytics.in_degrees()["4"], 0)
+        record = self.db.get_record("3")
+        record.references.add("4")
+        self.db.update_record("3", record)
+        self.assertEqual(self.db.analytics.in_degrees()["4"], 1)
+
+
+class TestReduction(unittest.TestCase):
+    def test_transitive_reduction(self):
+        connections = {("1", "2"), ("2", "3"), ("1", "3"), ("3", "4"),
+                       ("4", "3")}
+        self.assertEqual(reduction.transitive_reduction(connections),
+                         {("1", "2"), ("2", "3"), ("3", "4"), ("4", "3")})
+
+    def test_k_core(self):
+        connections = {("1", "2"), ("2", "3"), ("1", "3"), ("3", "4")}
+        self.assertEqual(reduction.k_core(connections, 2),
+                         {("1", "2"), ("2", "3"), ("1", "3")})
+
+    def test_top_nodes(self):
+        connections = {("1", "2"), ("2", "3"), ("1", "3")}
+        scores = {"1": 1, "2": 5, "3": 3}
+        self.assertEqual(reduction.top_nodes(connections, scores, 2),
+                         {("2", "3")})
+
+
+class TestSvgGraph(unittest.TestCase):
+    def test_svg(self):
+        db = make_db({"1": {"2", "3"}, "2": {"3"}})
+        db.get_record("1").bibkey = "Einstein:1935ab"
+        db.get_record("3").bibkey = "Podolsky:1930cd"
+        graph = SvgGraph(db, {})
+        graph.add_connections({("1", "2"), ("2", "3"), ("1", "3")})
+        svg = xml.dom.minidom.parseString(graph.generate_svg_str("year"))
+        self.assertEqual(len(svg.getElementsByTagName("line")), 3)
+        links = {a.getAttribute("xlink:href")
+                 for a in svg.getElementsByTagName("a")}
+        self.assertIn("http://inspirehep.net/record/1", links)
+        circles = {c.parentNode.getAttribute("xlink:href"):
+                   float(c.getAttribute("cy"))
+                   for c in svg.getElementsByTagName("circle")}
+        # newer papers are on top
+        self.assertLess(circles["http://inspirehep.net/record/1"],
+                        circles["http://inspirehep.net/record/3"])
+
+
+class TestYears(unittest.TestCase):
+    def setUp(self):
+        self.db = make_db({"1": {"2", "3"}, "2": {"3"}})
+        self.db._get_recids_from_json(
+            '[{"recid": 1, "system_control_number": '
+            '{"institute": "INSPIRETeX", "value": "A:2001ab"}},'
+            '{"recid": 2, "system_control_number": '
+            '{"institute": "INSPIRETeX", "value": "B:1999cd"}},'
+            '{"recid": 3, "system_control_number": '
+            '{"institute": "INSPIRETeX", "value": "C:1980ef"}}]')
+
+    def test_year_at_ingest(self):
+        self.assertEqual(self.db.get_record("2").year, 1999)
+        self.assertEqual(self.db.get_recids_in_years(1990), {"1", "2"})
+        self.assertEqual(self.db.get_recids_in_years(0, 1999), {"2", "3"})
+
+    def test_plot_year_range(self):
+        self.assertEqual(get_plot_connections(["a@1990:-a@1990:"], set(),
+                                              self.db),
+                         {("1", "2")})
+
+    def test_year_of_old_records(self):
+        # saved before the year was stored
+        record = self.db.get_record("3")
+        record.year = 0
+        self.db._dirty.clear()
+        self.assertEqual(self.db.get_year("3"), 1980)
+        self.assertEqual(record.year, 1980)
+        self.assertEqual(self.db._dirty, {"3"})
+        self.assertEqual(get_plot_connections(["a-a@1980"], set(), self.db),
+                         {("1", "3"), ("2", "3")})
+
+
+class TestRecidExtractor(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.dir = self.tmp_dir.name
+        files = {"a.tex": "\\cite{Davies:2016ruz,Einstein:1935ab}",
+                 "sub/b.bib": "@article{Podolsky:1935cd,",
+                 ".hidden.tex": "\\cite{Hidden:2000aa}",
+                 "c.pdf": "\\cite{Pdf:2000aa}",
+                 "urls.txt": "http://inspirehep.net/record/566620/refs\n"}
+        for name, content in files.items():
+            path = os.path.join(self.dir, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w") as stream:
+                stream.write(content)
+        with open(os.path.join(self.dir, "binary.dat"), "wb") as stream:
+            stream.write(b"\0Binary:2000aa")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_bibkeys(self):
+        expected = {"Davies:2016ruz", "Einstein:1935ab", "Podolsky:1935cd"}
+        for processes in [1, 2]:
+            with self.subTest(processes=processes):
+                self.assertEqual(recidextractor.extract_from_paths(
+                    [self.dir], "bibkey", processes=processes), expected)
+
+    def test_urls(self):
+        self.assertEqual(recidextractor.get_recids_from_url_paths(
+            [self.dir]), {"566620"})
+
+    def test_manifest(self):
+        manifest_path = os.path.join(self.dir, ".manifest")
+        db = make_db({})
+        db.get_record("1").bibkey = "Davies:2016ruz"
+        db.get_record("2").bibkey = "Einstein:1935ab"
+        queries = []
+        published = {}
+
+        def fake_query(query, record_group, record_offset):
+            queries.append(query)
+            return published.get(query, '[]')
+        db._get_json_from_query = fake_query
+        recids = recidextractor.get_recids_from_bibkey_paths(
+            [self.dir], db, manifest=recidextractor.Manifest(manifest_path))
+        self.assertEqual(recids, {"1", "2"})
+        self.assertEqual(queries, ["Podolsky:1935cd"])
+
+        # second run: Nothing is read again, the missing bibkey is not
+        # looked up again until the lookup expires
+        def fail(*args, **kwargs):
+            raise AssertionError("Should not be called.")
+        original_extract = recidextractor._extract_from_file
+        recidextractor._extract_from_file = fail
+        try:
+            recids = recidextractor.get_recids_from_bibkey_paths(
+                [self.dir], db,
+                manifest=recidextractor.Manifest(manifest_path))
+            self.assertEqual(recids, {"1", "2"})
+            self.assertEqual(queries, ["Podolsky:1935cd"])
+            db.resolution_expiry = -1
+            published["Podolsky:1935cd"] = \
+                '[{"recid": 3, "system_control_number": {"institute": ' \
+                '"INSPIRETeX", "value": "Podolsky:1935cd"}}]'
+            recids = recidextractor.get_recids_from_bibkey_paths(
+                [self.dir], db,
+                manifest=recidextractor.Manifest(manifest_path))
+        finally:
+            recidextractor._extract_from_file = original_extract
+        self.assertEqual(recids, {"1", "2", "3"})
+        self.assertEqual(queries, ["Podolsky:1935cd"] * 2)
+
+    def test_manifest_hash(self):
+        manifest_path = os.path.join(self.dir, ".manifest")
+        manifest = recidextractor.Manifest(manifest_path)
+        expected = recidextractor.extract_from_paths([self.dir], "bibkey",
+                                                     manifest=manifest)
+        self.assertTrue(os.path.exists(manifest_path))
+        os.remove(manifest_path)
+        # nothing changed: the manifest is not written again
+        recidextractor.extract_from_paths([self.dir], "bibkey",
+                                          manifest=manifest)
+        self.assertFalse(os.path.exists(manifest_path))
+        # only the modification time changed: the file is not scanned
+        path = os.path.join(self.dir, "a.tex")
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+        def fail(data):
+            raise AssertionError("Should not be called.")
+        original_scanner = recidextractor._scanners["bibkey"]
+        recidextractor._scanners["bibkey"] = fail
+        try:
+            self.assertEqual(recidextractor.extract_from_paths(
+                [self.dir], "bibkey", manifest=manifest), expected)
+        finally:
+            recidextractor._scanners["bibkey"] = original_scanner
+        self.assertEqual(manifest.get(path, "bibkey")["mtime"],
+                         os.stat(path).st_mtime_ns)
+        self.assertTrue(os.path.exists(manifest_path))
+
+
+class TestBibkeyResolutions(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db = Database(os.path.join(self.tmp_dir.name, "db"))
+        self.queries = []
+
+        def fake_query(query, record_group, record_offset):
+            self.queries.append(query)
+            if query == "Davies:2016ruz":
+                return '[{"recid": 1472971, "system_control_number": ' \
+                       '{"institute": "INSPIRETeX", "value": ' \
+                       '"Davies:2016ruz"}}]'
+            return '[]'
+        self.db._get_json_from_query = fake_query
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_negative_results(self):
+        bibkeys = {"Davies:2016ruz", "Typo:2016xyz"}
+        self.assertEqual(self.db.get_recids_from_bibkeys(bibkeys),
+                         {"Davies:2016ruz": "1472971"})
+        self.assertEqual(set(self.queries), bibkeys)
+        self.db.save()
+
+        db2 = Database(self.db.backup_path)
+        db2.load()
+        db2._get_json_from_query = self.db._get_json_from_query
+        self.queries.clear()
+        self.assertEqual(db2.get_recids_from_bibkeys(bibkeys),
+                         {"Davies:2016ruz": "1472971"})
+        self.assertEqual(self.queries, [])
+
+        db2.resolution_expiry = -1
+        db2.get_recids_from_bibkeys(bibkeys)
+        self.assertEqual(self.queries, ["Typo:2016xyz"])
+
+
+class TestLabels(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db = make_db({"1": {"2"}})
+        self.db.get_record("1").bibkey = "Davies:2016ruz"
+        self.db.get_record("2").bibkey = "Einstein:1935ab"
+        self.db.offline_testing = True
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _write(self, content):
+        path = os.path.join(self.tmp_dir.name, "labels.csv")
+        with open(path, "w") as stream:
+            stream.write(content)
+        return path
+
+    def test_bibkey_labels(self):
+        path = self._write("bibkey;label\n"
+                           "Davies:2016ruz;first\n"
+                           "# comment\n"
+                           "Einstein:1935ab;second\n"
+                           "Typo:2000xx;third\n")
+        unresolved = self.db.get_labels_from_file(path)
+        self.assertEqual(self.db.get_record("1").custom_label, "first")
+        self.assertEqual(self.db.get_record("2").custom_label, "second")
+        self.assertEqual(unresolved, [(5, "Typo:2000xx")])
+
+    def test_url_labels(self):
+        path = self._write("url;label\n"
+                           "http://inspirehep.net/record/2;url label\n")
+        self.assertEqual(self.db.get_labels_from_file(path), [])
+        self.assertEqual(self.db.get_record("2").custom_label, "url label")
+
+
+class TestShardedDatabase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "sharded")
+        self.db = make_db({str(i): {str(i + 1)} for i in range(50)})
+        self.db.backup_path = self.path
+        self.db.shards = 4
+        self.db.save()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_save_load(self):
+        self.assertEqual(len(os.listdir(self.path)), 5)
+        for processes in [1, 2]:
+            with self.subTest(processes=processes):
+                db2 = Database(self.path, processes=processes)
+                db2.load()
+                self.assertEqual(db2.shards, 4)
+                self.assertEqual(db2._records, self.db._records)
+
+    def test_only_dirty_shards(self):
+        db2 = Database(self.path)
+        db2.load()
+        record = db2.get_record("7")
+        record.custom_label = "changed"
+        db2.update_record("7", record)
+        mtimes = {name: os.stat(os.path.join(self.path, name)).st_mtime_ns
+                  for name in os.listdir(self.path)}
+        db2.save()
+        changed = {name for name in os.listdir(self.path)
+                   if os.stat(os.path.join(self.path, name)).st_mtime_ns !=
+                   mtimes[name]}
+        self.assertEqual(changed, {"meta.pickle", os.path.basename(
+            storage.shard_path(self.path, storage.shard_of("7", 4)))})
+        db3 = Database(self.path)
+        db3.load()
+        self.assertEqual(db3.get_record("7").custom_label, "changed")
+
+    def test_save_in_processes(self):
+        path = os.path.join(self.tmp_dir.name, "parallel")
+        self.db.processes = 2
+        self.db.save(path)
+        db2 = Database(path)
+        db2.load()
+        self.assertEqual(db2._records, self.db._records)
+
+    def test_merge_sharded(self):
+        other_path = os.path.join(self.tmp_dir.name, "other")
+        other = make_db({"7": {"100"}, "100": set()})
+        other.get_record("7").bibkey = "Other:2000ab"
+        other.shards = 4
+        other.save(other_path)
+        record = self.db.get_record("7")
+        record.bibkey = "Ours:2000ab"
+        self.db.update_record("7", record)
+        self.db.save()
+        results = []
+        for processes in [1, 2]:
+            with self.subTest(processes=processes):
+                db2 = Database(processes=processes)
+                self.assertEqual(len(db2._sharded_groups(
+                    [self.path, other_path])), 3 - processes)
+                db2.load([self.path, other_path])
+                self.assertEqual(len(db2._records), 52)
+                self.assertEqual(db2.get_record("7").references,
+                                 {"8", "100"})
+                self.assertEqual(db2.get_record("100").citations, {"7"})
+                self.assertEqual(db2.merge_conflicts,
+                                 [("7", "bibkey", "Ours:2000ab",
+                                   "Other:2000ab")])
+                results.append(db2._records)
+        self.assertEqual(results[0], results[1])
+
+
+class TestSave(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db = make_db({str(i): {str(i + 1)} for i in range(50)})
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_background_save(self):
+        for name in ["db.pickle", "sharded", "db.compact", "db.sqlite"]:
+            with self.subTest(name=name):
+                path = os.path.join(self.tmp_dir.name, name)
+                if name == "sharded":
+                    os.mkdir(path)
+                self.db.backup_path = path
+                self.assertTrue(self.db.save(background=True))
+                self.db.wait_for_background_save()
+                self.assertEqual(self.db._dirty, set())
+                db2 = Database(path)
+                db2.load()
+                self.assertEqual(db2._records, self.db._records)
+
+    def test_crash_while_saving(self):
+        path = os.path.join(self.tmp_dir.name, "db.pickle")
+        self.db.save(path)
+        with open(path, "rb") as stream:
+            saved = stream.read()
+        # can't be pickled
+        self.db.get_record("1").custom_label = lambda: None
+        with self.assertRaises(Exception):
+            self.db.save(path)
+        with open(path, "rb") as stream:
+            self.assertEqual(stream.read(), saved)
+        self.assertEqual(os.listdir(self.tmp_dir.name), ["db.pickle"])
+
+
+class TestMerge(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "other.pickle")
+        other = make_db({"1": {"3"}, "4": {"1"}})
+        other.get_record("1").bibkey = "Other:2000ab"
+        other.get_record("4").bibkey = "Fourth:2010cd"
+        other.save(self.path)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_merge(self):
+        db = make_db({"1": {"2"}})
+        db.get_record("1").bibkey = "First:1999xy"
+        db.load(self.path)
+        self.assertEqual(db.get_record("1").references, {"2", "3"})
+        self.assertEqual(db.get_record("1").bibkey, "First:1999xy")
+        self.assertEqual(db.get_record("4").bibkey, "Fourth:2010cd")
+        self.assertEqual(db.merge_conflicts,
+                         [("1", "bibkey", "First:1999xy", "Other:2000ab")])
+        report_path = os.path.join(self.tmp_dir.name, "conflicts.csv")
+        db.report_merge_conflicts(report_path)
+        with open(report_path) as report_file:
+            self.assertEqual(report_file.read().splitlines()[1],
+                             "1;bibkey;First:1999xy;Other:2000ab")
+
+    def test_inspire_url_conflict(self):
+        db = make_db({"4": set()})
+        record = db.get_record("4")
+        record.inspire_url = "https://inspirehep.net/literature/4"
+        db.load(self.path)
+        self.assertEqual(db.get_record("4").inspire_url,
+                         "https://inspirehep.net/literature/4")
+        self.assertEqual(db.get_record("4").references, {"1"})
+        self.assertEqual(db.merge_conflicts,
+                         [("4", "inspire_url",
+                           "https://inspirehep.net/literature/4",
+                           "http://inspirehep.net/record/4")])
+
+
+class TestIndexedDatabase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "db.sqlite")
+        # chain 0 -> 1 -> 2 -> ... -> 20
+        self.db = make_db({str(i): {str(i + 1)} for i in range(20)})
+        for i in range(20):
+            self.db.get_record(str(i + 1)).citations = {str(i)}
+        self.db.save(self.path)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_save_load(self):
+        self.assertTrue(storage.is_indexed(self.path))
+        db2 = Database(self.path)
+        db2.load()
+        self.assertEqual(db2._records, self.db._records)
+
+    def test_neighbourhood(self):
+        db2 = Database(self.path)
+        db2.load_neighbourhood(["10"], 2)
+        self.assertEqual(set(db2._records), {"8", "9", "10", "11", "12"})
+        record = db2.get_record("10")
+        record.custom_label = "changed"
+        db2.update_record("10", record)
+        db2.save()
+        db3 = Database(self.path)
+        db3.load()
+        self.assertEqual(len(db3._records), 21)
+        self.assertEqual(db3.get_record("10").custom_label, "changed")
+
+    def test_partial_save_keeps_stored_records(self):
+        path = os.path.join(self.tmp_dir.name, "small.sqlite")
+        db = make_db({"1": {"2"}, "2": {"3"}, "3": {"4"}, "5": {"4"}})
+        record = db.get_record("5")
+        record.bibkey = "Author:2005ab"
+        record.references_dl = True
+        db.save(path)
+        db2 = Database(path)
+        db2.load_neighbourhood({"1"}, 1)
+        self.assertNotIn("5", db2._records)
+        db2.get_record("5")
+        db2.save()
+        db3 = Database(path)
+        db3.load()
+        self.assertEqual(len(db3._records), 5)
+        self.assertEqual(db3.get_record("5").bibkey, "Author:2005ab")
+        self.assertTrue(db3.get_record("5").references_dl)
+        self.assertEqual(db3.get_record("5").references, {"4"})
+
+
+class TestCompactDatabase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db = make_db({"1": {"2", "300"}, "2": {"300"}, "4": {"1"}})
+        for recid, citations in {"2": {"1"}, "300": {"1", "2", "999"},
+                                 "1": set()}.items():
+            self.db.get_record(recid).citations = citations
+        record = self.db.get_record("1")
+        record.bibkey = "Author:2001ab"
+        record.custom_label = "Ä label"
+        record.year = 2001
+        record.cocitation_weights = {"300": 2}
+        self.db.get_record("2").bibkey = "Author:2001ab"
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_save_load(self):
+        for compression in compact.compressions:
+            with self.subTest(compression=compression):
+                path = os.path.join(self.tmp_dir.name,
+                                    compression + ".compact")
+                self.db.compression = compression
+                self.db.save(path)
+                self.assertTrue(compact.is_compact(path))
+                db2 = Database(path)
+                db2.load()
+                # loading adds the citation of 1 by 4 again
+                expected = copy.deepcopy(self.db)
+                expected._reconcile_edges()
+                self.assertEqual(db2._records, expected._records)
+
+    def test_citation_count(self):
+        self.db.get_record("2").citation_count = 1234
+        path = os.path.join(self.tmp_dir.name, "counts.compact")
+        self.db.save(path)
+        db2 = Database(path)
+        db2.load()
+        self.assertEqual(db2.get_record("2").citation_count, 1234)
+        self.assertEqual(db2.get_record("1").citation_count, -1)
+
+
+class TestCitationCounts(unittest.TestCase):
+    def setUp(self):
+        self.db = make_db({"1": {"2", "3"}})
+        self.queries = []
+        counts = {"1": 0, "2": 17, "3": 4}
+
+        def fake_query(query, record_group, record_offset,
+                       output_tags="recid,system_control_number"):
+            self.queries.append((query, output_tags))
+            if output_tags == "recid,number_of_citations":
+                recids = [part.split(":")[1] for part in query.split(" or ")]
+                return json.dumps([{"recid": int(recid),
+                                    "number_of_citations": counts[recid]}
+                                   for recid in recids])
+            return '[{"recid": 5, "system_control_number": []}]'
+        self.db._get_json_from_query = fake_query
+
+    def test_batches(self):
+        self.assertEqual(self.db.get_citation_counts(["1", "2", "3"],
+                                                     batch=2),
+                         {"1": 0, "2": 17, "3": 4})
+        self.assertEqual([query for query, _ in self.queries],
+                         ["recid:1 or recid:2", "recid:3"])
+        self.assertEqual(self.db.get_citation_counts(["2"]), {"2": 17})
+        self.assertEqual(len(self.queries), 2)
+        self.assertEqual(self.db.analytics.scores("citations"),
+                         {"1": 0, "2": 17, "3": 4})
+
+    def test_min_citations(self):
+        self.db.crawl_min_citations = 5
+        self.assertEqual(self.db.autocomplete_records(["seeds.cites"],
+                                                      recids={"1", "2", "3"},
+                                                      save_every=1000),
+                         {"1", "2", "3", "5"})
+        # only the citations of 2 were downloaded
+        self.assertEqual(self.queries[-1],
+                         ("refersto:recid:2", "recid,system_control_number"))
+        self.assertEqual(len(self.queries), 2)
+
+
+class TestPlanner(unittest.TestCase):
+    def setUp(self):
+        self.db = make_db({"1": {"2", "3"}, "2": {"3"}})
+        for recid in ["1", "2"]:
+            self.db.get_record(recid).references_dl = True
+        self.db.get_record("2").citation_count = 600
+        self.db.get_record("3").citation_count = 0
+
+    def test_known(self):
+        refs, cites = planner.estimate_update(self.db, "seeds.refs.cites",
+                                              {"1"})
+        # all references are known
+        self.assertEqual((refs.records, refs.queries, refs.pages),
+                         (1, 0, 0))
+        # 1: average citations (count unknown, 300 citations: 2 pages),
+        # 2: 600 citations (3 pages), 3: not cited
+        self.assertEqual(cites.records, 3)
+        self.assertEqual(cites.queries, 2)
+        self.assertEqual(cites.pages, 2 + 3)
+        # (1 is known to cite 2)
+        self.assertEqual(cites.new_records, 300 + 599)
+
+    def test_unknown(self):
+        refs, refs2 = planner.estimate_update(self.db, "seeds.r.r", {"5"})
+        self.assertEqual((refs.queries, refs.new_records), (1, 1 + 1.5))
+        # the 1.5 new records are unknown, too
+        self.assertEqual(refs2.queries, 2.5)
+
+    def test_min_citations(self):
+        self.db.crawl_min_citations = 1000
+        cites, = planner.estimate_update(self.db, "seeds.c", {"2", "4"})
+        # one request for the count of 4 which most likely is not cited
+        # often enough (like 3 of the 2 records with known count)
+        self.assertEqual(cites.pages, 1)
+
+
+class TestDumpImport(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        ref = "https://inspirehep.net/api/literature/{}"
+        lines = [
+            {"control_number": 1, "texkeys": ["Author:2017ab"],
+             "arxiv_eprints": [{"value": "1701.02937"}],
+             "references": [{"record": {"$ref": ref.format(2)}},
+                            {"record": {"$ref": ref.format(3)}},
+                            {"reference": {"title": "not in inspire"}}],
+             "citation_count": 0},
+            {"metadata": {"control_number": 2, "texkeys": ["Other:1999x"],
+                          "references": [{"record": {
+                              "$ref": ref.format(3)}}]}},
+        ]
+        self.path = os.path.join(self.tmp_dir.name, "dump.jsonl.gz")
+        with gzip.open(self.path, "wt") as dump:
+            for line in lines:
+                dump.write(json.dumps(line) + "\n")
+            dump.write("not json\n\n")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_import(self):
+        for processes in [1, 2]:
+            with self.subTest(processes=processes):
+                db = make_db({"2": set()})
+                db.get_record("2").custom_label = "label"
+                self.assertEqual(import_dumps(db, [self.path],
+                                              processes=processes), 2)
+                record = db.get_record("1")
+                self.assertEqual(record.bibkey, "Author:2017ab")
+                self.assertEqual(record.year, 2017)
+                self.assertEqual(record.fulltext_url,
+                                 "http://arxiv.org/pdf/1701.02937")
+                self.assertEqual(record.references, {"2", "3"})
+                self.assertEqual(record.citation_count, 0)
+                self.assertTrue(record.references_dl)
+                self.assertFalse(record.citations_dl)
+                self.assertEqual(db.get_record("2").custom_label, "label")
+                self.assertEqual(db.get_record("2").citations, {"1"})
+                self.assertEqual(db.get_record("3").citations, {"1", "2"})
+                self.assertFalse(db.get_record("3").references_dl)
+
+
+class TestEdges(unittest.TestCase):
+    def test_reconcile_on_load(self):
+        db = Database()
+        db.get_record("1").references = {"2", "3"}
+        db.get_record("2").citations = {"4"}
+        for recid in ["3", "4"]:
+            db.get_record(recid)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "db.pickle")
+            db.save(path)
+            db2 = Database(path)
+            db2.load()
+        self.assertEqual(db2.get_record("2").citations, {"1", "4"})
+        self.assertEqual(db2.get_record("3").citations, {"1"})
+        self.assertEqual(db2.get_record("4").references, {"2"})
+
+    def test_implied_citations(self):
+        db = make_db({"1": {"3"}, "2": {"3"}})
+        queries = []
+
+        def fake_query(query, record_group, record_offset):
+            queries.append(query)
+            return '[]'
+        db._get_json_from_query = fake_query
+        db.get_record("3").citation_count = 2
+        db.get_record("1").citation_count = 1
+        # all citations of 3 are known from the references of 1 and 2
+        self.assertEqual(db.get_citations("3"), {"1", "2"})
+        # the count might be outdated, so this is not remembered
+        self.assertFalse(db.get_record("3").citations_dl)
+        db.get_citations("1")
+        self.assertEqual(queries, ["refersto:recid:1"])
+        # a newer count: the citations of 3 are downloaded again
+        db.get_record("3").citation_count = 3
+        db.get_citations("3")
+        self.assertEqual(queries, ["refersto:recid:1", "refersto:recid:3"])
+
+
+class TestFrontier(unittest.TestCase):
+    def test_spill(self):
+        with tempfile.TemporaryDirectory() as directory:
+            frontier = Frontier(memory_budget=3, directory=directory)
+            frontier.update(["5", "3", "1", "3", "9", "5", "7", "1", "2"])
+            self.assertEqual(len(os.listdir(directory)), 1)
+            self.assertEqual(list(frontier), ["1", "2", "3", "5", "7", "9"])
+            self.assertEqual(len(frontier), 6)
+            frontier.close()
+            self.assertEqual(os.listdir(directory), [])
+
+    def test_crawl(self):
+        references = {str(i): {str(2 * i), str(2 * i + 1)}
+                      for i in range(1, 100)}
+        results = []
+        for memory_budget in [0, 4]:
+            db = Database()
+            db.crawl_memory = memory_budget
+            handled = []
+
+            def get_references(recid, force=False):
+                handled.append(recid)
+                return references.get(recid, set())
+
+            db.get_references = get_references
+            results.append(db.autocomplete_records(["s.r.r.r"],
+                                                   recids={"1", "2"},
+                                                   save_every=1000,
+                                                   statistics_every=1000))
+            self.assertEqual(len(handled), 2 + 5 + 11)
+        self.assertEqual(results[0], results[1])
+        self.assertEqual(results[0], set(map(str, range(1, 24))))
+
+
+class TestWorkQueue(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "queue.sqlite")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_lease(self):
+        queue = WorkQueue(self.path, lease_time=0., max_attempts=2)
+        queue.add([("1", "refs"), ("1", "refs")])
+        self.assertEqual(queue.claim("w1"), [("1", "refs")])
+        # lease expired right away
+        self.assertEqual(queue.claim("w2"), [("1", "refs")])
+        self.assertTrue(queue.complete("1", "refs", {"1": "w1"}))
+        self.assertFalse(queue.complete("1", "refs", {"1": "w2"}))
+        self.assertEqual(queue.collect(), [("1", "refs", {"1": "w1"})])
+        self.assertEqual(queue.collect(), [])
+        queue.add([("2", "cites")])
+        for _ in range(2):
+            queue.claim("w1")
+            queue.release("2", "cites")
+        self.assertEqual(queue.status([("2", "cites")]),
+                         {("2", "cites"): "failed"})
+        queue.close()
+
+    def test_distributed_crawl(self):
+        references = {"1": ["2", "3"], "2": ["3"], "3": []}
+        original = Database.get_recids_from_query
+
+        def get_recids_from_query(db, query, record_group=250):
+            return set(references[query.split(":")[-1]])
+
+        Database.get_recids_from_query = get_recids_from_query
+        worker = threading.Thread(target=run_worker, args=(self.path,),
+                                  kwargs={"poll_interval": 0.01,
+                                          "idle_timeout": 0.5})
+        worker.start()
+        try:
+            db = Database()
+            db.work_queue = WorkQueue(self.path)
+            db.poll_interval = 0.01
+            db.get_record("3").references_dl = True
+            recids = db.autocomplete_records(["s.r.r"], recids={"1"})
+            db.work_queue.close()
+        finally:
+            worker.join()
+            Database.get_recids_from_query = original
+        self.assertEqual(recids, {"1", "2", "3"})
+        self.assertEqual(db.get_record("1").references, {"2", "3"})
+        self.assertTrue(db.get_record("2").references_dl)
+        queue = WorkQueue(self.path)
+        self.assertEqual(queue.counts(), {"merged": 2})
+        queue.close()
+
+    def test_no_workers(self):
+        references = {"1": ["2", "3"], "2": ["3"], "3": []}
+        original = Database.get_recids_from_query
+
+        def get_recids_from_query(db, query, record_group=250):
+            return set(references[query.split(":")[-1]])
+
+        Database.get_recids_from_query = get_recids_from_query
+        try:
+            db = Database()
+            db.work_queue = WorkQueue(self.path)
+            db.poll_interval = 0.01
+            db.worker_timeout = 0.05
+            recids = db.autocomplete_records(["s.r"], recids={"1"})
+            db.work_queue.close()
+        finally:
+            Database.get_recids_from_query = original
+        self.assertEqual(recids, {"1", "2", "3"})
+        self.assertTrue(db.get_record("1").references_dl)
+
+
+class TestServer(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db = make_db({"1": {"2", "3"}, "2": {"3"}})
+        self.db.get_record("3").bibkey = "Author:2003ab"
+        self.db.backup_path = os.path.join(self.tmp_dir.name, "db.pickle")
+        config = configparser.ConfigParser()
+        config.read("config/default.ini")
+        self.server = DatabaseServer(("127.0.0.1", 0), self.db,
+                                     config["dotgraph"])
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.url = "http://127.0.0.1:{}".format(self.server.server_port)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        self.tmp_dir.cleanup()
+
+    def request(self, path, data):
+        request = urllib.request.Request(self.url + path,
+                                         json.dumps(data).encode("utf-8"))
+        with urllib.request.urlopen(request) as response:
+            return response.read().decode("utf-8")
+
+    def test_requests(self):
+        self.assertEqual(json.loads(self.request("/resolve",
+                                                 {"recids": ["1", 2]})),
+                         {"recids": ["1", "2"]})
+        self.assertEqual(
+            json.loads(self.request("/resolve",
+                                    {"recids": ["1"],
+                                     "bibkeys": ["Author:2003ab"]})),
+            {"recids": ["1", "3"]})
+        self.assertEqual(
+            json.loads(self.request("/connections", {"recids": ["1", "2"],
+                                                     "plot": ["s-a"]})),
+            {"connections": [["1", "2"], ["1", "3"], ["2", "3"]]})
+        dot = self.request("/plot", {"recids": ["1", "2"], "plot": ["s-s"]})
+        self.assertTrue(dot.startswith("digraph"))
+        self.assertIn('"1" -> "2"', dot)
+
+    def test_errors(self):
+        for path, data, code in [("/nothing", {}, 404),
+                                 ("/plot", {"format": "png"}, 400),
+                                 ("/plot", [], 400)]:
+            with self.subTest(path=path):
+                with self.assertRaises(urllib.error.HTTPError) as context:
+                    self.request(path, data)
+                self.assertEqual(context.exception.code, code)
+
+
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db = make_db({"1": {"2", "3"}, "2": {"3"}, "4": {"1"}})
+        config = configparser.ConfigParser()
+        config.read("config/default.ini")
+        self.config = config["dotgraph"]
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_batch(self):
+        directory = self.tmp_dir.name
+        seeds_path = os.path.join(directory, "seeds.txt")
+        with open(seeds_path, "w") as seeds_file:
+            seeds_file.write("1\n2\n")
+        batch_path = os.path.join(directory, "jobs.ini")
+        with open(batch_path, "w") as batch_file:
+            batch_file.write("[DEFAULT]\nrecidpaths = {}\n"
+                             "[seeds]\noutput = {}/out/s.dot\n"
+                             "[all]\nplot = s-a\noutput = {}/a.svg\n"
+                             "format = svg\n"
+                             "[other]\nrecids = 4 1\noutput = {}/o.dot\n"
+                             "".format(seeds_path, *[directory] * 3))
+        for processes in [1, 2]:
+            with self.subTest(processes=processes):
+                outputs = run_batch(self.db, self.config, batch_path,
+                                    processes=processes)
+                self.assertEqual(len(outputs), 3)
+                with open(os.path.join(directory, "out", "s.dot")) as dot:
+                    content = dot.read()
+                self.assertIn('"1" -> "2"', content)
+                self.assertNotIn('"3"', content)
+                with open(os.path.join(directory, "o.dot")) as dot:
+                    self.assertIn('"4" -> "1"', dot.read())
+                xml.dom.minidom.parse(os.path.join(directory, "a.svg"))
+
+    def test_invalid_rule(self):
+        batch_path = os.path.join(self.tmp_dir.name, "jobs.ini")
+        with open(batch_path, "w") as batch_file:
+            batch_file.write("[DEFAULT]\nrecids = 1\n"
+                             "[a]\nplot = s-s-s\noutput = {0}/a.dot\n"
+                             "[b]\nrecids = 2\nplot = s-s-s\n"
+                             "output = {0}/b.dot\n".format(
+                                 self.tmp_dir.name))
+        for processes in [1, 2]:
+            with self.subTest(processes=processes):
+                with self.assertRaises(SystemExit):
+                    run_batch(self.db, self.config, batch_path,
+                              processes=processes)
+
+
+class TestTraversal(unittest.TestCase):
+    def setUp(self):
+        # 1 -> 2 -> 3 -> 4, 1 -> 5 -> 4, 6 -> 4, 7 -> 8
+        self.db = make_db({"1": {"2", "5"}, "2": {"3"}, "3": {"4"},
+                           "5": {"4"}, "6": {"4"}, "7": {"8"}})
+
+    def test_shortest_paths(self):
+        self.assertEqual(self.db.shortest_paths("1", "4"),
+                         [["1", "5", "4"]])
+        self.assertEqual(self.db.shortest_paths("1", "4", k=3),
+                         [["1", "5", "4"], ["1", "2", "3", "4"]])
+        self.assertEqual(self.db.shortest_paths("4", "1", directed=True), [])
+        self.assertEqual(self.db.shortest_paths("6", "1"),
+                         [["6", "4", "5", "1"]])
+        self.assertEqual(self.db.shortest_paths("1", "7"), [])
+        self.assertEqual(
+            self.db.path_connections(self.db.shortest_paths("6", "1")),
+            {("6", "4"), ("5", "4"), ("1", "5")})
+
+    def test_ego_network(self):
+        self.assertEqual(self.db.ego_network(["4"], 1),
+                         {"3", "4", "5", "6"})
+        self.assertEqual(self.db.ego_network(["1"], 2, direction="refs"),
+                         {"1", "2", "3", "4", "5"})
+        self.assertEqual(self.db.induced_connections({"1", "2", "5"}),
+                         {("1", "2"), ("1", "5")})
+
+    def test_components(self):
+        self.assertEqual(self.db.connected_components(),
+                         [{"1", "2", "3", "4", "5", "6"}, {"7", "8"}])
+
+
+class TestCommunities(unittest.TestCase):
+    def setUp(self):
+        # two cliques 1-4 and 5-8, connected by 4 -> 5
+        references = {}
+        for clique in [["1", "2", "3", "4"], ["5", "6", "7", "8"]]:
+            for i, recid in enumerate(clique):
+                references[recid] = set(clique[i + 1:])
+        references["4"].add("5")
+        self.db = make_db(references)
+        self.db.get_record("4").bibkey = "Four:2000ab"
+        self.connections = {(recid, ref) for recid, refs in references.items()
+                            for ref in refs}
+        config = configparser.ConfigParser()
+        config.read("config/default.ini")
+        self.config = config["dotgraph"]
+
+    def test_detect(self):
+        self.assertEqual(detect_communities(self.connections),
+                         [{"1", "2", "3", "4"}, {"5", "6", "7", "8"}])
+
+    def test_clusters(self):
+        dot = make_graph(self.db, self.config, [], [],
+                         connections=self.connections,
+                         communities=True).return_dot_str()
+        self.assertIn('subgraph "cluster_community_0"', dot)
+        self.assertIn('label="Four:2000ab + 3";', dot)
+        self.assertIn('\t\t"8";\n', dot)
+
+    def test_collapse(self):
+        for output_format in ["dot", "svg"]:
+            with self.subTest(output_format=output_format):
+                dg = make_graph(self.db, self.config, [], [],
+                                connections=self.connections,
+                                output_format=output_format, collapse=True)
+                self.assertEqual(dg._connections,
+                                 {("community_0", "community_1")})
+        self.assertIn('"community_0" [label="Four:2000ab + 3" shape=box3d]',
+                      make_graph(self.db, self.config, [], [],
+                                 connections=self.connections,
+                                 collapse=True).return_dot_str())
+
+
+class TestSplit(unittest.TestCase):
+    def setUp(self):
+        # component 1 -> 2 -> ... -> 6, component 7 -> 8, 9 -> 10
+        references = {str(i): {str(i + 1)} for i in range(1, 6)}
+        references.update({"7": {"8"}, "9": {"10"}})
+        self.db = make_db(references)
+        for recid in references:
+            self.db.get_record(recid).year = 1990 + 3 * int(recid)
+        self.connections = {(recid, ref) for recid, refs in references.items()
+                            for ref in refs}
+        config = configparser.ConfigParser()
+        config.read("config/default.ini")
+        self.config = config["dotgraph"]
+
+    def test_split_components(self):
+        parts = split_connections(self.db, self.connections)
+        self.assertEqual([name for name, _ in parts],
+                         ["component_000", "small_components"])
+        self.assertEqual(len(parts[0][1]), 5)
+        self.assertEqual(parts[1][1], {("7", "8"), ("9", "10")})
+
+    def test_split_years(self):
+        parts = split_connections(self.db, self.connections, split="years")
+        self.assertEqual([name for name, _ in parts],
+                         ["1990-1999", "2000-2009", "2010-2019"])
+        self.assertEqual(set.union(*[part for _, part in parts]),
+                         self.connections)
+
+    def test_write_parts(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            output = os.path.join(tmpdir, "plot.dot")
+            paths = write_parts(self.db, self.config, [], [], output,
+                                processes=2, connections=self.connections)
+            self.assertEqual(paths, [
+                os.path.join(tmpdir, "plot_component_000.dot"),
+                os.path.join(tmpdir, "plot_small_components.dot"),
+                output + ".index.csv"])
+            with open(paths[1]) as dot_file:
+                self.assertIn('"9" -> "10"', dot_file.read())
+            with open(paths[-1]) as index_file:
+                self.assertEqual(index_file.read().splitlines()[1:], [
+                    "component_000;{};6;5".format(paths[0]),
+                    "small_components;{};4;2".format(paths[1])])
+
+
+if __name__ == "__main__":
+    unittest.main()